@@ -1,43 +1,60 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Request, status
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from starlette.routing import Match
+from fastapi.routing import APIRoute
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import Optional, List
 from datetime import datetime, timedelta
 from jose import JWTError, jwt
 from passlib.context import CryptContext
-from pymongo import MongoClient
+import pymongo
+from pymongo import MongoClient, ReturnDocument, ReplaceOne, UpdateOne, ASCENDING, DESCENDING, HASHED
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, PyMongoError
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
 import os
+import sys
+import asyncio
+import anyio
+import functools
+import math
+import time
 from dotenv import load_dotenv
 import requests
 import uuid
 from bson import ObjectId
 import json
+import logging
+import zlib
+import gzip
+import hashlib
+import struct
+import random
+import signal
+import threading
+from contextvars import Context, ContextVar
+from bisect import bisect_right
+from collections import defaultdict
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="FitTracker API", version="1.0.0")
+logger = logging.getLogger("fittracker")
 
-# CORS middleware - Updated for Vercel
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=[
-        "https://*.vercel.app",
-        "https://*.vercel.com",
-        "http://localhost:3000",
-        "*"  # For Vercel deployment
-    ],
-    allow_credentials=True,
-    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["*"],
-)
+app = FastAPI(title="FitTracker API", version="1.0.0")
 
 # Security
 security = HTTPBearer()
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# MongoDB connection - Updated for MongoDB Atlas
+# Fail fast instead of queueing behind an unreachable server; request deadlines
+# bound each operation further
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "2000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000"))
+
+# MongoDB connection - created lazily so every worker process opens its own client
 mongo_url = os.getenv("MONGO_URL", "mongodb://localhost:27017/fittracker")
 client = None
 db = None
@@ -45,18 +62,262 @@ db = None
 def get_database():
     global client, db
     if client is None:
-        client = MongoClient(mongo_url)
+        client = MongoClient(mongo_url, connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+                             serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS)
         db = client.fittracker
     return db
 
+def reset_database():
+    """Forget a client inherited through fork; MongoClient is not fork-safe"""
+    global client, db
+    client = None
+    db = None
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_database)
+
+# Serverless functions (Vercel) only run while handling a request, so nothing can
+# rely on background tasks there: the job outbox is drained before each response
+# completes, and the retention scheduler and change stream watcher stay off
+SERVERLESS = os.getenv("SERVERLESS", "true" if os.getenv("VERCEL") else "false").lower() == "true"
+
+# Number of stored foods loaded into the nutrient cache at startup
+FOOD_CACHE_WARMUP = int(os.getenv("FOOD_CACHE_WARMUP", "1000"))
+
+# Wrap multi-document writes in transactions (requires a replica set). Without them
+# a write and its follow-up (the user_weight job, the lookup claims) land separately:
+# a crash in between leaves the first without the second until a retry repeats it
+MONGO_TRANSACTIONS = os.getenv("MONGO_TRANSACTIONS", "false").lower() == "true"
+
+# Read routing for history/analytics queries, e.g. "secondaryPreferred".
+# Max staleness must be at least 90 seconds and only applies to non-primary modes.
+MONGO_HISTORY_READ_PREFERENCE = os.getenv("MONGO_HISTORY_READ_PREFERENCE", "primary")
+MONGO_MAX_STALENESS_SECONDS = int(os.getenv("MONGO_MAX_STALENESS_SECONDS", "-1"))
+MONGO_QUERY_HINTS = os.getenv("MONGO_QUERY_HINTS", "true").lower() == "true"
+
+# Cross-instance cache invalidation through change streams (requires a replica set).
+# Per-worker user caching is only enabled along with it.
+CHANGE_STREAMS_ENABLED = os.getenv("CHANGE_STREAMS_ENABLED", "false").lower() == "true" and not SERVERLESS
+USER_CACHE_SECONDS = int(os.getenv("USER_CACHE_SECONDS", "300"))
+CHANGE_STREAM_HISTORY_LOST = 286
+
+# Sharding: per-user collections are sharded on hashed user_id so every per-user
+# query targets one shard. Usernames and emails resolve to a user_id through
+# `user_lookup`, sharded on its _id. foods, job_outbox, scheduler_locks, retention_state and
+# token_denylist stay unsharded.
+SHARD_KEYS = {
+    "users": {"user_id": "hashed"},
+    "user_lookup": {"_id": "hashed"},
+    "food_entries": {"user_id": "hashed"},
+    "weight_entries": {"user_id": "hashed"},
+    "saved_meals": {"user_id": "hashed"},
+    "food_suggestions": {"user_id": "hashed"},
+    "goal_history": {"user_id": "hashed"},
+    "daily_rollups": {"user_id": "hashed"}
+}
+# Resolve users missing from user_lookup with a users query and backfill them.
+# Turn off once shard_setup.py has backfilled the lookup collection.
+USER_LOOKUP_FALLBACK = os.getenv("USER_LOOKUP_FALLBACK", "true").lower() == "true"
+
 # JWT configuration
 SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-super-secret-jwt-key-here")
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+TOKEN_DENYLIST_REDIS_URL = os.getenv("TOKEN_DENYLIST_REDIS_URL")
+# Event streams authenticate with a query parameter, so they get a single-use
+# ticket instead of the access token, which would end up in access logs
+STREAM_TICKET_SECONDS = 30
 
 # USDA API configuration
 USDA_API_KEY = os.getenv("USDA_API_KEY")
-USDA_BASE_URL = "https://api.nal.usda.gov/fdc/v1"
+USDA_BASE_URL = os.getenv("USDA_BASE_URL", "https://api.nal.usda.gov/fdc/v1")
+USDA_BATCH_SIZE = 20  # FDC caps multi-id /foods lookups at 20 ids
+USDA_BATCH_WINDOW_SECONDS = float(os.getenv("USDA_BATCH_WINDOW_SECONDS", "0.01"))
+USDA_TIMEOUT_SECONDS = float(os.getenv("USDA_TIMEOUT_SECONDS", "5"))
+
+# Nutrient normalization: FDC nutrient ids compiled into a fixed vector layout.
+# The layout is append-only: stored vectors are zero-padded when it grows.
+NUTRIENT_FIELDS = (
+    "calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium",
+    "added_sugar", "saturated_fat", "trans_fat", "monounsaturated_fat", "polyunsaturated_fat", "cholesterol",
+    "potassium", "calcium", "iron", "magnesium", "phosphorus", "zinc",
+    "vitamin_a", "vitamin_c", "vitamin_d", "vitamin_e", "vitamin_k",
+    "thiamin", "riboflavin", "niacin", "vitamin_b6", "folate", "vitamin_b12"
+)
+NUTRIENT_SOURCES = {
+    # field: (target unit, FDC nutrient ids in order of preference)
+    "calories": ("kcal", (1008, 2047, 2048, 1062)),
+    "protein": ("g", (1003,)),
+    "carbs": ("g", (1005, 1050)),
+    "fat": ("g", (1004, 1085)),
+    "fiber": ("g", (1079,)),
+    "sugar": ("g", (2000, 1063)),
+    "sodium": ("mg", (1093,)),
+    "added_sugar": ("g", (1235,)),
+    "saturated_fat": ("g", (1258,)),
+    "trans_fat": ("g", (1257,)),
+    "monounsaturated_fat": ("g", (1292,)),
+    "polyunsaturated_fat": ("g", (1293,)),
+    "cholesterol": ("mg", (1253,)),
+    "potassium": ("mg", (1092,)),
+    "calcium": ("mg", (1087,)),
+    "iron": ("mg", (1089,)),
+    "magnesium": ("mg", (1090,)),
+    "phosphorus": ("mg", (1091,)),
+    "zinc": ("mg", (1095,)),
+    "vitamin_a": ("ug", (1106,)),  # RAE; the IU variants cannot be converted without the source
+    "vitamin_c": ("mg", (1162,)),
+    "vitamin_d": ("ug", (1114,)),
+    "vitamin_e": ("mg", (1109,)),
+    "vitamin_k": ("ug", (1185,)),
+    "thiamin": ("mg", (1165,)),
+    "riboflavin": ("mg", (1166,)),
+    "niacin": ("mg", (1167,)),
+    "vitamin_b6": ("mg", (1175,)),
+    "folate": ("ug", (1190, 1177)),
+    "vitamin_b12": ("ug", (1178,))
+}
+# Shown on search results and kept as plain fields on food entries
+SUMMARY_NUTRIENT_FIELDS = NUTRIENT_FIELDS[:7]
+# Food entries carry the full vector packed as little-endian float32
+NUTRIENT_VECTOR_FORMAT = f"<{len(NUTRIENT_FIELDS)}f"
+NUTRIENT_VECTOR_BYTES = struct.calcsize(NUTRIENT_VECTOR_FORMAT)
+NUTRIENT_ID_INDEX = {
+    nutrient_id: (slot, rank, NUTRIENT_SOURCES[field][0])
+    for slot, field in enumerate(NUTRIENT_FIELDS)
+    for rank, nutrient_id in enumerate(NUTRIENT_SOURCES[field][1])
+}
+NUTRIENT_UNIT_SCALE = {"kcal": 1, "kj": 1 / 4.184, "g": 1, "mg": 1e-3, "ug": 1e-6, "\u00b5g": 1e-6}
+SERVING_UNIT_GRAMS = {
+    "g": 1, "gm": 1, "grm": 1, "kg": 1000, "mg": 0.001,
+    "oz": 28.3495, "onz": 28.3495, "lb": 453.592,
+    # Volumes assume a density of water unless the food has its own portions
+    "ml": 1, "mlt": 1, "l": 1000, "fl oz": 29.5735,
+    "cup": 240, "tbsp": 15, "tsp": 5
+}
+food_nutrient_cache = {}
+
+FOOD_SUGGESTION_LIMIT = int(os.getenv("FOOD_SUGGESTION_LIMIT", "50"))
+FOOD_SUGGESTION_HALF_LIFE_DAYS = float(os.getenv("FOOD_SUGGESTION_HALF_LIFE_DAYS", "14"))
+FOOD_SUGGESTION_EPOCH = datetime(2024, 1, 1)
+FOOD_SUGGESTION_APPLIED_IDS = 200  # entry ids remembered per user so replayed jobs are skipped
+food_suggestion_cache = {}
+food_suggestion_cache_ids = {}  # food_suggestions _id -> user_id, for change stream invalidation
+
+# Meal planning: candidates are the user's recent foods plus the most recently
+# fetched foods from the local store, whose macro matrix is cached per worker
+MEAL_PLAN_POOL_SIZE = int(os.getenv("MEAL_PLAN_POOL_SIZE", "300"))
+MEAL_PLAN_POOL_TTL_SECONDS = int(os.getenv("MEAL_PLAN_POOL_TTL_SECONDS", "600"))
+MEAL_PLAN_MAX_SERVINGS = 3
+MEAL_PLAN_SERVING_STEP = 0.25
+MEAL_PLAN_ITERATIONS = 300
+MEAL_PLAN_SPARSITY = 0.005  # per-serving penalty that keeps plans to a few foods
+MACRO_FIELDS = NUTRIENT_FIELDS[:4]
+meal_plan_pool = {"loaded_at": None, "foods": [], "matrix": None}
+compaction_watermark = {"loaded_at": None, "date": None}
+
+# Background jobs: secondary writes deferred through a Mongo-backed outbox
+JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", "200"))
+JOB_BATCH_WINDOW_SECONDS = float(os.getenv("JOB_BATCH_WINDOW_SECONDS", "0.05"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+# Response compression: minimum body size in bytes before a route's responses are compressed
+COMPRESSION_MINIMUM_SIZE = int(os.getenv("COMPRESSION_MINIMUM_SIZE", "1024"))
+COMPRESSION_THRESHOLDS = {
+    "/api/weight-entries": 512,
+    "/api/food-entries": 512,
+    "/api/meals": 512
+}
+COMPRESSION_GZIP_LEVEL = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; totals fall back to pure Python sums
+    np = None
+
+try:
+    import msgspec
+except ImportError:  # msgspec is optional; bodies fall back to pydantic's JSON validation
+    msgspec = None
+
+# Push channel for dashboard updates. Without EVENTS_REDIS_URL events only reach
+# streams in the publishing process, so more than one worker requires it
+# (gunicorn.conf.py turns streams off otherwise). Streams hold a connection open,
+# which serverless functions cannot do.
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() == "true" and not SERVERLESS
+EVENTS_REDIS_URL = os.getenv("EVENTS_REDIS_URL")
+EVENTS_CHANNEL = "fittracker:events"
+EVENT_QUEUE_SIZE = 100
+EVENT_KEEPALIVE_SECONDS = 25
+
+# Data retention: raw entries older than RETENTION_DAYS are archived and compacted
+# into per-day rollups. 0 keeps raw entries forever.
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+# Serverless filesystems are read-only apart from a throwaway /tmp, so archiving
+# there needs an explicit, durable location
+RETENTION_ARCHIVE_DIR = os.getenv("RETENTION_ARCHIVE_DIR") or (
+    None if SERVERLESS else os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "86400"))
+# How long a worker trusts its copy of the compaction watermark
+RETENTION_WATERMARK_SECONDS = int(os.getenv("RETENTION_WATERMARK_SECONDS", "300"))
+ROLLUP_FIELDS = NUTRIENT_FIELDS
+
+# Request deadlines and load shedding. The default budget stays under Vercel's
+# 10 s maxDuration; each priority class may use a share of the in-flight slots.
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "8"))
+MAX_INFLIGHT_REQUESTS = int(os.getenv("MAX_INFLIGHT_REQUESTS", "64"))
+PRIORITY_CLASSES = {
+    # class: (share of MAX_INFLIGHT_REQUESTS, deadline budget in seconds)
+    "critical": (1.0, REQUEST_DEADLINE_SECONDS),
+    "normal": (0.75, REQUEST_DEADLINE_SECONDS),
+    "low": (0.5, REQUEST_DEADLINE_SECONDS / 2)
+}
+ROUTE_PRIORITIES = {
+    # path prefix: class; anything else is "normal"
+    "/api/login": "critical",
+    "/api/token/refresh": "critical",
+    "/api/dashboard": "critical",
+    "/api/profile": "critical",
+    "/api/food-entries": "critical",
+    "/api/weight-entries": "critical",
+    "/api/admin": "critical",
+    "/api/foods/search": "low",
+    "/api/foods/barcode": "low",
+    "/api/meal-plan": "low",
+    "/api/nutrition-history": "low",
+    "/api/groups": "low"
+}
+DEADLINE_EXEMPT_PATHS = ("/api/events", "/api/health")  # streams and probes
+
+# Sampling profiler: comma separated user_ids allowed to use the admin endpoints.
+# Usernames can be changed through the profile, so they cannot grant access.
+ADMIN_USER_IDS = {user_id.strip() for user_id in os.getenv("ADMIN_USER_IDS", "").split(",") if user_id.strip()}
+PROFILER_MAX_SECONDS = 600
+PROFILER_MIN_INTERVAL_MS = 1
+PROFILER_MAX_DEPTH = 64
+PROFILER_MAX_STACKS = 10000  # distinct stacks kept per session; further new stacks are dropped
+
+# Rate limiting: route -> [(key type, bucket capacity, tokens refilled per second)]
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL")
+# Proxies in front of the app that append to X-Forwarded-For (Heroku's router, Vercel's edge).
+# Only the hop the nearest trusted proxy appended identifies the client; earlier ones are
+# whatever the client sent. 0 ignores the header and uses the socket address.
+RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1"))
+RATE_LIMIT_POLICIES = {
+    "/api/login": [("ip", 10, 10 / 60)],
+    "/api/register": [("ip", 5, 5 / 3600)],
+    "/api/token/refresh": [("ip", 30, 0.5)],
+    "/api/foods/search": [("user", 20, 1), ("ip", 60, 2)]
+}
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -114,17 +375,122 @@ class FoodEntry(BaseModel):
     carbs: float
     fat: float
     date: str
+    serving_unit: Optional[str] = None  # when set, servings is an amount in this unit
     timestamp: datetime = Field(default_factory=datetime.now)
 
 class WeightEntry(BaseModel):
     user_id: str
     weight: float
     date: str
+    entry_id: Optional[str] = None  # client-generated ids make retries idempotent
     timestamp: datetime = Field(default_factory=datetime.now)
 
 class Token(BaseModel):
     access_token: str
     token_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class MealIngredient(BaseModel):
+    food_id: str
+    food_name: str
+    servings: float
+    calories: float  # per serving of the food
+    protein: float
+    carbs: float
+    fat: float
+
+class SavedMeal(BaseModel):
+    name: str
+    servings: float = 1  # how many servings the recipe yields
+    ingredients: List[MealIngredient]
+
+class SavedMealUpdate(BaseModel):
+    name: Optional[str] = None
+    servings: Optional[float] = None
+    ingredients: Optional[List[MealIngredient]] = None
+
+class MealLog(BaseModel):
+    meal_type: str  # breakfast, lunch, dinner, snack
+    date: str
+    servings: float = 1
+
+class GroupCreate(BaseModel):
+    name: str
+    usernames: List[str] = []  # invited; each one joins by accepting
+
+class GroupInvite(BaseModel):
+    usernames: List[str]
+
+class ProfilerStart(BaseModel):
+    duration_seconds: float = 30
+    percent: float = 100  # share of requests to sample
+    interval_ms: float = 10
+
+# Fast body decoding for high-volume endpoints: validated straight from request
+# bytes into plain dicts, without building pydantic models and copying them out
+def fast_struct(model):
+    """A msgspec Struct with the fields, types and defaults of a pydantic model"""
+    fields = []
+    for name, field in model.model_fields.items():
+        if field.is_required():
+            fields.append((name, field.annotation))
+        elif field.default_factory is not None:
+            fields.append((name, field.annotation, msgspec.field(default_factory=field.default_factory)))
+        else:
+            fields.append((name, field.annotation, field.default))
+    return msgspec.defstruct(model.__name__, fields, kw_only=True)
+
+def body_decoder(model, many=False):
+    """Dependency decoding a JSON body of `model` (or a list of them) into dicts"""
+    adapter = TypeAdapter(List[model] if many else model)
+
+    def validate(body):
+        value = adapter.validate_json(body)
+        return [item.model_dump() for item in value] if many else value.model_dump()
+
+    if msgspec is not None:
+        struct = fast_struct(model)
+        # strict=False accepts the same numeric strings pydantic's lax mode does
+        decoder = msgspec.json.Decoder(List[struct] if many else struct, strict=False)
+
+        def decode(body):
+            try:
+                value = decoder.decode(body)
+            except msgspec.MsgspecError:
+                # Rejected bodies go through pydantic again for its per-field error details
+                return validate(body)
+            return [msgspec.structs.asdict(item) for item in value] if many else msgspec.structs.asdict(value)
+    else:
+        decode = validate
+
+    async def dependency(request: Request):
+        try:
+            return decode(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])}
+                                          for error in e.errors(include_url=False)])
+
+    return dependency
+
+def body_schema(model, many=False):
+    """OpenAPI request body for endpoints that decode through body_decoder"""
+    schema = model.model_json_schema()
+    if many:
+        schema = {"type": "array", "items": schema}
+    return {"requestBody": {"required": True, "content": {"application/json": {"schema": schema}}}}
+
+def fast_json(content):
+    """Encode a response with msgspec, skipping FastAPI's jsonable_encoder pass"""
+    if msgspec is None:
+        return content
+    return Response(msgspec.json.encode(content), media_type="application/json")
+
+food_entry_body = body_decoder(FoodEntry)
+food_entries_body = body_decoder(FoodEntry, many=True)
+weight_entry_body = body_decoder(WeightEntry)
 
 # Helper functions
 def verify_password(plain_password, hashed_password):
@@ -143,7 +509,30 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+def create_refresh_token(username, user_id, family=None):
+    """Create a rotating refresh token; every token in a login session shares a family id"""
+    return create_access_token(
+        data={"sub": username, "uid": user_id, "type": "refresh", "jti": str(uuid.uuid4()),
+              "family": family or str(uuid.uuid4())},
+        expires_delta=timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+    )
+
+def create_stream_ticket(username, user_id):
+    return create_access_token(
+        data={"sub": username, "uid": user_id, "type": "stream", "jti": str(uuid.uuid4())},
+        expires_delta=timedelta(seconds=STREAM_TICKET_SECONDS)
+    )
+
+def issue_tokens(username, user_id, family=None):
+    # The uid claim lets requests load the user by shard key
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    access_token = create_access_token(
+        data={"sub": username, "uid": user_id}, expires_delta=access_token_expires
+    )
+    return {"access_token": access_token, "token_type": "bearer",
+            "refresh_token": create_refresh_token(username, user_id, family)}
+
+def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -152,13 +541,37 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     try:
         payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
-        if username is None:
+        if username is None or payload.get("type") in ("refresh", "stream"):
             raise credentials_exception
     except JWTError:
         raise credentials_exception
     
-    db = get_database()
-    user = db.users.find_one({"username": username})
+    # Tokens issued before the uid claim only carry the username
+    user_id = payload.get("uid") or find_user_id("username", username)
+    user = find_cached_user(user_id) if user_id else None
+    if user is None:
+        raise credentials_exception
+    return user
+
+def get_admin_user(current_user: dict = Depends(get_current_user)):
+    if current_user["user_id"] not in ADMIN_USER_IDS:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return current_user
+
+async def get_current_user_from_ticket(ticket: str):
+    """Authenticate clients such as EventSource that cannot send an Authorization header"""
+    credentials_exception = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
+                                          detail="Invalid stream ticket")
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("type") != "stream" or not payload.get("uid"):
+        raise credentials_exception
+    # Single use, so a ticket copied from a log or a proxy cannot open another stream
+    if not await token_denylist.claim(f"jti:{payload['jti']}", STREAM_TICKET_SECONDS):
+        raise credentials_exception
+    user = await asyncio.to_thread(find_cached_user, payload["uid"])
     if user is None:
         raise credentials_exception
     return user
@@ -214,318 +627,2978 @@ def calculate_daily_goals(user_data):
         "daily_fat_goal": round(daily_fat, 1)
     }
 
-# Authentication endpoints
-@app.post("/api/register", response_model=Token)
-async def register(user: UserCreate):
-    db = get_database()
-    # Check if user already exists
-    if db.users.find_one({"username": user.username}):
-        raise HTTPException(status_code=400, detail="Username already registered")
-    
-    if db.users.find_one({"email": user.email}):
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create new user
-    user_dict = user.dict()
-    user_dict["user_id"] = str(uuid.uuid4())
-    user_dict["password"] = get_password_hash(user.password)
-    user_dict["created_at"] = datetime.now()
-    
-    # Calculate daily goals
-    goals = calculate_daily_goals(user_dict)
-    user_dict.update(goals)
-    
-    db.users.insert_one(user_dict)
-    
-    # Create initial weight entry if weight was provided
-    if user.weight:
-        weight_entry = {
-            "entry_id": str(uuid.uuid4()),
-            "user_id": user_dict["user_id"],
-            "weight": user.weight,
-            "date": datetime.now().strftime("%Y-%m-%d"),
-            "timestamp": datetime.now()
-        }
-        db.weight_entries.insert_one(weight_entry)
-    
-    # Create access token
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+def calculate_meal_nutrition(ingredients, servings):
+    """Aggregate ingredient nutrition into per-serving totals for a saved meal"""
+    totals = {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
+    for ingredient in ingredients:
+        for key in totals:
+            totals[key] += ingredient[key] * ingredient["servings"]
 
-@app.post("/api/login", response_model=Token)
-async def login(user: UserLogin):
-    db = get_database()
-    db_user = db.users.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["password"]):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Incorrect username or password",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-    
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
-    
-    return {"access_token": access_token, "token_type": "bearer"}
+    servings = servings or 1
+    return {key: round(value / servings, 2) for key, value in totals.items()}
 
-# User profile endpoints
-@app.get("/api/profile", response_model=UserProfile)
-async def get_profile(current_user: dict = Depends(get_current_user)):
-    user_data = {
-        "user_id": current_user["user_id"],
-        "username": current_user["username"],
-        "email": current_user["email"],
-        "age": current_user.get("age"),
-        "gender": current_user.get("gender"),
-        "height": current_user.get("height"),
-        "weight": current_user.get("weight"),
-        "activity_level": current_user.get("activity_level", "sedentary"),
-        "goal": current_user.get("goal", "maintain"),
-        "daily_calorie_goal": current_user.get("daily_calorie_goal"),
-        "daily_protein_goal": current_user.get("daily_protein_goal"),
-        "daily_carb_goal": current_user.get("daily_carb_goal"),
-        "daily_fat_goal": current_user.get("daily_fat_goal")
-    }
-    return user_data
+def nutrient_vector(food_nutrients):
+    """Map FDC foodNutrients onto NUTRIENT_FIELDS order (per 100 g), converting units"""
+    vector = [0.0] * len(NUTRIENT_FIELDS)
+    ranks = [None] * len(NUTRIENT_FIELDS)
+    for nutrient in food_nutrients:
+        # Search results are flat, /food details nest the nutrient definition
+        definition = nutrient.get("nutrient", {})
+        match = NUTRIENT_ID_INDEX.get(nutrient.get("nutrientId", definition.get("id")))
+        if match is None:
+            continue
 
-@app.put("/api/profile")
-async def update_profile(profile: UserProfile, current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    update_data = profile.dict(exclude_unset=True)
-    
-    # Recalculate goals if relevant data changed
-    if any(key in update_data for key in ["age", "gender", "height", "weight", "activity_level", "goal"]):
-        updated_user_data = {**current_user, **update_data}
-        goals = calculate_daily_goals(updated_user_data)
-        update_data.update(goals)
-    
-    db.users.update_one(
-        {"user_id": current_user["user_id"]},
-        {"$set": update_data}
-    )
-    
-    return {"message": "Profile updated successfully"}
+        slot, rank, unit = match
+        value = nutrient.get("value", nutrient.get("amount"))
+        if value is None or (ranks[slot] is not None and ranks[slot] <= rank):
+            continue
 
-# Food search endpoints
-@app.get("/api/foods/search")
-async def search_foods(query: str, current_user: dict = Depends(get_current_user)):
-    if not USDA_API_KEY:
-        # Mock data for demonstration
-        return {
-            "foods": [
-                {
-                    "fdcId": "123456",
-                    "description": "Banana, raw",
-                    "brandName": "",
-                    "servingSize": 100,
-                    "servingUnit": "g",
-                    "calories": 89,
-                    "protein": 1.1,
-                    "carbs": 22.8,
-                    "fat": 0.3,
-                    "fiber": 2.6,
-                    "sugar": 12.2,
-                    "sodium": 1
-                },
-                {
-                    "fdcId": "789012",
-                    "description": "Apple, raw",
-                    "brandName": "",
-                    "servingSize": 100,
-                    "servingUnit": "g",
-                    "calories": 52,
-                    "protein": 0.3,
-                    "carbs": 13.8,
-                    "fat": 0.2,
-                    "fiber": 2.4,
-                    "sugar": 10.4,
-                    "sodium": 1
-                }
-            ]
-        }
-    
-    try:
-        response = requests.get(
-            f"{USDA_BASE_URL}/foods/search",
-            params={
-                "query": query,
-                "api_key": USDA_API_KEY,
-                "dataType": ["Branded", "Foundation", "SR Legacy"],
-                "pageSize": 20
-            }
-        )
-        
-        if response.status_code == 200:
-            data = response.json()
-            foods = []
-            
-            for food in data.get("foods", []):
-                # Extract nutrition data
-                nutrients = {n["nutrientName"]: n["value"] for n in food.get("foodNutrients", [])}
-                
-                food_item = {
-                    "fdcId": food["fdcId"],
-                    "description": food["description"],
-                    "brandName": food.get("brandName", ""),
-                    "servingSize": food.get("servingSize", 100),
-                    "servingUnit": food.get("servingSizeUnit", "g"),
-                    "calories": nutrients.get("Energy", 0),
-                    "protein": nutrients.get("Protein", 0),
-                    "carbs": nutrients.get("Carbohydrate, by difference", 0),
-                    "fat": nutrients.get("Total lipid (fat)", 0),
-                    "fiber": nutrients.get("Fiber, total dietary", 0),
-                    "sugar": nutrients.get("Sugars, total including NLEA", 0),
-                    "sodium": nutrients.get("Sodium, Na", 0)
-                }
-                foods.append(food_item)
-            
-            return {"foods": foods}
-        else:
-            raise HTTPException(status_code=500, detail="Failed to fetch food data")
-            
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error searching foods: {str(e)}")
+        from_unit = (nutrient.get("unitName") or definition.get("unitName") or unit).lower()
+        scale = NUTRIENT_UNIT_SCALE.get(from_unit, 1) / NUTRIENT_UNIT_SCALE[unit]
+        vector[slot] = value * scale
+        ranks[slot] = rank
+    return vector
 
-# Food logging endpoints
-@app.post("/api/food-entries")
-async def log_food(entry: FoodEntry, current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    entry_dict = entry.dict()
-    entry_dict["entry_id"] = str(uuid.uuid4())
-    entry_dict["user_id"] = current_user["user_id"]
-    
-    db.food_entries.insert_one(entry_dict)
-    return {"message": "Food logged successfully", "entry_id": entry_dict["entry_id"]}
+def pad_nutrients(vector):
+    """Extend a vector stored under an older, shorter layout with zeros"""
+    return list(vector) + [0.0] * (len(NUTRIENT_FIELDS) - len(vector))
 
-@app.get("/api/food-entries")
-async def get_food_entries(date: str, current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    entries = list(db.food_entries.find(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
-    ))
-    
-    # Group by meal type
-    grouped_entries = {
-        "breakfast": [],
-        "lunch": [],
-        "dinner": [],
-        "snack": []
+def pack_nutrients(vector):
+    return struct.pack(NUTRIENT_VECTOR_FORMAT, *pad_nutrients(vector))
+
+def entry_nutrients(entry):
+    """Packed nutrient vector of a food entry; older entries only have plain fields"""
+    packed = entry.get("nutrients")
+    if packed is None:
+        return pack_nutrients([entry.get(field) or 0 for field in SUMMARY_NUTRIENT_FIELDS])
+    return bytes(packed).ljust(NUTRIENT_VECTOR_BYTES, b"\0")
+
+def nutrient_totals(totals):
+    return {field: round(float(value), 2) for field, value in zip(NUTRIENT_FIELDS, totals)}
+
+def sum_nutrients(entries):
+    """Total the nutrient vectors of food entries as {field: value}"""
+    packed = b"".join(entry_nutrients(entry) for entry in entries)
+    if np is None:
+        columns = zip(*struct.iter_unpack(NUTRIENT_VECTOR_FORMAT, packed))
+        return nutrient_totals([math.fsum(column) for column in columns] or [0.0] * len(NUTRIENT_FIELDS))
+
+    matrix = np.frombuffer(packed, dtype="<f4").reshape(-1, len(NUTRIENT_FIELDS))
+    return nutrient_totals(matrix.sum(axis=0, dtype=np.float64))
+
+def sum_nutrients_by_date(entries):
+    """Nutrient totals and entry counts per date for food entries sorted by date"""
+    starts = [i for i, entry in enumerate(entries) if i == 0 or entry["date"] != entries[i - 1]["date"]]
+    ends = starts[1:] + [len(entries)]
+    if np is None or not entries:
+        return {entries[start]["date"]: (sum_nutrients(entries[start:end]), end - start)
+                for start, end in zip(starts, ends)}
+
+    packed = b"".join(entry_nutrients(entry) for entry in entries)
+    matrix = np.frombuffer(packed, dtype="<f4").reshape(-1, len(NUTRIENT_FIELDS))
+    sums = np.add.reduceat(matrix, starts, axis=0, dtype=np.float64)
+    return {entries[start]["date"]: (nutrient_totals(row), end - start)
+            for start, end, row in zip(starts, ends, sums)}
+
+def portion_grams(food):
+    """Collect household measures (cup, slice, ...) as grams per unit from FDC portions"""
+    portions = {}
+    for portion in food.get("foodPortions", []):
+        if not portion.get("gramWeight"):
+            continue
+        unit = portion.get("measureUnit", {}).get("name", "undetermined")
+        if unit == "undetermined":
+            unit = portion.get("modifier") or portion.get("portionDescription") or ""
+        if unit:
+            portions[unit.strip().lower()] = portion["gramWeight"] / (portion.get("amount") or 1)
+
+    for measure in food.get("foodMeasures", []):
+        text = (measure.get("disseminationText") or "").strip()
+        if not text or not measure.get("gramWeight"):
+            continue
+        amount, _, unit = text.partition(" ")
+        try:
+            amount = float(amount)
+        except ValueError:
+            amount, unit = 1, text
+        if unit and amount:
+            portions.setdefault(unit.strip().lower(), measure["gramWeight"] / amount)
+    return portions
+
+def to_grams(amount, unit, portions=None):
+    """Convert an amount in a serving unit to grams, or None if the unit is unknown"""
+    unit = unit.strip().lower()
+    if portions and unit in portions:
+        return amount * portions[unit]
+    if unit in SERVING_UNIT_GRAMS:
+        return amount * SERVING_UNIT_GRAMS[unit]
+    return None
+
+def cache_food_profile(food_id, nutrients_per_100g, serving_grams, portions=None):
+    food_nutrient_cache[str(food_id)] = {
+        "nutrients": pad_nutrients(nutrients_per_100g),
+        "serving_grams": serving_grams,
+        "portions": portions or {}
     }
-    
-    total_nutrition = {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
-    
-    for entry in entries:
-        meal_type = entry["meal_type"]
-        if meal_type in grouped_entries:
-            grouped_entries[meal_type].append(entry)
-            
-            # Add to totals
-            total_nutrition["calories"] += entry["calories"]
-            total_nutrition["protein"] += entry["protein"]
-            total_nutrition["carbs"] += entry["carbs"]
-            total_nutrition["fat"] += entry["fat"]
-    
-    return {
-        "entries": grouped_entries,
-        "total_nutrition": total_nutrition
+
+def fdc_food_profile(food):
+    """Nutrients per 100 g, listed serving, serving weight and portions of an FDC food"""
+    per_100g = nutrient_vector(food.get("foodNutrients", []))
+    serving_size = food.get("servingSize") or 100
+    serving_unit = food.get("servingSizeUnit") or "g"
+    portions = portion_grams(food)
+    serving_grams = to_grams(serving_size, serving_unit, portions) or 100
+    return per_100g, serving_size, serving_unit, serving_grams, portions
+
+def normalize_fdc_food(food):
+    """Turn an FDC food into a search result with per-serving values and cache its nutrient vector"""
+    per_100g, serving_size, serving_unit, serving_grams, portions = fdc_food_profile(food)
+    cache_food_profile(food["fdcId"], per_100g, serving_grams, portions)
+
+    food_item = {
+        "fdcId": food["fdcId"],
+        "description": food["description"],
+        "brandName": food.get("brandName", ""),
+        "servingSize": serving_size,
+        "servingUnit": serving_unit
     }
+    for field, value in zip(SUMMARY_NUTRIENT_FIELDS, per_100g):
+        food_item[field] = round(value * serving_grams / 100, 2)
+    return food_item
 
-@app.delete("/api/food-entries/{entry_id}")
-async def delete_food_entry(entry_id: str, current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    result = db.food_entries.delete_one({
-        "entry_id": entry_id,
-        "user_id": current_user["user_id"]
-    })
-    
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Food entry not found")
-    
-    return {"message": "Food entry deleted successfully"}
+def cache_food_item(food_item):
+    """Cache the nutrient vector of an already shaped per-serving search result"""
+    serving_grams = to_grams(food_item["servingSize"], food_item["servingUnit"]) or 100
+    per_100g = [food_item.get(field, 0) * 100 / serving_grams for field in SUMMARY_NUTRIENT_FIELDS]
+    cache_food_profile(food_item["fdcId"], per_100g, serving_grams)
 
-# Weight tracking endpoints
-@app.post("/api/weight-entries")
-async def log_weight(entry: WeightEntry, current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    entry_dict = entry.dict()
-    entry_dict["entry_id"] = str(uuid.uuid4())
-    entry_dict["user_id"] = current_user["user_id"]
-    
-    # Update user's current weight
-    db.users.update_one(
-        {"user_id": current_user["user_id"]},
-        {"$set": {"weight": entry.weight}}
-    )
-    
-    db.weight_entries.insert_one(entry_dict)
-    return {"message": "Weight logged successfully", "entry_id": entry_dict["entry_id"]}
+def compute_entries_nutrition(entries):
+    """Fill nutrition for a batch of entries from cached per-food nutrient vectors.
 
-@app.get("/api/weight-entries")
-async def get_weight_entries(current_user: dict = Depends(get_current_user)):
-    db = get_database()
-    entries = list(db.weight_entries.find(
-        {"user_id": current_user["user_id"]},
-        {"_id": 0}
-    ).sort("timestamp", -1).limit(30))
-    
-    return {"entries": entries}
+    Entries for foods we have never seen keep the client's values and are
+    flagged as unverified.
+    """
+    profiles = {}
+    for food_id in {str(entry["food_id"]) for entry in entries}:
+        profiles[food_id] = food_nutrient_cache.get(food_id)
 
-# Dashboard/summary endpoints
-@app.get("/api/dashboard")
-async def get_dashboard(date: str, current_user: dict = Depends(get_current_user)):
+    # Fall back to the persistent food store in a single read
+    missing = [food_id for food_id, profile in profiles.items() if profile is None]
     db = get_database()
-    # Get today's food entries
-    entries = list(db.food_entries.find(
-        {"user_id": current_user["user_id"], "date": date},
-        {"_id": 0}
-    ))
+    if missing:
+        for doc in db.foods.find({"fdc_id": {"$in": missing}},
+                                 {"_id": 0, "fdc_id": 1, "nutrients": 1, "serving_grams": 1, "portions": 1}):
+            profiles[doc["fdc_id"]] = cache_food_document(doc)
+
+    for entry in entries:
+        profile = profiles[str(entry["food_id"])]
+        if profile is None:
+            entry["nutrients"] = entry_nutrients(entry)
+            entry["verified"] = False
+            continue
+
+        if entry.get("serving_unit"):
+            grams = to_grams(entry["servings"], entry["serving_unit"], profile["portions"])
+            if grams is None:
+                raise HTTPException(status_code=400,
+                                    detail=f"Unknown serving unit: {entry['serving_unit']}")
+        else:
+            grams = entry["servings"] * profile["serving_grams"]
+
+        factor = grams / 100
+        vector = [value * factor for value in profile["nutrients"]]
+        for field, value in zip(SUMMARY_NUTRIENT_FIELDS, vector):
+            entry[field] = round(value, 2)
+        entry["nutrients"] = pack_nutrients(vector)
+        entry["grams"] = round(grams, 1)
+        entry["verified"] = True
+    return entries
+
+def verify_meal_ingredients(ingredients):
+    """Replace ingredient macros with per-serving values from cached nutrient vectors.
+
+    Ingredients of foods we have never seen keep the client's values, as
+    food entries do.
+    """
+    entries = compute_entries_nutrition([{"food_id": ingredient["food_id"], "servings": 1,
+                                          **{field: ingredient[field] for field in MACRO_FIELDS}}
+                                         for ingredient in ingredients])
+    for ingredient, entry in zip(ingredients, entries):
+        if entry["verified"]:
+            ingredient.update({field: entry[field] for field in MACRO_FIELDS})
+    return ingredients
+
+def gtin_check_digit(body):
+    """GS1 check digit for the digits of a GTIN without its check digit"""
+    total = sum(int(ch) * (3 if i % 2 == 0 else 1) for i, ch in enumerate(reversed(body)))
+    return str(-total % 10)
+
+def expand_upce(digits):
+    """Expand an 8 digit UPC-E code to its 12 digit UPC-A form, or None if it is not one"""
+    if digits[0] not in "01":
+        return None
+    ns, d, check = digits[0], digits[1:7], digits[7]
+    if d[5] in "012":
+        body = ns + d[0:2] + d[5] + "0000" + d[2:5]
+    elif d[5] == "3":
+        body = ns + d[0:3] + "00000" + d[3:5]
+    elif d[5] == "4":
+        body = ns + d[0:4] + "00000" + d[4]
+    else:
+        body = ns + d[0:5] + "0000" + d[5]
+    # EAN-8 codes can start with 0 or 1 too, the check digit tells them apart
+    return body + check if gtin_check_digit(body) == check else None
+
+def normalize_gtin(code):
+    """Normalize UPC-E, EAN-8, UPC-A, EAN-13 and GTIN-14 codes to one 14 digit key, or None"""
+    digits = "".join(ch for ch in str(code or "") if ch.isdigit())
+    if not 8 <= len(digits) <= 14:
+        return None
+    if len(digits) == 8:
+        digits = expand_upce(digits) or digits
+    return digits.zfill(14)
+
+def food_document(food):
+    """Build the persistent `foods` document for an FDC food detail record"""
+    per_100g, serving_size, serving_unit, serving_grams, portions = fdc_food_profile(food)
+    return {
+        "fdc_id": str(food["fdcId"]),
+        "description": food["description"],
+        "brand_name": food.get("brandName") or food.get("brandOwner") or "",
+        "data_type": food.get("dataType"),
+        "gtin_upc": food.get("gtinUpc"),
+        "gtin": normalize_gtin(food.get("gtinUpc")),
+        "serving_size": serving_size,
+        "serving_unit": serving_unit,
+        "serving_grams": serving_grams,
+        "nutrients": per_100g,
+        # Stored as pairs since portion names may contain dots
+        "portions": sorted(portions.items()),
+        "fetched_at": datetime.now()
+    }
+
+def cache_food_document(doc):
+    cache_food_profile(doc["fdc_id"], doc["nutrients"], doc["serving_grams"], dict(doc.get("portions", [])))
+    return food_nutrient_cache[doc["fdc_id"]]
+
+def food_detail(doc):
+    """Shape a stored food like a search result, plus full per-100 g nutrients and portions"""
+    detail = {
+        "fdcId": doc["fdc_id"],
+        "description": doc["description"],
+        "brandName": doc.get("brand_name", ""),
+        "servingSize": doc["serving_size"],
+        "servingUnit": doc["serving_unit"]
+    }
+    for field, value in zip(SUMMARY_NUTRIENT_FIELDS, doc["nutrients"]):
+        detail[field] = round(value * doc["serving_grams"] / 100, 2)
+    detail["nutrientsPer100g"] = {field: round(value, 2) for field, value in zip(NUTRIENT_FIELDS, doc["nutrients"])}
+    detail["portions"] = [{"unit": unit, "gramWeight": round(grams, 2)} for unit, grams in doc.get("portions", [])]
+    return detail
+
+def fetch_fdc_foods(fdc_ids):
+    """Fetch up to USDA_BATCH_SIZE foods in one multi-id FDC call"""
+    response = requests.post(
+        f"{USDA_BASE_URL}/foods",
+        params={"api_key": USDA_API_KEY},
+        json={"fdcIds": [int(fdc_id) if fdc_id.isdigit() else fdc_id for fdc_id in fdc_ids]},
+        timeout=USDA_TIMEOUT_SECONDS
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail="Failed to fetch food data")
+    return response.json()
+
+class FoodDetailBatcher:
+    """Coalesces food detail misses from concurrent requests into batched FDC calls.
+
+    Callers asking for an id that is already queued or in flight share the
+    same future, so each food is fetched from FDC at most once at a time.
+    Fetched foods are backfilled into the `foods` collection.
+    """
+
+    def __init__(self, window=USDA_BATCH_WINDOW_SECONDS, batch_size=USDA_BATCH_SIZE):
+        self.window = window
+        self.batch_size = batch_size
+        self.futures = {}
+        self.queue = []
+        self.flush_task = None
+
+    async def get(self, fdc_id):
+        future = self.futures.get(fdc_id)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self.futures[fdc_id] = future
+            self.queue.append(fdc_id)
+            if self.flush_task is None:
+                # The batch serves many requests, so it runs outside any one request's deadline
+                self.flush_task = detached(self.flush())
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), outbound_timeout(USDA_TIMEOUT_SECONDS))
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Request deadline exceeded")
+
+    async def flush(self):
+        await asyncio.sleep(self.window)
+        queue, self.queue = self.queue, []
+        self.flush_task = None
+
+        chunks = [queue[i:i + self.batch_size] for i in range(0, len(queue), self.batch_size)]
+        await asyncio.gather(*(self.fetch(chunk) for chunk in chunks))
+
+    async def fetch(self, fdc_ids):
+        try:
+            foods = await asyncio.to_thread(fetch_fdc_foods, fdc_ids)
+            docs = {}
+            for food in foods:
+                doc = food_document(food)
+                docs[doc["fdc_id"]] = doc
+            if docs:
+                await asyncio.to_thread(store_food_documents, list(docs.values()))
+        except Exception as e:
+            for fdc_id in fdc_ids:
+                self.futures.pop(fdc_id).set_exception(e)
+            return
+
+        for fdc_id in fdc_ids:
+            self.futures.pop(fdc_id).set_result(docs.get(fdc_id))
+
+def store_food_documents(docs):
+    db = get_database()
+    db.foods.bulk_write(
+        [ReplaceOne({"fdc_id": doc["fdc_id"]}, doc, upsert=True) for doc in docs],
+        ordered=False
+    )
+
+food_detail_batcher = FoodDetailBatcher()
+
+# Barcodes FDC had no match for, so repeated scans of unknown products stay local
+BARCODE_MISS_SECONDS = 3600
+barcode_misses = {}
+
+def find_food_by_gtin(gtin):
+    """Exact barcode match against the local foods store through the hashed gtin index"""
+    db = get_database()
+    docs = list(db.foods.find({"gtin": gtin}, {"_id": 0}).sort("fetched_at", -1).limit(1))
+    return docs[0] if docs else None
+
+def gtin_search_code(gtin):
+    """The printed form of a 14 digit key: EAN-8, UPC-A or EAN-13, as FDC stores gtinUpc.
+
+    Leading zeros inside that form are significant, e.g. most UPC-A codes start with 0.
+    """
+    if gtin.startswith("000000"):
+        return gtin[-8:]
+    if gtin.startswith("00"):
+        return gtin[-12:]
+    if gtin.startswith("0"):
+        return gtin[-13:]
+    return gtin
+
+def fetch_fdc_food_by_gtin(gtin):
+    """Backfill a barcode from FDC's branded search, keeping only exact GTIN matches"""
+    response = requests.get(
+        f"{USDA_BASE_URL}/foods/search",
+        params={"query": gtin_search_code(gtin), "dataType": "Branded", "pageSize": 10, "api_key": USDA_API_KEY},
+        timeout=outbound_timeout(USDA_TIMEOUT_SECONDS)
+    )
+    if response.status_code != 200:
+        raise HTTPException(status_code=502, detail="Failed to fetch food data")
+
+    docs = [food_document(food) for food in response.json().get("foods", [])
+            if normalize_gtin(food.get("gtinUpc")) == gtin]
+    if docs:
+        store_food_documents(docs)
+    return docs[0] if docs else None
+
+def food_suggestion_weight(when):
+    """Weight of a single log event; scores only ever grow, so newer logs outrank older ones"""
+    days = (when - FOOD_SUGGESTION_EPOCH).total_seconds() / 86400
+    return 2 ** (days / FOOD_SUGGESTION_HALF_LIFE_DAYS)
+
+def rank_food_suggestions(foods):
+    """Order a user's suggestion index by decayed frequency"""
+    ranked = sorted(foods.values(), key=lambda food: food["score"], reverse=True)
+    return ranked[:FOOD_SUGGESTION_LIMIT]
+
+def serving_nutrition(entry):
+    """Macros for one listed serving of an entry's food, or None if its serving size is unknown.
+
+    servings is an amount in serving_unit when that is set, so dividing the
+    entry's totals by it only works for plain serving counts.
+    """
+    profile = food_nutrient_cache.get(str(entry["food_id"]))
+    if entry.get("verified") and profile is not None:
+        return {field: value * profile["serving_grams"] / 100
+                for field, value in zip(MACRO_FIELDS, profile["nutrients"])}
+    if entry.get("serving_unit") or not entry["servings"]:
+        return None
+    return {field: entry[field] / entry["servings"] for field in MACRO_FIELDS}
+
+def record_food_suggestions(user_id, entries):
+    """Bump logged foods in the user's suggestion index, pruning it back to the cap.
+
+    Each entry is applied at most once: the entry ids of recent updates are
+    kept on the document, so a replayed job batch only adds the entries it
+    has not already counted.
+    """
+    db = get_database()
+    for _ in range(3):
+        now = datetime.now()
+        inc = {}
+        fields = {}
+        for entry in entries:
+            key = "foods." + str(entry["food_id"]).replace(".", "_").replace("$", "_")
+            inc[f"{key}.score"] = inc.get(f"{key}.score", 0) + food_suggestion_weight(now)
+            inc[f"{key}.count"] = inc.get(f"{key}.count", 0) + 1
+            fields.update({
+                f"{key}.food_id": entry["food_id"],
+                f"{key}.food_name": entry["food_name"],
+                **{f"{key}.{field}": entry[field] for field in MACRO_FIELDS},
+                f"{key}.last_used": now
+            })
+        entry_ids = [entry["entry_id"] for entry in entries if entry.get("entry_id")]
+
+        try:
+            doc = db.food_suggestions.find_one_and_update(
+                {"user_id": user_id, "entry_ids": {"$nin": entry_ids}},
+                {"$inc": inc, "$set": fields,
+                 "$push": {"entry_ids": {"$each": entry_ids, "$slice": -FOOD_SUGGESTION_APPLIED_IDS}}},
+                projection={"foods": 1},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+            break
+        except DuplicateKeyError:
+            # The filter missed the existing document: some entries were applied before
+            applied = db.food_suggestions.find_one({"user_id": user_id}, {"_id": 0, "entry_ids": 1}) or {}
+            applied = set(applied.get("entry_ids", []))
+            entries = [entry for entry in entries if entry.get("entry_id") not in applied]
+            if not entries:
+                return
+    else:
+        raise RuntimeError(f"Could not record food suggestions for {user_id}")
+
+    foods = doc.get("foods", {})
+
+    # Let the index overshoot a little so pruning stays amortized
+    if len(foods) > FOOD_SUGGESTION_LIMIT * 1.2:
+        ranked = sorted(foods, key=lambda k: foods[k]["score"], reverse=True)
+        stale = ranked[FOOD_SUGGESTION_LIMIT:]
+        db.food_suggestions.update_one(
+            {"user_id": user_id},
+            {"$unset": {f"foods.{k}": "" for k in stale}}
+        )
+        for k in stale:
+            foods.pop(k)
+
+    if CHANGE_STREAMS_ENABLED:
+        food_suggestion_cache[user_id] = rank_food_suggestions(foods)
+        food_suggestion_cache_ids[doc["_id"]] = user_id
+
+def get_food_suggestions(user_id, query=None):
+    """Return the user's ranked suggestions, from memory when possible.
+
+    Jobs may update them on another worker, so the per-worker cache is only
+    used while change streams keep it fresh, as for find_cached_user.
+    """
+    suggestions = food_suggestion_cache.get(user_id) if CHANGE_STREAMS_ENABLED else None
+    db = get_database()
+    if suggestions is None:
+        doc = db.food_suggestions.find_one({"user_id": user_id}, {"foods": 1})
+        suggestions = rank_food_suggestions(doc.get("foods", {}) if doc else {})
+        if CHANGE_STREAMS_ENABLED:
+            food_suggestion_cache[user_id] = suggestions
+            if doc:
+                food_suggestion_cache_ids[doc["_id"]] = user_id
+
+    if query:
+        query = query.lower()
+        suggestions = [food for food in suggestions if query in food["food_name"].lower()]
+    return suggestions
+
+def suggestion_to_food(suggestion):
+    """Shape a suggestion like a search result so the client can log it directly"""
+    return {
+        "fdcId": suggestion["food_id"],
+        "description": suggestion["food_name"],
+        "brandName": "",
+        "servingSize": 1,
+        "servingUnit": "serving",
+        "calories": round(suggestion["calories"], 2),
+        "protein": round(suggestion["protein"], 2),
+        "carbs": round(suggestion["carbs"], 2),
+        "fat": round(suggestion["fat"], 2),
+        "source": "recent"
+    }
+
+class MemoryTokenBuckets:
+    """In-process token buckets; each check is a single dict lookup and update"""
+
+    def __init__(self, max_keys=100000):
+        self.buckets = {}
+        self.max_keys = max_keys
+
+    async def take(self, key, capacity, rate, cost=1):
+        """Take `cost` tokens, returning 0 or the seconds until they are available"""
+        now = time.monotonic()
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.prune(now)
+            bucket = self.buckets[key] = [capacity, now]
+
+        tokens = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+        bucket[1] = now
+        if tokens >= cost:
+            bucket[0] = tokens - cost
+            return 0
+        bucket[0] = tokens
+        return (cost - tokens) / rate
+
+    def prune(self, now):
+        # Buckets idle long enough to have refilled carry no state worth keeping
+        idle = [key for key, (tokens, updated) in self.buckets.items() if now - updated > 3600]
+        for key in idle:
+            del self.buckets[key]
+        if len(self.buckets) >= self.max_keys:
+            # Evict the least recently used quarter instead of resetting clients mid-limit
+            oldest = sorted(self.buckets, key=lambda key: self.buckets[key][1])[:self.max_keys // 4 or 1]
+            for key in oldest:
+                del self.buckets[key]
+
+class RedisTokenBuckets:
+    """Token buckets shared across workers in any Redis-protocol server"""
+
+    SCRIPT = """
+    local capacity, rate, now, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local bucket = redis.call('HMGET', KEYS[1], 't', 'u')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated = tonumber(bucket[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = tokens - cost else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 't', tokens, 'u', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate * 1000))
+    return tostring(wait)
+    """
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.script = self.client.register_script(self.SCRIPT)
+
+    async def take(self, key, capacity, rate, cost=1):
+        wait = await self.script(keys=[f"ratelimit:{key}"], args=[capacity, rate, time.time(), cost])
+        return float(wait)
+
+class MongoDenylist:
+    """Revoked token ids in `token_denylist`, shared by every worker and instance.
+
+    Each entry is kept only until the token would have expired anyway; a TTL
+    index removes it after that.
+    """
+
+    def claim_sync(self, key, ttl):
+        now = datetime.now()
+        try:
+            # Matches only an expired entry the TTL monitor has not removed yet; a live
+            # one makes the upsert collide on _id
+            get_database().token_denylist.update_one(
+                {"_id": key, "expires_at": {"$lte": now}},
+                {"$set": {"expires_at": now + timedelta(seconds=ttl)}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            return False
+        return True
+
+    async def claim(self, key, ttl):
+        """Add a key, returning False if it was already present"""
+        return await asyncio.to_thread(self.claim_sync, key, ttl)
+
+    async def contains(self, key):
+        doc = await asyncio.to_thread(get_database().token_denylist.find_one,
+                                      {"_id": key, "expires_at": {"$gt": datetime.now()}}, {"_id": 1})
+        return doc is not None
+
+class RedisDenylist:
+    """Denylist in Redis, for deployments that already run one for rate limits or events"""
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+    async def claim(self, key, ttl):
+        return bool(await self.client.set(f"denylist:{key}", 1, ex=max(int(ttl), 1), nx=True))
+
+    async def contains(self, key):
+        return bool(await self.client.exists(f"denylist:{key}"))
+
+token_denylist = RedisDenylist(TOKEN_DENYLIST_REDIS_URL) if TOKEN_DENYLIST_REDIS_URL else MongoDenylist()
+
+rate_limit_store = RedisTokenBuckets(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else MemoryTokenBuckets()
+
+def rate_limit_identity(request: Request, key_type):
+    if key_type == "user":
+        # Only the token subject is needed, so skip the database lookup
+        auth = request.headers.get("authorization", "")
+        if auth.lower().startswith("bearer "):
+            try:
+                return "user:" + jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM])["sub"]
+            except (JWTError, KeyError):
+                pass
+        return None
+
+    host = request.client.host if request.client else "unknown"
+    if RATE_LIMIT_TRUSTED_PROXIES > 0:
+        hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if hops:
+            host = hops[max(len(hops) - RATE_LIMIT_TRUSTED_PROXIES, 0)]
+    return "ip:" + host
+
+@app.middleware("http")
+async def rate_limit(request: Request, call_next):
+    policies = RATE_LIMIT_POLICIES.get(request.url.path) if RATE_LIMIT_ENABLED else None
+    if policies and request.method != "OPTIONS":
+        for key_type, capacity, rate in policies:
+            identity = rate_limit_identity(request, key_type)
+            if identity is None:
+                continue
+            retry_after = await rate_limit_store.take(f"{request.url.path}:{identity}", capacity, rate)
+            if retry_after:
+                return JSONResponse(
+                    status_code=429,
+                    content={"detail": "Too many requests"},
+                    headers={"Retry-After": str(math.ceil(retry_after))}
+                )
+    return await call_next(request)
+
+# Database helpers
+def ensure_indexes(legacy_user_indexes=USER_LOOKUP_FALLBACK):
+    """Create the indexes the write paths rely on for uniqueness and the hot read paths"""
+    indexes = [
+        # Usernames and emails are unique through the user_lookup _id
+        ("users", [("user_id", ASCENDING)], {"unique": True}),
+        ("food_entries", [("user_id", ASCENDING), ("date", ASCENDING)], {}),
+        ("food_entries", [("user_id", ASCENDING), ("entry_id", ASCENDING)], {"unique": True}),
+        ("weight_entries", [("user_id", ASCENDING), ("timestamp", DESCENDING)], {}),
+        ("weight_entries", [("user_id", ASCENDING), ("entry_id", ASCENDING)], {"unique": True}),
+        ("saved_meals", [("user_id", ASCENDING), ("meal_id", ASCENDING)], {"unique": True}),
+        ("food_suggestions", [("user_id", ASCENDING)], {"unique": True}),
+        ("foods", [("fdc_id", ASCENDING)], {"unique": True}),
+        ("foods", [("fetched_at", DESCENDING)], {}),
+        ("foods", [("gtin", HASHED)], {}),
+        ("goal_history", [("user_id", ASCENDING), ("effective_date", ASCENDING)], {"unique": True}),
+        ("job_outbox", [("job_id", ASCENDING)], {"unique": True}),
+        ("job_outbox", [("run_after", ASCENDING)], {}),
+        ("job_outbox", [("lease", ASCENDING)], {"sparse": True}),
+        ("daily_rollups", [("user_id", ASCENDING), ("date", ASCENDING)], {"unique": True}),
+        ("token_denylist", [("expires_at", ASCENDING)], {"expireAfterSeconds": 0}),
+        ("groups", [("group_id", ASCENDING)], {"unique": True}),
+        ("groups", [("coach_id", ASCENDING)], {}),
+        ("groups", [("member_ids", ASCENDING)], {}),
+        ("groups", [("invited_ids", ASCENDING)], {})
+    ]
+    if legacy_user_indexes:
+        # Users from before user_lookup existed are only unique through these until
+        # the lookup is backfilled; shard_setup.py drops them before sharding users
+        indexes += [
+            ("users", [("username", ASCENDING)], {"unique": True}),
+            ("users", [("email", ASCENDING)], {"unique": True})
+        ]
+    if RETENTION_DAYS > 0:
+        # Compaction walks old data one date at a time
+        indexes += [
+            ("food_entries", [("date", ASCENDING)], {}),
+            ("weight_entries", [("date", ASCENDING)], {})
+        ]
+    db = get_database()
+    for collection, keys, options in indexes:
+        try:
+            db[collection].create_index(keys, **options)
+        except PyMongoError:
+            # Existing duplicates block a unique index; keep serving and surface it
+            logger.exception("Could not create index %s on %s", keys, collection)
+
+def run_transaction(callback):
+    """Run callback(session) in a transaction when enabled, otherwise with no session"""
+    if not MONGO_TRANSACTIONS:
+        return callback(None)
+    db = get_database()
+    with db.client.start_session() as session:
+        return session.with_transaction(callback)
+
+def warm_food_cache():
+    """Load the most recently fetched foods so early log_food calls verify from memory"""
+    db = get_database()
+    for doc in db.foods.find({}, {"_id": 0, "fdc_id": 1, "nutrients": 1, "serving_grams": 1, "portions": 1}
+                             ).sort("fetched_at", -1).limit(FOOD_CACHE_WARMUP):
+        cache_food_document(doc)
+
+@app.on_event("startup")
+async def warm_up():
+    # Cold starts are on the request path in serverless deployments, so indexes are
+    # created at deploy time there and the client connects on first use
+    if not MONGO_TRANSACTIONS:
+        logger.warning("MONGO_TRANSACTIONS is off: multi-document writes are not atomic")
+    if SERVERLESS:
+        return
+    # Runs in each worker after fork, so the connection pool belongs to this process
+    await asyncio.to_thread(get_database().command, "ping")
+    await asyncio.to_thread(ensure_indexes)
+    await asyncio.to_thread(warm_food_cache)
+
+# Repository: projected, index-hinted reads
+USER_PROJECTION = {"_id": 0, "password": 0}
+FOOD_ENTRY_FIELDS = (
+    "entry_id", "food_id", "food_name", "meal_type", "servings", "serving_unit",
+    "calories", "protein", "carbs", "fat", "fiber", "sugar", "sodium",
+    "date", "timestamp", "meal_id"
+)
+FOOD_ENTRY_PROJECTION = {"_id": 0, **{field: 1 for field in FOOD_ENTRY_FIELDS}}
+# Packed vectors plus the plain fields older entries were stored with
+FOOD_TOTALS_PROJECTION = {"_id": 0, "nutrients": 1, **{field: 1 for field in SUMMARY_NUTRIENT_FIELDS}}
+WEIGHT_ENTRY_FIELDS = ("entry_id", "weight", "date", "timestamp")
+WEIGHT_ENTRY_PROJECTION = {"_id": 0, **{field: 1 for field in WEIGHT_ENTRY_FIELDS}}
+FOOD_ENTRIES_BY_DATE = [("user_id", ASCENDING), ("date", ASCENDING)]
+WEIGHT_ENTRIES_BY_TIME = [("user_id", ASCENDING), ("timestamp", DESCENDING)]
+READ_PREFERENCES = {
+    "primary": Primary,
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest
+}
+
+def history_database():
+    """The database handle used for history and analytics reads.
+
+    These tolerate slightly stale data, so they can be routed to secondaries.
+    """
+    db = get_database()
+    mode = READ_PREFERENCES[MONGO_HISTORY_READ_PREFERENCE]
+    if mode is Primary:
+        return db
+    return db.client.get_database(db.name, read_preference=mode(max_staleness=MONGO_MAX_STALENESS_SECONDS))
+
+def parse_fields(fields, allowed):
+    """Validate a comma separated `fields=` selection against a response schema; None selects all"""
+    if fields is None:
+        return None
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+    if unknown or not selected:
+        raise HTTPException(status_code=400,
+                            detail=f"Unknown fields: {', '.join(unknown)}" if unknown else "No fields selected")
+    return selected
+
+def select_fields(document, fields):
+    return {field: document[field] for field in fields if field in document}
+
+# Indexes a hint named that turned out not to exist, e.g. on a deploy that skipped ensure_indexes
+missing_hint_indexes = set()
+
+def hinted_find(collection, query, projection, index, sort=None, limit=0):
+    """find() pinned to `index`, or left to the planner if that index does not exist"""
+    def run(hint):
+        cursor = collection.find(query, projection)
+        if hint:
+            cursor = cursor.hint(index)
+        if sort is not None:
+            cursor = cursor.sort(*sort)
+        return list(cursor.limit(limit))
+
+    key = (collection.name, tuple(index))
+    if not MONGO_QUERY_HINTS or key in missing_hint_indexes:
+        return run(False)
+    try:
+        return run(True)
+    except OperationFailure as e:
+        if e.code != 2 or "hint" not in str(e):
+            raise
+        logger.warning("Index %s on %s is missing; querying without the hint until restart", index, collection.name)
+        missing_hint_indexes.add(key)
+        return run(False)
+
+USER_LOOKUP_FIELDS = ("username", "email")
+
+def find_user(user_id, projection=USER_PROJECTION):
+    # The bcrypt hash is only fetched by login, which asks for it explicitly
+    db = get_database()
+    return db.users.find_one({"user_id": user_id}, projection)
+
+user_cache = {}
+user_cache_ids = {}  # users _id -> user_id, for change stream invalidation
+user_cache_generation = 0
+
+def find_cached_user(user_id):
+    """find_user through a per-worker cache that change streams keep fresh"""
+    if not CHANGE_STREAMS_ENABLED:
+        return find_user(user_id)
+    cached = user_cache.get(user_id)
+    if cached is not None and time.monotonic() - cached[0] < USER_CACHE_SECONDS:
+        return cached[1]
+
+    # Skip caching a read that raced with an invalidation
+    generation = user_cache_generation
+    user = find_user(user_id, {"password": 0})
+    if user is None:
+        return None
+    document_id = user.pop("_id")
+    if generation == user_cache_generation:
+        user_cache_ids[document_id] = user_id
+        user_cache[user_id] = (time.monotonic(), user)
+    return user
+
+def find_user_id(field, value):
+    """Resolve a username or email to a user_id with a single-shard lookup"""
+    db = get_database()
+    doc = db.user_lookup.find_one({"_id": f"{field}:{value}"})
+    if doc is not None:
+        return doc["user_id"]
+    if not USER_LOOKUP_FALLBACK:
+        return None
+
+    # Users created before user_lookup existed; this query is not shard-targeted
+    user = db.users.find_one({field: value}, {"_id": 0, "user_id": 1, "username": 1, "email": 1})
+    if user is None:
+        return None
+    for lookup_field in USER_LOOKUP_FIELDS:
+        try:
+            db.user_lookup.update_one({"_id": f"{lookup_field}:{user[lookup_field]}"},
+                                      {"$setOnInsert": {"user_id": user["user_id"]}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+    return user["user_id"]
+
+def find_user_by_username(username, projection=USER_PROJECTION):
+    user_id = find_user_id("username", username)
+    return find_user(user_id, projection) if user_id else None
+
+def reserve_user_keys(user_id, fields, session=None):
+    """Claim the username and email in `fields` for a user in one write; a taken one is a 400.
+
+    Returns the claimed keys so callers can release them if a later step fails.
+    """
+    db = get_database()
+    keys = [(field, f"{field}:{fields[field]}") for field in USER_LOOKUP_FIELDS if field in fields]
+    if not keys:
+        return []
+    try:
+        db.user_lookup.insert_many([{"_id": key, "user_id": user_id} for _, key in keys],
+                                   ordered=False, session=session)
+    except BulkWriteError as e:
+        failed = {error["index"] for error in e.details["writeErrors"]}
+        # A failed write aborts a transaction by itself
+        if session is None:
+            release_user_keys(user_id, [key for i, (_, key) in enumerate(keys) if i not in failed])
+        taken = [keys[error["index"]][0] for error in e.details["writeErrors"] if error["code"] == 11000]
+        if len(taken) < len(failed):
+            raise
+        field = min(taken, key=USER_LOOKUP_FIELDS.index)
+        raise HTTPException(status_code=400, detail=f"{field.capitalize()} already registered")
+
+    if USER_LOOKUP_FALLBACK:
+        # Users created before user_lookup existed may hold a value without a lookup entry
+        legacy = db.users.find_one(
+            {"$or": [{field: fields[field]} for field, _ in keys], "user_id": {"$ne": user_id}},
+            {"_id": 0, **{field: 1 for field, _ in keys}}, session=session
+        )
+        if legacy is not None:
+            if session is None:
+                release_user_keys(user_id, [key for _, key in keys])
+            field = next(field for field, _ in keys if legacy.get(field) == fields[field])
+            raise HTTPException(status_code=400, detail=f"{field.capitalize()} already registered")
+    return [key for _, key in keys]
+
+def release_user_keys(user_id, keys, session=None):
+    db = get_database()
+    if keys:
+        db.user_lookup.delete_many({"_id": {"$in": keys}, "user_id": user_id}, session=session)
+
+def find_food_entries(user_id, date, projection=FOOD_ENTRY_PROJECTION):
+    db = get_database()
+    return hinted_find(db.food_entries, {"user_id": user_id, "date": date}, projection, FOOD_ENTRIES_BY_DATE)
+
+def find_weight_history(user_id, limit=30, projection=WEIGHT_ENTRY_PROJECTION):
+    return hinted_find(history_database().weight_entries, {"user_id": user_id}, projection,
+                       WEIGHT_ENTRIES_BY_TIME, sort=("timestamp", -1), limit=limit)
+
+def find_latest_weight(user_id, projection=WEIGHT_ENTRY_PROJECTION):
+    db = get_database()
+    entries = hinted_find(db.weight_entries, {"user_id": user_id}, projection,
+                          WEIGHT_ENTRIES_BY_TIME, sort=("timestamp", -1), limit=1)
+    if not entries and compacted_before() is not None:
+        # Every raw entry may already be compacted
+        entries = find_rollup_weights(user_id)
+    return entries[0] if entries else None
+
+# Goal history: one version per user per day the goal inputs changed
+GOAL_FIELDS = ("daily_calorie_goal", "daily_protein_goal", "daily_carb_goal", "daily_fat_goal")
+GOAL_INPUT_FIELDS = ("age", "gender", "height", "weight", "activity_level", "goal")
+DEFAULT_GOALS = {"daily_calorie_goal": 2000, "daily_protein_goal": 150,
+                 "daily_carb_goal": 250, "daily_fat_goal": 67}
+# Seed date for users created before created_at was recorded
+GOAL_HISTORY_EPOCH = datetime(2000, 1, 1)
+
+def user_goals(user):
+    return {field: user.get(field) or DEFAULT_GOALS[field] for field in GOAL_FIELDS}
+
+def goal_version_write(user_id, goals, when):
+    """Upsert the goal version in effect from `when`'s date; later changes that day win"""
+    return UpdateOne(
+        {"user_id": user_id, "effective_date": when.strftime("%Y-%m-%d")},
+        {"$set": {**{field: goals[field] for field in GOAL_FIELDS}, "effective_at": when}},
+        upsert=True
+    )
+
+def goal_seed_write(user_id, goals, when):
+    """Record goals from `when`'s date only if that day has no version yet.
+
+    Used for starting goals, which must never overwrite a later change made
+    the same day, including when the job recording them is replayed.
+    """
+    return UpdateOne(
+        {"user_id": user_id, "effective_date": when.strftime("%Y-%m-%d")},
+        {"$setOnInsert": {**{field: goals[field] for field in GOAL_FIELDS}, "effective_at": when}},
+        upsert=True
+    )
+
+def previous_goals_seed(user):
+    """Seed the goals a user had before a change, for users created before goal history existed"""
+    return goal_seed_write(user["user_id"], user_goals(user), user.get("created_at") or GOAL_HISTORY_EPOCH)
+
+def goals_for_date(user, date):
+    """Goals in effect on a YYYY-MM-DD date.
+
+    Dates before the first recorded version use the earliest known goals,
+    and users without any history their current goals.
+    """
+    db = get_database()
+    projection = {"_id": 0, **{field: 1 for field in GOAL_FIELDS}}
+    version = db.goal_history.find_one(
+        {"user_id": user["user_id"], "effective_date": {"$lte": date}}, projection,
+        sort=[("effective_date", -1)]
+    )
+    if version is None:
+        version = db.goal_history.find_one({"user_id": user["user_id"]}, projection, sort=[("effective_date", 1)])
+    return user_goals(version or user)
+
+def goals_for_dates(user, dates):
+    """Resolve the goals in effect for many dates with one read and a binary search each"""
+    if not dates:
+        return {}
+    versions = list(history_database().goal_history.find(
+        {"user_id": user["user_id"], "effective_date": {"$lte": max(dates)}},
+        {"_id": 0, "effective_date": 1, **{field: 1 for field in GOAL_FIELDS}}
+    ).sort("effective_date", 1))
+    if not versions:
+        return {date: user_goals(user) for date in dates}
+
+    starts = [version["effective_date"] for version in versions]
+    # Dates before the first recorded version use the earliest known goals
+    return {date: user_goals(versions[max(bisect_right(starts, date) - 1, 0)]) for date in dates}
+
+def calculate_progress(total_nutrition, goals):
+    return {
+        "calories": (total_nutrition["calories"] / goals["daily_calorie_goal"]) * 100,
+        "protein": (total_nutrition["protein"] / goals["daily_protein_goal"]) * 100,
+        "carbs": (total_nutrition["carbs"] / goals["daily_carb_goal"]) * 100,
+        "fat": (total_nutrition["fat"] / goals["daily_fat_goal"]) * 100
+    }
+
+# Background jobs
+job_handlers = {}
+
+def job_handler(job_type):
+    """Register a handler that receives every claimed job of a type as one batch"""
+    def register_handler(func):
+        job_handlers[job_type] = func
+        return func
+    return register_handler
+
+def enqueue_jobs(jobs, session=None):
+    """Durably record deferred work as (type, payload) pairs with a single outbox write"""
+    if not jobs:
+        return
+    now = datetime.now()
+    db = get_database()
+    db.job_outbox.insert_many([
+        {"job_id": str(uuid.uuid4()), "type": job_type, "payload": payload,
+         "run_after": now, "attempts": 0, "created_at": now}
+        for job_type, payload in jobs
+    ], session=session)
+    job_runner.notify()
+
+def enqueue_job(job_type, payload, session=None):
+    enqueue_jobs([(job_type, payload)], session=session)
+
+class JobRunner:
+    """In-process worker draining the job outbox in batches.
+
+    A job stays in the outbox until its handler succeeds, and claiming a job
+    only pushes its run_after forward by the lease, so jobs from a crashed or
+    frozen worker are retried: delivery is at-least-once and handlers must
+    tolerate replays. Serverless deployments have no loop; OutboxDrainMiddleware
+    drains after each request that enqueued jobs instead.
+    """
+
+    def __init__(self):
+        self.wakeup = None
+        self.loop = None
+        self.task = None
+        self.pending = False
+
+    def start(self):
+        if SERVERLESS:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # Drain whatever is due so a clean shutdown leaves nothing waiting on the lease
+        await asyncio.to_thread(self.drain)
+
+    def notify(self):
+        self.pending = True
+        if self.wakeup is not None:
+            # Called from threadpool handlers; the event belongs to the loop
+            self.loop.call_soon_threadsafe(self.wakeup.set)
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            # Give concurrent requests a moment to add to the same batch
+            await asyncio.sleep(JOB_BATCH_WINDOW_SECONDS)
+            try:
+                await asyncio.to_thread(self.drain)
+            except Exception:
+                logger.exception("Background job batch failed")
+
+    def drain(self):
+        while self.run_batch() == JOB_BATCH_SIZE:
+            pass
+
+    def run_batch(self):
+        """Claim up to JOB_BATCH_SIZE due jobs and run them grouped by type"""
+        now = datetime.now()
+        db = get_database()
+        job_ids = [job["job_id"] for job in db.job_outbox.find(
+            {"run_after": {"$lte": now}}, {"_id": 0, "job_id": 1}
+        ).sort("run_after", 1).limit(JOB_BATCH_SIZE)]
+        if not job_ids:
+            return 0
+
+        lease = str(uuid.uuid4())
+        db.job_outbox.update_many(
+            {"job_id": {"$in": job_ids}, "run_after": {"$lte": now}},
+            {"$set": {"run_after": now + timedelta(seconds=JOB_LEASE_SECONDS), "lease": lease},
+             "$inc": {"attempts": 1}}
+        )
+
+        batches = defaultdict(list)
+        for job in db.job_outbox.find({"lease": lease}, {"_id": 0, "job_id": 1, "type": 1, "payload": 1}):
+            batches[job["type"]].append(job)
+
+        for job_type, jobs in batches.items():
+            try:
+                job_handlers[job_type]([job["payload"] for job in jobs])
+            except Exception:
+                logger.exception("Background job handler %s failed; retrying after lease", job_type)
+                continue
+            db.job_outbox.delete_many({"job_id": {"$in": [job["job_id"] for job in jobs]}})
+        return len(job_ids)
+
+job_runner = JobRunner()
+
+@job_handler("food_suggestions")
+def run_food_suggestion_jobs(entries):
+    by_user = defaultdict(list)
+    for entry in entries:
+        by_user[entry["user_id"]].append(entry)
+    for user_id, user_entries in by_user.items():
+        record_food_suggestions(user_id, user_entries)
+
+@job_handler("user_weight")
+def run_user_weight_jobs(entries):
+    # Only the newest weight per user matters, and older replays must not win
+    latest = {}
+    for entry in entries:
+        current = latest.get(entry["user_id"])
+        if current is None or entry["timestamp"] > current["timestamp"]:
+            latest[entry["user_id"]] = entry
+
+    db = get_database()
+    users = {user["user_id"]: user for user in db.users.find(
+        {"user_id": {"$in": list(latest)}},
+        {"_id": 0, **{field: 1 for field in ("user_id", "created_at", "weight_updated_at",
+                                              *GOAL_INPUT_FIELDS, *GOAL_FIELDS)}}
+    )}
+
+    user_writes = []
+    goal_writes = []
+    for user_id, entry in latest.items():
+        user = users.get(user_id)
+        if user is None or (user.get("weight_updated_at") and user["weight_updated_at"] >= entry["timestamp"]):
+            continue
+
+        # Weight feeds the goal calculation, so keep goals and their history in step
+        update = {"weight": entry["weight"], "weight_updated_at": entry["timestamp"]}
+        goals = calculate_daily_goals({**user, "weight": entry["weight"]})
+        if goals != user_goals(user):
+            update.update(goals)
+            goal_writes.append(previous_goals_seed(user))
+            goal_writes.append(goal_version_write(user_id, goals, entry["timestamp"]))
+
+        user_writes.append(UpdateOne(
+            {"user_id": user_id, "$or": [{"weight_updated_at": {"$exists": False}},
+                                         {"weight_updated_at": {"$lt": entry["timestamp"]}}]},
+            {"$set": update}
+        ))
+
+    if user_writes:
+        db.users.bulk_write(user_writes, ordered=False)
+    if goal_writes:
+        db.goal_history.bulk_write(goal_writes, ordered=False)
+
+@job_handler("goal_version")
+def run_goal_version_jobs(versions):
+    # Only starting goals are recorded through jobs; a replay must not undo a later edit
+    db = get_database()
+    db.goal_history.bulk_write(
+        [goal_seed_write(version["user_id"], version, version["effective_at"]) for version in versions],
+        ordered=False
+    )
+
+@job_handler("weight_entry")
+def run_weight_entry_jobs(entries):
+    db = get_database()
+    db.weight_entries.bulk_write(
+        [ReplaceOne({"user_id": entry["user_id"], "entry_id": entry["entry_id"]}, entry, upsert=True)
+         for entry in entries],
+        ordered=False
+    )
+
+def suggestion_jobs(entries):
+    """food_suggestions jobs carrying per-serving macros; entries of unknown serving size are skipped"""
+    jobs = []
+    for entry in entries:
+        per_serving = serving_nutrition(entry)
+        if per_serving is not None:
+            jobs.append(("food_suggestions", {"user_id": entry["user_id"], "entry_id": entry["entry_id"],
+                                              "food_id": entry["food_id"], "food_name": entry["food_name"],
+                                              **per_serving}))
+    return jobs
+
+@app.on_event("startup")
+async def start_job_runner():
+    job_runner.start()
+
+@app.on_event("shutdown")
+async def stop_job_runner():
+    await job_runner.stop()
+
+class OutboxDrainMiddleware:
+    """Runs jobs enqueued by a request once its response is written.
+
+    Mangum returns the response only after the app finishes, so on
+    serverless the jobs complete before the function is frozen.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        await self.app(scope, receive, send)
+        if scope["type"] == "http" and job_runner.pending:
+            job_runner.pending = False
+            try:
+                await asyncio.to_thread(job_runner.drain)
+            except Exception:
+                logger.exception("Background job batch failed")
+
+class StreamCompressor:
+    """Incremental gzip or brotli encoder that can flush after every chunk"""
+
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == "br":
+            self.compressor = brotli.Compressor(quality=COMPRESSION_BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data, flush=False):
+        if self.encoding == "br":
+            return self.compressor.process(data) + (self.compressor.flush() if flush else b"")
+        return self.compressor.compress(data) + (self.compressor.flush(zlib.Z_SYNC_FLUSH) if flush else b"")
+
+    def finish(self):
+        if self.encoding == "br":
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+class CompressionMiddleware:
+    """Negotiated gzip/brotli compression with per-route size thresholds.
+
+    Works at the ASGI message level so streamed responses are compressed
+    chunk by chunk once they pass the size threshold; only the chunks before
+    that are buffered. Small responses, already encoded bodies and event
+    streams pass through.
+    """
+
+    def __init__(self, app, minimum_size=COMPRESSION_MINIMUM_SIZE, thresholds=None):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.thresholds = thresholds or {}
+
+    def negotiate(self, scope):
+        accept = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1").lower()
+                break
+        weights = {}
+        for token in accept.split(","):
+            coding, *params = [part.strip() for part in token.split(";")]
+            weight = 1.0
+            for param in params:
+                if param.startswith("q="):
+                    try:
+                        weight = float(param[2:])
+                    except ValueError:
+                        weight = 0.0
+            if coding:
+                weights[coding] = weight
+        # A coding the client lists with q=0 is refused; "*" covers the ones it leaves out
+        candidates = ["br", "gzip"] if brotli is not None else ["gzip"]
+        weighted = [(weights.get(coding, weights.get("*", 0.0)), coding) for coding in candidates]
+        weight, coding = max(weighted, key=lambda item: item[0])
+        return coding if weight > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        encoding = self.negotiate(scope) if scope["type"] == "http" else None
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        threshold = self.thresholds.get(scope["path"], self.minimum_size)
+        start = None
+        compressor = None
+        passthrough = False
+        pending = b""
+
+        async def send_compressed(message):
+            nonlocal start, compressor, passthrough, pending
+            if message["type"] == "http.response.start":
+                start = message
+                headers = {name.lower() for name, _ in message.get("headers", [])}
+                content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+                passthrough = b"content-encoding" in headers or content_type.startswith(b"text/event-stream")
+                if passthrough:
+                    await send(message)
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if compressor is None:
+                body = pending + body
+                if len(body) < threshold:
+                    if more_body:
+                        # Wrapping middleware sends even small bodies in several messages,
+                        # so hold them until the size is known
+                        pending = body
+                        return
+                    passthrough = True
+                    await send(start)
+                    await send({"type": "http.response.body", "body": body})
+                    return
+
+                compressor = StreamCompressor(encoding)
+                vary = [value for name, value in start.get("headers", []) if name.lower() == b"vary"]
+                headers = [(name, value) for name, value in start.get("headers", [])
+                           if name.lower() not in (b"content-length", b"vary")]
+                headers += [(b"content-encoding", encoding.encode()),
+                            (b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+                if not more_body:
+                    body = compressor.compress(body) + compressor.finish()
+                    headers.append((b"content-length", str(len(body)).encode()))
+                    await send({**start, "headers": headers})
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send({**start, "headers": headers})
+
+            # Streaming: flush each chunk so clients see data as it is produced
+            chunk = compressor.compress(body, flush=more_body)
+            if not more_body:
+                chunk += compressor.finish()
+            await send({"type": "http.response.body", "body": chunk, "more_body": more_body})
+
+        await self.app(scope, receive, send_compressed)
+
+app.add_middleware(CompressionMiddleware, thresholds=COMPRESSION_THRESHOLDS)
+
+# Sampling profiler
+profiled_route = ContextVar("profiled_route", default=None)
+
+class SamplingProfiler:
+    """Wall-clock stack sampler for a share of requests on this worker.
+
+    A SIGALRM timer interrupts the event loop thread every interval; the
+    handler runs in the context of whichever request is executing, so it
+    only records stacks of requests marked by ProfilerMiddleware. Sync
+    endpoints run in the threadpool, so their threads register themselves
+    in `threads` and are sampled through sys._current_frames(). Cost is
+    bounded by the sampling interval and PROFILER_MAX_STACKS rather than by
+    request volume, and nothing runs while no session is active.
+    """
+
+    def __init__(self):
+        self.active = False
+        self.percent = 0
+        self.until = 0
+        self.started_at = None
+        self.interval = 0
+        self.stacks = defaultdict(lambda: defaultdict(int))
+        self.stack_count = 0
+        self.dropped = 0
+        self.previous_handler = None
+        self.threads = {}  # threadpool thread id -> route of the sampled request it runs
+
+    @staticmethod
+    def available():
+        return hasattr(signal, "setitimer") and threading.current_thread() is threading.main_thread()
+
+    def start(self, duration, percent, interval):
+        self.stop()
+        self.stacks = defaultdict(lambda: defaultdict(int))
+        self.stack_count = 0
+        self.dropped = 0
+        self.percent = percent
+        self.interval = interval
+        self.started_at = datetime.now()
+        self.until = time.monotonic() + duration
+        self.previous_handler = signal.signal(signal.SIGALRM, self.sample)
+        signal.setitimer(signal.ITIMER_REAL, interval, interval)
+        self.active = True
+
+    def stop(self):
+        if not self.active:
+            return
+        self.active = False
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, self.previous_handler or signal.SIG_DFL)
+
+    def sampled(self):
+        return self.active and (self.percent >= 100 or random.random() * 100 < self.percent)
+
+    def sample(self, signum, frame):
+        if time.monotonic() >= self.until:
+            self.stop()
+            return
+        route = profiled_route.get()
+        if route is not None:
+            self.record(route, frame)
+        if self.threads:
+            frames = sys._current_frames()
+            for ident, thread_route in list(self.threads.items()):
+                if ident in frames:
+                    self.record(thread_route, frames[ident])
+
+    def record(self, route, frame):
+        stack = []
+        while frame is not None and len(stack) < PROFILER_MAX_DEPTH:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+
+        counts = self.stacks[route]
+        if stack not in counts:
+            if self.stack_count >= PROFILER_MAX_STACKS:
+                self.dropped += 1
+                return
+            self.stack_count += 1
+        counts[stack] += 1
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "active": self.active,
+            "started_at": self.started_at,
+            "seconds_left": max(0, round(self.until - time.monotonic(), 1)) if self.active else 0,
+            "percent": self.percent,
+            "interval_ms": self.interval * 1000,
+            "samples": {route: sum(counts.values()) for route, counts in self.stacks.items()},
+            "dropped_samples": self.dropped
+        }
+
+    def collapsed(self):
+        """Brendan Gregg's collapsed stack format, one `route;frame;... count` line per stack"""
+        lines = []
+        for route, counts in self.stacks.items():
+            for stack, count in counts.items():
+                frames = [f"{name} ({os.path.basename(filename)}:{line})".replace(";", ":")
+                          for name, filename, line in stack]
+                lines.append(f"{';'.join([route, *frames])} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self):
+        """Speedscope file with one sampled profile per route"""
+        frames = {}
+        profiles = []
+        for route, counts in self.stacks.items():
+            samples = []
+            weights = []
+            for stack, count in counts.items():
+                samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+                weights.append(count * self.interval * 1000)
+            profiles.append({
+                "type": "sampled", "name": route, "unit": "milliseconds",
+                "startValue": 0, "endValue": sum(weights), "samples": samples, "weights": weights
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "exporter": "fittracker",
+            "name": f"fittracker worker {os.getpid()}",
+            "shared": {"frames": [{"name": name, "file": filename, "line": line}
+                                  for name, filename, line in frames]},
+            "profiles": profiles
+        }
+
+profiler = SamplingProfiler()
+
+class ProfilerMiddleware:
+    """Marks a sampled share of requests with their route template while a profile runs"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.sampled():
+            await self.app(scope, receive, send)
+            return
+
+        route = scope["path"]
+        for candidate in scope["app"].router.routes:
+            if candidate.matches(scope)[0] == Match.FULL:
+                route = candidate.path
+                break
+        token = profiled_route.set(f"{scope['method']} {route}")
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profiled_route.reset(token)
+
+app.add_middleware(ProfilerMiddleware)
+
+def profiled_thread(endpoint):
+    """Wrap a sync endpoint so the profiler can find the threadpool thread running it"""
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        route = profiled_route.get()
+        if route is None:
+            return endpoint(*args, **kwargs)
+        ident = threading.get_ident()
+        profiler.threads[ident] = route
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profiler.threads.pop(ident, None)
+    return run
+
+class ProfiledRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = profiled_thread(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+# Endpoints that block on Mongo or USDA are plain functions, so FastAPI runs them
+# in the threadpool and the event loop keeps admitting and shedding requests
+app.router.route_class = ProfiledRoute
+
+# Request deadlines
+request_deadline = ContextVar("request_deadline", default=None)
+
+def route_priority(path):
+    for prefix, priority in sorted(ROUTE_PRIORITIES.items(), key=lambda item: -len(item[0])):
+        if path.startswith(prefix):
+            return priority
+    return "normal"
+
+def outbound_timeout(timeout):
+    """Timeout for an outbound call: what is left of the request's budget, capped at `timeout`"""
+    deadline = request_deadline.get()
+    if deadline is None:
+        return timeout
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise HTTPException(status_code=503, detail="Request deadline exceeded")
+    return min(timeout, remaining)
+
+def detached(coroutine):
+    """Start a task outside the current request's deadline, for work shared by many requests"""
+    return Context().run(asyncio.create_task, coroutine)
+
+class DeadlineMiddleware:
+    """Gives each request a deadline budget by priority class and sheds load early.
+
+    The budget applies to every Mongo operation through pymongo.timeout,
+    which derives maxTimeMS and socket timeouts from what is left, and to
+    outbound HTTP through outbound_timeout. Once a class has used its share
+    of the worker's in-flight slots, new requests in it get a 503 at once
+    instead of queueing past their deadline, so lower classes shed first.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.inflight = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(DEADLINE_EXEMPT_PATHS):
+            await self.app(scope, receive, send)
+            return
+
+        share, budget = PRIORITY_CLASSES[route_priority(scope["path"])]
+        if self.inflight >= MAX_INFLIGHT_REQUESTS * share:
+            response = JSONResponse(status_code=503, content={"detail": "Server overloaded"},
+                                    headers={"Retry-After": "1"})
+            await response(scope, receive, send)
+            return
+
+        self.inflight += 1
+        token = request_deadline.set(time.monotonic() + budget)
+        try:
+            with pymongo.timeout(budget):
+                await self.app(scope, receive, send)
+        finally:
+            request_deadline.reset(token)
+            self.inflight -= 1
+
+app.add_middleware(DeadlineMiddleware)
+
+# Outside DeadlineMiddleware, so the drain neither runs under the request's spent
+# pymongo.timeout nor holds its in-flight slot
+if SERVERLESS:
+    app.add_middleware(OutboxDrainMiddleware)
+
+@app.on_event("startup")
+async def size_threadpool():
+    # Every admitted request may hold a threadpool thread; anyio's default is 40
+    anyio.to_thread.current_default_thread_limiter().total_tokens = MAX_INFLIGHT_REQUESTS
+
+# CORS middleware - Updated for Vercel. Added last so it wraps every other
+# middleware and the 429/503 responses they send carry CORS headers too.
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=[
+        "https://*.vercel.app",
+        "https://*.vercel.com",
+        "http://localhost:3000",
+        "*"  # For Vercel deployment
+    ],
+    allow_credentials=True,
+    allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
+    allow_headers=["*"],
+    # Lets clients back off on 429 and 503 responses
+    expose_headers=["Retry-After"],
+)
+
+@app.exception_handler(PyMongoError)
+async def mongo_error_handler(request: Request, exc: PyMongoError):
+    if exc.timeout:
+        return JSONResponse(status_code=503, content={"detail": "Request deadline exceeded"},
+                            headers={"Retry-After": "1"})
+    logger.exception("Database error on %s", request.url.path, exc_info=exc)
+    return JSONResponse(status_code=500, content={"detail": "Internal Server Error"})
+
+# Data retention
+def retention_cutoff():
+    """Dates before this YYYY-MM-DD only exist as rollups, or None when retention is off"""
+    if RETENTION_DAYS <= 0:
+        return None
+    return (datetime.now() - timedelta(days=RETENTION_DAYS)).strftime("%Y-%m-%d")
+
+def compacted_before():
+    """Dates before this YYYY-MM-DD may have rollups, or None when nothing was ever compacted.
+
+    Compaction records how far it got, so rollups stay visible after
+    RETENTION_DAYS is raised or retention is turned off.
+    """
+    now = time.monotonic()
+    if compaction_watermark["loaded_at"] is None or now - compaction_watermark["loaded_at"] >= RETENTION_WATERMARK_SECONDS:
+        doc = get_database().retention_state.find_one({"_id": "watermark"})
+        compaction_watermark["date"] = doc["compacted_before"] if doc else None
+        compaction_watermark["loaded_at"] = now
+    # The cutoff covers compactions run by other workers since the watermark was read
+    dates = [date for date in (compaction_watermark["date"], retention_cutoff()) if date is not None]
+    return max(dates) if dates else None
+
+def is_compacted(date):
+    watermark = compacted_before()
+    return watermark is not None and date < watermark
+
+def find_rollups(user_id, start, end):
+    return list(history_database().daily_rollups.find(
+        {"user_id": user_id, "date": {"$gte": start, "$lte": end}},
+        {"_id": 0, "batches": 0}
+    ).sort("date", 1))
+
+def rollup_weight_entry(rollup):
+    return {"entry_id": None, "weight": rollup["weight"], "date": rollup["date"],
+            "timestamp": rollup["weight_timestamp"]}
+
+def find_rollup_weights(user_id, before=None, limit=1):
+    query = {"user_id": user_id, "weight": {"$exists": True}}
+    if before is not None:
+        query["date"] = {"$lt": before}
+    rollups = history_database().daily_rollups.find(
+        query, {"_id": 0, "weight": 1, "date": 1, "weight_timestamp": 1}
+    ).sort("date", -1).limit(limit)
+    return [rollup_weight_entry(rollup) for rollup in rollups]
+
+def archive_documents(kind, docs):
+    """Append documents to per-month gzip JSONL files in cold storage.
+
+    Each append adds a gzip member, which readers see as one stream. A
+    compaction retried after a crash may archive an entry twice, so readers
+    should dedupe on entry_id.
+    """
+    os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+    files = {}
+    try:
+        for doc in docs:
+            month = doc["date"][:7]
+            if month not in files:
+                files[month] = gzip.open(os.path.join(RETENTION_ARCHIVE_DIR, f"{kind}-{month}.jsonl.gz"), "at")
+            files[month].write(json.dumps(doc, default=str) + "\n")
+    finally:
+        for f in files.values():
+            f.close()
+
+def write_rollups(writes):
+    try:
+        get_database().daily_rollups.bulk_write(writes, ordered=False)
+    except BulkWriteError as e:
+        # A duplicate key means the batch guard already matched: that day was folded in before
+        if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+            raise
+
+def oldest_date(collection, cutoff):
+    doc = collection.find_one({"date": {"$lt": cutoff}}, {"_id": 0, "date": 1}, sort=[("date", 1)])
+    return doc["date"] if doc else None
+
+def archived_food_entry(entry):
+    """Archive copy of an entry with its nutrients unpacked into named fields"""
+    archived = {key: value for key, value in entry.items() if key not in ("_id", "nutrients")}
+    archived["nutrients"] = dict(zip(NUTRIENT_FIELDS, struct.unpack(NUTRIENT_VECTOR_FORMAT, entry_nutrients(entry))))
+    return archived
+
+def compact_food_entries(cutoff):
+    """Fold the oldest remaining day of food entries into rollups; False when none are left"""
+    db = get_database()
+    date = oldest_date(db.food_entries, cutoff)
+    if date is None:
+        return False
+
+    # Grouped here since $group cannot sum the packed nutrient vectors
+    groups = defaultdict(list)
+    for entry in db.food_entries.find({"date": date}):
+        groups[entry["user_id"]].append(entry)
+    entries = [entry for user_entries in groups.values() for entry in user_entries]
+    archive_documents("food_entries", (archived_food_entry(entry) for entry in entries))
+
+    writes = []
+    for user_id, user_entries in groups.items():
+        # Identify this set of entries so a retried compaction does not add it twice
+        batch = hashlib.sha1(b"".join(sorted(entry["_id"].binary for entry in user_entries))).hexdigest()
+        writes.append(UpdateOne(
+            {"user_id": user_id, "date": date, "batches": {"$ne": batch}},
+            {"$inc": {"entries_count": len(user_entries), **sum_nutrients(user_entries)},
+             "$push": {"batches": {"$each": [batch], "$slice": -20}}},
+            upsert=True
+        ))
+    write_rollups(writes)
+    db.food_entries.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+    return True
+
+def compact_weight_entries(cutoff):
+    """Keep the last weight of the oldest remaining day in its rollup; False when none are left"""
+    db = get_database()
+    date = oldest_date(db.weight_entries, cutoff)
+    if date is None:
+        return False
+
+    groups = list(db.weight_entries.aggregate([
+        {"$match": {"date": date}},
+        {"$sort": {"timestamp": 1}},
+        {"$group": {"_id": "$user_id", "ids": {"$push": "$_id"},
+                    "weight": {"$last": "$weight"}, "weight_timestamp": {"$last": "$timestamp"}}}
+    ], allowDiskUse=True))
+    ids = [entry_id for group in groups for entry_id in group["ids"]]
+    archive_documents("weight_entries", db.weight_entries.find({"_id": {"$in": ids}}, {"_id": 0}))
+
+    write_rollups([
+        UpdateOne(
+            {"user_id": group["_id"], "date": date},
+            {"$set": {"weight": group["weight"], "weight_timestamp": group["weight_timestamp"]}},
+            upsert=True
+        )
+        for group in groups
+    ])
+    db.weight_entries.delete_many({"_id": {"$in": ids}})
+    return True
+
+def run_retention():
+    """Compact everything older than the horizon, if no other worker holds the lock"""
+    cutoff = retention_cutoff()
+    if cutoff is None:
+        return
+    if RETENTION_ARCHIVE_DIR is None:
+        logger.warning("Retention skipped: set RETENTION_ARCHIVE_DIR to archive entries before compacting them")
+        return
+
+    db = get_database()
+    now = datetime.now()
+    try:
+        db.scheduler_locks.update_one(
+            {"_id": "retention", "locked_until": {"$lt": now}},
+            {"$set": {"locked_until": now + timedelta(seconds=RETENTION_INTERVAL_SECONDS / 2)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return
+
+    # Raised before compacting so readers merge rollups for days that are partly compacted
+    db.retention_state.update_one({"_id": "watermark"}, {"$max": {"compacted_before": cutoff}}, upsert=True)
+    compaction_watermark["loaded_at"] = None
+
+    days = 0
+    while compact_food_entries(cutoff):
+        days += 1
+    while compact_weight_entries(cutoff):
+        days += 1
+    logger.info("Retention compacted %d days older than %s", days, cutoff)
+
+class RetentionScheduler:
+    def __init__(self):
+        self.task = None
+
+    def start(self):
+        # Serverless deployments run run_retention from an external scheduler instead
+        if RETENTION_DAYS > 0 and not SERVERLESS:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.to_thread(run_retention)
+            except Exception:
+                logger.exception("Retention run failed")
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+
+retention_scheduler = RetentionScheduler()
+
+@app.on_event("startup")
+async def start_retention_scheduler():
+    retention_scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_retention_scheduler():
+    await retention_scheduler.stop()
+
+# Push events
+class EventBroker:
+    """Fans per-user change events out to open event streams.
+
+    Delivery to local subscribers is a put_nowait per open stream, so idle
+    connections cost nothing until something is published. A slow client whose
+    queue is full misses events and is told to refetch. With a backend, events
+    go through it so that subscribers on every instance receive them.
+    """
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self.loop = None
+        self.subscribers = defaultdict(set)
+
+    def subscribe(self, user_id):
+        self.loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=EVENT_QUEUE_SIZE)
+        self.subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id, queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def publish(self, user_id, event):
+        # Handlers publish from the threadpool; queues and the backend client belong to the loop
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.dispatch, user_id, event)
+
+    def dispatch(self, user_id, event):
+        if self.backend is not None:
+            self.backend.publish(user_id, event)
+        else:
+            self.deliver(user_id, event)
+
+    def deliver(self, user_id, event):
+        for queue in self.subscribers.get(user_id, ()):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Replace the backlog with a single resync marker
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        if self.backend is not None:
+            await self.backend.start(self)
+
+    async def stop(self):
+        if self.backend is not None:
+            await self.backend.stop()
+
+class RedisEventBackend:
+    """Pub/sub over any Redis-protocol server so events reach every instance"""
+
+    def __init__(self, url):
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+        self.task = None
+
+    def publish(self, user_id, event):
+        message = json.dumps({"user_id": user_id, "event": event}, default=str)
+        asyncio.get_running_loop().create_task(self.client.publish(EVENTS_CHANNEL, message))
+
+    async def start(self, broker):
+        pubsub = self.client.pubsub()
+        await pubsub.subscribe(EVENTS_CHANNEL)
+
+        async def listen():
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    data = json.loads(message["data"])
+                    broker.deliver(data["user_id"], data["event"])
+
+        self.task = asyncio.create_task(listen())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        await self.client.close()
+
+event_broker = EventBroker(RedisEventBackend(EVENTS_REDIS_URL) if EVENTS_REDIS_URL else None)
+
+def public_fields(document, projection):
+    return {key: document[key] for key in projection if key != "_id" and key in document}
+
+def publish_food_entries(user_id, entries, removed=False):
+    """Publish added or removed entries with the per-day change in totals"""
+    by_date = defaultdict(list)
+    for entry in entries:
+        by_date[entry["date"]].append(entry)
+
+    sign = -1 if removed else 1
+    for date, date_entries in by_date.items():
+        event = {
+            "type": "food_entries",
+            "date": date,
+            "delta": {key: sign * value for key, value in sum_nutrients(date_entries).items()},
+            "entries_count": sign * len(date_entries)
+        }
+        if removed:
+            event["removed"] = [entry["entry_id"] for entry in date_entries]
+        else:
+            event["added"] = [public_fields(entry, FOOD_ENTRY_PROJECTION) for entry in date_entries]
+        event_broker.publish(user_id, event)
+
+@app.on_event("startup")
+async def start_event_broker():
+    await event_broker.start()
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    await event_broker.stop()
+
+# Cache invalidation
+cache_invalidators = defaultdict(list)
+
+def invalidates(collection):
+    """Register func(document_id) to drop local cache entries when `collection` changes.
+
+    document_id is the changed document's _id, or None when the change is
+    unknown (lost stream history) and the whole cache should go. Change
+    events only carry the _id, so each cache remembers which _id its
+    entries were loaded from.
+    """
+    def register_invalidator(func):
+        cache_invalidators[collection].append(func)
+        return func
+    return register_invalidator
+
+@invalidates("users")
+def invalidate_user(document_id):
+    global user_cache_generation
+    user_cache_generation += 1
+    if document_id is None:
+        user_cache.clear()
+        user_cache_ids.clear()
+    else:
+        user_cache.pop(user_cache_ids.pop(document_id, None), None)
+
+@invalidates("food_suggestions")
+def invalidate_food_suggestions(document_id):
+    if document_id is None:
+        food_suggestion_cache.clear()
+        food_suggestion_cache_ids.clear()
+    else:
+        food_suggestion_cache.pop(food_suggestion_cache_ids.pop(document_id, None), None)
+
+def invalidate_all():
+    for invalidators in cache_invalidators.values():
+        for func in invalidators:
+            func(None)
+
+class CacheInvalidationWatcher:
+    """Follows a change stream over the cached collections and applies invalidations.
+
+    Runs on a daemon thread in every worker. After a network error or
+    failover it resumes from the last resume token, so no change is
+    missed; if the oplog no longer holds that point every cache is cleared
+    instead. Caches start empty in a new process, so tokens are not persisted.
+    """
+
+    def __init__(self):
+        self.thread = None
+        self.stopping = threading.Event()
+        self.resume_token = None
+
+    def start(self):
+        if CHANGE_STREAMS_ENABLED and cache_invalidators:
+            self.thread = threading.Thread(target=self.run, name="cache-invalidation", daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self):
+        while not self.stopping.is_set():
+            try:
+                self.watch()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_HISTORY_LOST:
+                    logger.warning("Change stream history lost; clearing local caches")
+                    self.resume_token = None
+                    invalidate_all()
+                else:
+                    logger.exception("Change stream failed")
+                    self.stopping.wait(1)
+            except PyMongoError:
+                logger.exception("Change stream interrupted; resuming")
+                self.stopping.wait(1)
+
+    def watch(self):
+        db = get_database()
+        # Invalidation only needs the documentKey, so changed documents are never looked up or shipped
+        pipeline = [{"$match": {"ns.coll": {"$in": list(cache_invalidators)}}},
+                    {"$project": {"ns": 1, "documentKey": 1}}]
+        with db.watch(pipeline, start_after=self.resume_token, max_await_time_ms=1000) as stream:
+            while not self.stopping.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    self.apply(change)
+                self.resume_token = stream.resume_token
+
+    def apply(self, change):
+        document_id = change.get("documentKey", {}).get("_id")
+        for func in cache_invalidators.get(change["ns"]["coll"], []):
+            func(document_id)
+
+cache_invalidation_watcher = CacheInvalidationWatcher()
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    cache_invalidation_watcher.start()
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation():
+    cache_invalidation_watcher.stop()
+
+# Authentication endpoints
+@app.post("/api/register", response_model=Token)
+def register(user: UserCreate):
+    # Create new user; claiming the username and email in user_lookup rejects duplicates
+    user_dict = user.dict()
+    user_dict["user_id"] = str(uuid.uuid4())
+    user_dict["password"] = get_password_hash(user.password)
+    user_dict["created_at"] = datetime.now()
+    
+    # Calculate daily goals
+    goals = calculate_daily_goals(user_dict)
+    user_dict.update(goals)
+    
+    # Create initial weight entry if weight was provided
+    weight_entry = None
+    if user.weight:
+        weight_entry = {
+            "entry_id": str(uuid.uuid4()),
+            "user_id": user_dict["user_id"],
+            "weight": user.weight,
+            "date": datetime.now().strftime("%Y-%m-%d"),
+            "timestamp": datetime.now()
+        }
+
+    # Record the starting goals so history before any change has a version to use
+    jobs = [("goal_version", {"user_id": user_dict["user_id"], "effective_at": user_dict["created_at"], **goals})]
+    if weight_entry:
+        jobs.append(("weight_entry", weight_entry))
+
+    def create_user(session):
+        db = get_database()
+        claimed = reserve_user_keys(user_dict["user_id"], user_dict, session=session)
+        try:
+            db.users.insert_one(user_dict, session=session)
+            enqueue_jobs(jobs, session=session)
+        except Exception:
+            # Without a transaction nothing rolls back, so free the username and email again
+            if session is None:
+                db.users.delete_one({"user_id": user_dict["user_id"]})
+                release_user_keys(user_dict["user_id"], claimed)
+            raise
+
+    try:
+        run_transaction(create_user)
+    except DuplicateKeyError:
+        # Only the legacy username and email indexes can reject a fresh user_id
+        raise HTTPException(status_code=400, detail="Username or email already registered")
+    
+    # Create access and refresh tokens
+    return issue_tokens(user.username, user_dict["user_id"])
+
+@app.post("/api/login", response_model=Token)
+def login(user: UserLogin):
+    db_user = find_user_by_username(user.username, {"_id": 0, "user_id": 1, "username": 1, "password": 1})
+    if not db_user or not verify_password(user.password, db_user["password"]):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect username or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     
-    # Calculate totals
-    total_nutrition = {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
-    for entry in entries:
-        total_nutrition["calories"] += entry["calories"]
-        total_nutrition["protein"] += entry["protein"]
-        total_nutrition["carbs"] += entry["carbs"]
-        total_nutrition["fat"] += entry["fat"]
-    
-    # Get user goals
-    user_goals = {
-        "daily_calorie_goal": current_user.get("daily_calorie_goal", 2000),
-        "daily_protein_goal": current_user.get("daily_protein_goal", 150),
-        "daily_carb_goal": current_user.get("daily_carb_goal", 250),
-        "daily_fat_goal": current_user.get("daily_fat_goal", 67)
+    return issue_tokens(user.username, db_user["user_id"])
+
+@app.post("/api/token/refresh", response_model=Token)
+async def refresh_token(request: RefreshRequest):
+    """Exchange a refresh token for new tokens with an HMAC check instead of bcrypt"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid refresh token",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    try:
+        payload = jwt.decode(request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("type") != "refresh" or not payload.get("sub"):
+        raise credentials_exception
+
+    family = payload["family"]
+    if await token_denylist.contains(f"family:{family}"):
+        raise credentials_exception
+    user_id = payload.get("uid") or await asyncio.to_thread(find_user_id, "username", payload["sub"])
+    if user_id is None:
+        raise credentials_exception
+
+    # Each refresh token is single-use; presenting a spent one means it leaked,
+    # so the whole session is revoked
+    ttl = payload["exp"] - time.time()
+    if not await token_denylist.claim(f"jti:{payload['jti']}", ttl):
+        await token_denylist.claim(f"family:{family}", REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+        raise credentials_exception
+
+    return issue_tokens(payload["sub"], user_id, family)
+
+@app.post("/api/logout")
+async def logout(request: RefreshRequest):
+    try:
+        payload = jwt.decode(request.refresh_token, SECRET_KEY, algorithms=[ALGORITHM],
+                             options={"verify_exp": False})
+    except JWTError:
+        raise HTTPException(status_code=400, detail="Invalid refresh token")
+    if payload.get("type") == "refresh":
+        await token_denylist.claim(f"family:{payload['family']}", REFRESH_TOKEN_EXPIRE_DAYS * 86400)
+    return {"message": "Logged out successfully"}
+
+# User profile endpoints
+@app.get("/api/profile", response_model=UserProfile)
+def get_profile(fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    selected = parse_fields(fields, UserProfile.model_fields)
+    user_data = {
+        "user_id": current_user["user_id"],
+        "username": current_user["username"],
+        "email": current_user["email"],
+        "age": current_user.get("age"),
+        "gender": current_user.get("gender"),
+        "height": current_user.get("height"),
+        "weight": current_user.get("weight"),
+        "activity_level": current_user.get("activity_level", "sedentary"),
+        "goal": current_user.get("goal", "maintain"),
+        "daily_calorie_goal": current_user.get("daily_calorie_goal"),
+        "daily_protein_goal": current_user.get("daily_protein_goal"),
+        "daily_carb_goal": current_user.get("daily_carb_goal"),
+        "daily_fat_goal": current_user.get("daily_fat_goal")
     }
+    if selected is not None:
+        # A partial profile would fail response_model validation
+        return JSONResponse(select_fields(user_data, selected))
+    return user_data
+
+@app.put("/api/profile")
+def update_profile(profile: UserProfile, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    update_data = profile.dict(exclude_unset=True)
+    # user_id is the shard key and never changes
+    update_data.pop("user_id", None)
     
-    # Calculate progress percentages
-    progress = {
-        "calories": (total_nutrition["calories"] / user_goals["daily_calorie_goal"]) * 100,
-        "protein": (total_nutrition["protein"] / user_goals["daily_protein_goal"]) * 100,
-        "carbs": (total_nutrition["carbs"] / user_goals["daily_carb_goal"]) * 100,
-        "fat": (total_nutrition["fat"] / user_goals["daily_fat_goal"]) * 100
+    # Claim a new username or email before switching to it, then free the old one
+    changed = {field: update_data[field] for field in USER_LOOKUP_FIELDS
+               if field in update_data and update_data[field] != current_user[field]}
+    claimed = reserve_user_keys(current_user["user_id"], changed)
+    
+    # Recalculate goals if relevant data changed
+    goals = None
+    if any(key in update_data for key in GOAL_INPUT_FIELDS):
+        updated_user_data = {**current_user, **update_data}
+        goals = calculate_daily_goals(updated_user_data)
+        update_data.update(goals)
+    
+    try:
+        db.users.update_one(
+            {"user_id": current_user["user_id"]},
+            {"$set": update_data}
+        )
+    except Exception as e:
+        release_user_keys(current_user["user_id"], claimed)
+        if isinstance(e, DuplicateKeyError):
+            raise HTTPException(status_code=400, detail="Username or email already registered")
+        raise
+    # Other workers hear about it from the change stream
+    user_cache.pop(current_user["user_id"], None)
+    release_user_keys(current_user["user_id"], [f"{field}:{current_user[field]}" for field in changed])
+    
+    if goals is not None and goals != user_goals(current_user):
+        db.goal_history.bulk_write([previous_goals_seed(current_user),
+                                    goal_version_write(current_user["user_id"], goals, datetime.now())])
+    
+    return {"message": "Profile updated successfully"}
+
+# Food search endpoints
+@app.get("/api/foods/suggest")
+def suggest_foods(query: Optional[str] = None, limit: int = 10,
+                        current_user: dict = Depends(get_current_user)):
+    suggestions = get_food_suggestions(current_user["user_id"], query)
+    return {"foods": [suggestion_to_food(s) for s in suggestions[:limit]]}
+
+def blend_suggestions(user_id, query, foods):
+    """Put the user's own matching foods ahead of remote search hits"""
+    recent = [suggestion_to_food(s) for s in get_food_suggestions(user_id, query)[:5]]
+    seen = {str(food["fdcId"]) for food in recent}
+    return recent + [food for food in foods if str(food["fdcId"]) not in seen]
+
+@app.get("/api/foods/search")
+def search_foods(query: str, current_user: dict = Depends(get_current_user)):
+    if not USDA_API_KEY:
+        # Mock data for demonstration
+        mock_foods = [
+            {
+                "fdcId": "123456",
+                "description": "Banana, raw",
+                "brandName": "",
+                "servingSize": 100,
+                "servingUnit": "g",
+                "calories": 89,
+                "protein": 1.1,
+                "carbs": 22.8,
+                "fat": 0.3,
+                "fiber": 2.6,
+                "sugar": 12.2,
+                "sodium": 1
+            },
+            {
+                "fdcId": "789012",
+                "description": "Apple, raw",
+                "brandName": "",
+                "servingSize": 100,
+                "servingUnit": "g",
+                "calories": 52,
+                "protein": 0.3,
+                "carbs": 13.8,
+                "fat": 0.2,
+                "fiber": 2.4,
+                "sugar": 10.4,
+                "sodium": 1
+            }
+        ]
+        for food in mock_foods:
+            cache_food_item(food)
+        return {"foods": blend_suggestions(current_user["user_id"], query, mock_foods)}
+    
+    timeout = outbound_timeout(USDA_TIMEOUT_SECONDS)
+    try:
+        response = requests.get(
+            f"{USDA_BASE_URL}/foods/search",
+            params={
+                "query": query,
+                "api_key": USDA_API_KEY,
+                "dataType": ["Branded", "Foundation", "SR Legacy"],
+                "pageSize": 20
+            },
+            timeout=timeout
+        )
+        
+        if response.status_code == 200:
+            data = response.json()
+            foods = []
+            
+            for food in data.get("foods", []):
+                # Extract nutrition data by nutrient id, scaled to the listed serving
+                foods.append(normalize_fdc_food(food))
+            
+            return {"foods": blend_suggestions(current_user["user_id"], query, foods)}
+        else:
+            raise HTTPException(status_code=500, detail="Failed to fetch food data")
+            
+    except requests.Timeout:
+        raise HTTPException(status_code=503, detail="Request deadline exceeded")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching foods: {str(e)}")
+
+@app.get("/api/foods/barcode/{code}")
+async def get_food_by_barcode(code: str, current_user: dict = Depends(get_current_user)):
+    gtin = normalize_gtin(code)
+    if gtin is None:
+        raise HTTPException(status_code=400, detail="Invalid barcode")
+
+    doc = await asyncio.to_thread(find_food_by_gtin, gtin)
+    if doc is None and USDA_API_KEY and barcode_misses.get(gtin, 0) < time.time():
+        try:
+            doc = await asyncio.to_thread(fetch_fdc_food_by_gtin, gtin)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Error fetching food: {str(e)}")
+        if doc is None:
+            if len(barcode_misses) > 10000:
+                barcode_misses.clear()
+            barcode_misses[gtin] = time.time() + BARCODE_MISS_SECONDS
+
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Food not found")
+
+    cache_food_document(doc)
+    return food_detail(doc)
+
+@app.get("/api/foods/{fdc_id}")
+async def get_food(fdc_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    doc = await asyncio.to_thread(db.foods.find_one, {"fdc_id": fdc_id}, {"_id": 0})
+    if doc is None and USDA_API_KEY:
+        try:
+            doc = await food_detail_batcher.get(fdc_id)
+        except HTTPException:
+            raise
+        except Exception as e:
+            raise HTTPException(status_code=502, detail=f"Error fetching food: {str(e)}")
+
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Food not found")
+
+    cache_food_document(doc)
+    return food_detail(doc)
+
+# Food logging endpoints
+@app.post("/api/food-entries", openapi_extra=body_schema(FoodEntry))
+def log_food(entry_dict: dict = Depends(food_entry_body), current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    entry_dict["entry_id"] = str(uuid.uuid4())
+    entry_dict["user_id"] = current_user["user_id"]
+    compute_entries_nutrition([entry_dict])
+    
+    db.food_entries.insert_one(entry_dict)
+    enqueue_jobs(suggestion_jobs([entry_dict]))
+    publish_food_entries(current_user["user_id"], [entry_dict])
+    return {"message": "Food logged successfully", "entry_id": entry_dict["entry_id"]}
+
+@app.post("/api/food-entries/batch", openapi_extra=body_schema(FoodEntry, many=True))
+def log_foods(entry_dicts: List[dict] = Depends(food_entries_body),
+                    current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    if not entry_dicts:
+        raise HTTPException(status_code=400, detail="No food entries provided")
+
+    for entry_dict in entry_dicts:
+        entry_dict["entry_id"] = str(uuid.uuid4())
+        entry_dict["user_id"] = current_user["user_id"]
+    compute_entries_nutrition(entry_dicts)
+
+    db.food_entries.insert_many(entry_dicts)
+    enqueue_jobs(suggestion_jobs(entry_dicts))
+    publish_food_entries(current_user["user_id"], entry_dicts)
+    return {"message": "Food logged successfully",
+            "entry_ids": [entry_dict["entry_id"] for entry_dict in entry_dicts]}
+
+@app.get("/api/food-entries")
+def get_food_entries(date: str, fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    selected = parse_fields(fields, FOOD_ENTRY_FIELDS)
+    projection = FOOD_ENTRY_PROJECTION if selected is None else {"_id": 0, "meal_type": 1, **{field: 1 for field in selected}}
+    entries = find_food_entries(current_user["user_id"], date, {**projection, **FOOD_TOTALS_PROJECTION})
+    rollups = find_rollups(current_user["user_id"], date, date) if is_compacted(date) else []
+    
+    # Group by meal type
+    grouped_entries = {
+        "breakfast": [],
+        "lunch": [],
+        "dinner": [],
+        "snack": []
     }
     
-    # Get recent weight entry
-    latest_weight = db.weight_entries.find_one(
+    for entry in entries:
+        meal_type = entry["meal_type"]
+        if meal_type in grouped_entries:
+            grouped_entries[meal_type].append(entry)
+    
+    # Add to totals
+    total_nutrition = sum_nutrients([entry for meal in grouped_entries.values() for entry in meal])
+    grouped_entries = {meal_type: [select_fields(entry, selected or FOOD_ENTRY_FIELDS) for entry in meal]
+                       for meal_type, meal in grouped_entries.items()}
+    
+    # Entries past the retention horizon only survive as day totals
+    for rollup in rollups:
+        for key in ROLLUP_FIELDS:
+            total_nutrition[key] += rollup.get(key, 0)
+    
+    return fast_json({
+        "entries": grouped_entries,
+        "total_nutrition": total_nutrition,
+        "archived_entries_count": sum(rollup.get("entries_count", 0) for rollup in rollups)
+    })
+
+@app.delete("/api/food-entries/{entry_id}")
+def delete_food_entry(entry_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    deleted = db.food_entries.find_one_and_delete(
+        {"entry_id": entry_id, "user_id": current_user["user_id"]},
+        projection={**FOOD_TOTALS_PROJECTION, "entry_id": 1, "date": 1}
+    )
+    
+    if deleted is None:
+        raise HTTPException(status_code=404, detail="Food entry not found")
+    
+    publish_food_entries(current_user["user_id"], [deleted], removed=True)
+    return {"message": "Food entry deleted successfully"}
+
+# Saved meal endpoints
+@app.post("/api/meals")
+def create_meal(meal: SavedMeal, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    if not meal.ingredients:
+        raise HTTPException(status_code=400, detail="A meal needs at least one ingredient")
+
+    meal_dict = meal.dict()
+    meal_dict["meal_id"] = str(uuid.uuid4())
+    meal_dict["user_id"] = current_user["user_id"]
+    verify_meal_ingredients(meal_dict["ingredients"])
+    meal_dict["nutrition_per_serving"] = calculate_meal_nutrition(
+        meal_dict["ingredients"], meal_dict["servings"]
+    )
+    meal_dict["created_at"] = datetime.now()
+
+    db.saved_meals.insert_one(meal_dict)
+    return {"message": "Meal saved successfully", "meal_id": meal_dict["meal_id"],
+            "nutrition_per_serving": meal_dict["nutrition_per_serving"]}
+
+@app.get("/api/meals")
+def get_meals(current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    meals = list(db.saved_meals.find(
         {"user_id": current_user["user_id"]},
-        {"_id": 0},
-        sort=[("timestamp", -1)]
+        {"_id": 0}
+    ).sort("name", 1))
+
+    return {"meals": meals}
+
+@app.put("/api/meals/{meal_id}")
+def update_meal(meal_id: str, meal: SavedMealUpdate, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    update_data = meal.dict(exclude_none=True)
+    if "ingredients" in update_data and not update_data["ingredients"]:
+        raise HTTPException(status_code=400, detail="A meal needs at least one ingredient")
+    if "ingredients" in update_data:
+        verify_meal_ingredients(update_data["ingredients"])
+
+    # Only re-aggregate nutrition when the recipe itself changed
+    if "ingredients" in update_data or "servings" in update_data:
+        existing = db.saved_meals.find_one(
+            {"meal_id": meal_id, "user_id": current_user["user_id"]},
+            {"_id": 0, "ingredients": 1, "servings": 1}
+        )
+        if existing is None:
+            raise HTTPException(status_code=404, detail="Meal not found")
+
+        recipe = {**existing, **update_data}
+        update_data["nutrition_per_serving"] = calculate_meal_nutrition(
+            recipe["ingredients"], recipe["servings"]
+        )
+
+    result = db.saved_meals.update_one(
+        {"meal_id": meal_id, "user_id": current_user["user_id"]},
+        {"$set": update_data}
+    )
+
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Meal not found")
+
+    return {"message": "Meal updated successfully"}
+
+@app.delete("/api/meals/{meal_id}")
+def delete_meal(meal_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    result = db.saved_meals.delete_one({
+        "meal_id": meal_id,
+        "user_id": current_user["user_id"]
+    })
+
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Meal not found")
+
+    return {"message": "Meal deleted successfully"}
+
+@app.post("/api/meals/{meal_id}/log")
+def log_meal(meal_id: str, log: MealLog, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    meal = db.saved_meals.find_one(
+        {"meal_id": meal_id, "user_id": current_user["user_id"]},
+        {"_id": 0}
     )
+    if meal is None:
+        raise HTTPException(status_code=404, detail="Meal not found")
+
+    # Scale each ingredient by the share of the recipe being eaten
+    portion = log.servings / (meal.get("servings") or 1)
+    timestamp = datetime.now()
+    entries = []
+    for ingredient in meal["ingredients"]:
+        servings = ingredient["servings"] * portion
+        entries.append({
+            "entry_id": str(uuid.uuid4()),
+            "user_id": current_user["user_id"],
+            "food_id": ingredient["food_id"],
+            "food_name": ingredient["food_name"],
+            "meal_type": log.meal_type,
+            "servings": servings,
+            "calories": ingredient["calories"] * servings,
+            "protein": ingredient["protein"] * servings,
+            "carbs": ingredient["carbs"] * servings,
+            "fat": ingredient["fat"] * servings,
+            "date": log.date,
+            "timestamp": timestamp,
+            "meal_id": meal_id
+        })
+    # Stored ingredient values only stand in for foods without a cached vector
+    compute_entries_nutrition(entries)
+
+    # One round trip for the whole meal
+    db.food_entries.insert_many(entries)
+    enqueue_jobs(suggestion_jobs(entries))
+    publish_food_entries(current_user["user_id"], entries)
+
+    added_nutrition = {key: round(sum(entry[key] for entry in entries), 2) for key in MACRO_FIELDS}
+    return {
+        "message": "Meal logged successfully",
+        "entry_ids": [entry["entry_id"] for entry in entries],
+        "added_nutrition": added_nutrition
+    }
+
+# Weight tracking endpoints
+@app.post("/api/weight-entries", openapi_extra=body_schema(WeightEntry))
+def log_weight(entry_dict: dict = Depends(weight_entry_body), current_user: dict = Depends(get_current_user)):
+    entry_dict["entry_id"] = entry_dict["entry_id"] or str(uuid.uuid4())
+    entry_dict["user_id"] = current_user["user_id"]
+
+    def write_weight(session):
+        # Upserting on entry_id makes a retried request a no-op instead of a duplicate
+        db = get_database()
+        db.weight_entries.update_one(
+            {"entry_id": entry_dict["entry_id"], "user_id": current_user["user_id"]},
+            {"$setOnInsert": entry_dict},
+            upsert=True,
+            session=session
+        )
+        # Update user's current weight in the background; replays are harmless
+        enqueue_job("user_weight", {key: entry_dict[key] for key in ("user_id", "weight", "timestamp")},
+                    session=session)
+
+    try:
+        run_transaction(write_weight)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail="Weight entry id already in use")
+    
+    event_broker.publish(current_user["user_id"], {
+        "type": "weight_entry",
+        "entry": public_fields(entry_dict, WEIGHT_ENTRY_PROJECTION)
+    })
+    return {"message": "Weight logged successfully", "entry_id": entry_dict["entry_id"]}
+
+@app.get("/api/weight-entries")
+def get_weight_entries(fields: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    selected = parse_fields(fields, WEIGHT_ENTRY_FIELDS)
+    projection = WEIGHT_ENTRY_PROJECTION if selected is None else {"_id": 0, "date": 1, **{field: 1 for field in selected}}
+    entries = find_weight_history(current_user["user_id"], projection=projection)
+    if len(entries) < 30 and compacted_before() is not None:
+        # Continue into compacted history with one weight per day
+        before = entries[-1]["date"] if entries else None
+        entries += find_rollup_weights(current_user["user_id"], before, 30 - len(entries))
+    
+    if selected is not None:
+        entries = [select_fields(entry, selected) for entry in entries]
+    return fast_json({"entries": entries})
+
+# Push updates
+@app.post("/api/event-ticket")
+def create_event_ticket(current_user: dict = Depends(get_current_user)):
+    if not EVENTS_ENABLED:
+        raise HTTPException(status_code=501, detail="Push events are not available on this deployment")
+    return {"ticket": create_stream_ticket(current_user["username"], current_user["user_id"])}
+
+@app.get("/api/events")
+async def stream_events(request: Request, current_user: dict = Depends(get_current_user_from_ticket)):
+    if not EVENTS_ENABLED:
+        # An error status stops EventSource from reconnecting; clients keep refetching instead
+        raise HTTPException(status_code=501, detail="Push events are not available on this deployment")
+    user_id = current_user["user_id"]
+    queue = event_broker.subscribe(user_id)
+
+    async def event_stream():
+        try:
+            yield "retry: 3000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), EVENT_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+        finally:
+            event_broker.unsubscribe(user_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Dashboard/summary endpoints
+@app.get("/api/dashboard")
+def get_dashboard(date: str, current_user: dict = Depends(get_current_user)):
+    # Get today's food entries
+    entries = find_food_entries(current_user["user_id"], date, FOOD_TOTALS_PROJECTION)
+    
+    # Calculate totals
+    total_nutrition = sum_nutrients(entries)
+    
+    entries_count = len(entries)
+    if is_compacted(date):
+        for rollup in find_rollups(current_user["user_id"], date, date):
+            for key in ROLLUP_FIELDS:
+                total_nutrition[key] += rollup.get(key, 0)
+            entries_count += rollup.get("entries_count", 0)
+    
+    # Get the goals that were in effect on that date
+    goals = goals_for_date(current_user, date)
+    
+    # Calculate progress percentages
+    progress = calculate_progress(total_nutrition, goals)
+    
+    # Get recent weight entry
+    latest_weight = find_latest_weight(current_user["user_id"])
     
     return {
         "total_nutrition": total_nutrition,
-        "user_goals": user_goals,
+        "user_goals": goals,
         "progress": progress,
         "latest_weight": latest_weight,
-        "entries_count": len(entries)
+        "entries_count": entries_count
+    }
+
+@app.get("/api/nutrition-history")
+def get_nutrition_history(start: str, end: str, current_user: dict = Depends(get_current_user)):
+    # Packed vectors are summed here rather than in a $group, which cannot add binary data
+    entries = hinted_find(
+        history_database().food_entries,
+        {"user_id": current_user["user_id"], "date": {"$gte": start, "$lte": end}},
+        {**FOOD_TOTALS_PROJECTION, "date": 1},
+        FOOD_ENTRIES_BY_DATE, sort=("date", 1)
+    )
+    days = sum_nutrients_by_date(entries)
+
+    if is_compacted(start):
+        # Merge in days that were compacted into rollups
+        for rollup in find_rollups(current_user["user_id"], start, end):
+            if "entries_count" not in rollup:
+                continue
+            totals, entries_count = days.get(rollup["date"], (nutrient_totals([0.0] * len(NUTRIENT_FIELDS)), 0))
+            totals = {key: value + rollup.get(key, 0) for key, value in totals.items()}
+            days[rollup["date"]] = (totals, entries_count + rollup["entries_count"])
+
+    dates = sorted(days)
+    goals = goals_for_dates(current_user, dates)
+    history = []
+    for date in dates:
+        total_nutrition, entries_count = days[date]
+        history.append({
+            "date": date,
+            "total_nutrition": total_nutrition,
+            "user_goals": goals[date],
+            "progress": calculate_progress(total_nutrition, goals[date]),
+            "entries_count": entries_count
+        })
+    
+    return {"days": history}
+
+# Meal planning
+def load_meal_plan_pool():
+    """Per-serving macros of recently fetched store foods as a cached 4 x n matrix"""
+    now = time.monotonic()
+    if meal_plan_pool["loaded_at"] is not None and now - meal_plan_pool["loaded_at"] < MEAL_PLAN_POOL_TTL_SECONDS:
+        return meal_plan_pool
+
+    db = get_database()
+    foods = []
+    columns = []
+    for doc in db.foods.find({}, {"_id": 0, "fdc_id": 1, "description": 1, "serving_size": 1, "serving_unit": 1,
+                                  "serving_grams": 1, "nutrients": 1}).sort("fetched_at", -1).limit(MEAL_PLAN_POOL_SIZE):
+        per_serving = [value * doc["serving_grams"] / 100 for value in pad_nutrients(doc["nutrients"])[:len(MACRO_FIELDS)]]
+        if per_serving[0] <= 0:
+            continue
+        foods.append({"fdcId": doc["fdc_id"], "description": doc["description"],
+                      "servingSize": doc["serving_size"], "servingUnit": doc["serving_unit"], "source": "store"})
+        columns.append(per_serving)
+
+    meal_plan_pool.update(
+        loaded_at=now,
+        foods=foods,
+        matrix=np.array(columns, dtype=float).reshape(-1, len(MACRO_FIELDS)).T
+    )
+    return meal_plan_pool
+
+def solve_servings(matrix, target, penalty):
+    """Servings in [0, MEAL_PLAN_MAX_SERVINGS] minimizing relative macro error plus a linear penalty.
+
+    Bounded least squares solved with FISTA; each iteration is two small
+    matrix-vector products, so hundreds of candidates take a few milliseconds.
+    """
+    scale = 1 / np.maximum(target, 1)
+    weighted = matrix * scale[:, None]
+    goal = target * scale
+    step = 1 / (np.linalg.norm(weighted, 2) ** 2 or 1)
+
+    x = y = np.zeros(matrix.shape[1])
+    t = 1.0
+    for _ in range(MEAL_PLAN_ITERATIONS):
+        gradient = weighted.T @ (weighted @ y - goal) + penalty
+        x_next = np.clip(y - step * gradient, 0, MEAL_PLAN_MAX_SERVINGS)
+        t_next = (1 + math.sqrt(1 + 4 * t * t)) / 2
+        y = x_next + (t - 1) / t_next * (x_next - x)
+        x, t = x_next, t_next
+    return x
+
+def plan_meal(foods, matrix, remaining, penalty, max_foods):
+    """Pick up to max_foods candidates and serving counts that fill the remaining macros"""
+    servings = solve_servings(matrix, remaining, penalty)
+    chosen = [index for index in np.argsort(-servings)[:max_foods] if servings[index] > 1e-3]
+    if not chosen:
+        return []
+
+    # Refit on the chosen foods alone, then round to servings people can measure
+    refit = solve_servings(matrix[:, chosen], remaining, np.zeros(len(chosen)))
+    refit = np.round(refit / MEAL_PLAN_SERVING_STEP) * MEAL_PLAN_SERVING_STEP
+    plan = []
+    for index, count in zip(chosen, refit):
+        if count <= 0:
+            continue
+        plan.append({**foods[index], "servings": float(count),
+                     **{field: round(float(matrix[row, index] * count), 2) for row, field in enumerate(MACRO_FIELDS)}})
+    return plan
+
+# Coach groups
+def find_user_ids(usernames):
+    """Resolve many usernames to user_ids with one lookup read"""
+    db = get_database()
+    found = {doc["_id"].partition(":")[2]: doc["user_id"] for doc in db.user_lookup.find(
+        {"_id": {"$in": [f"username:{username}" for username in usernames]}}
+    )}
+    for username in usernames:
+        if username not in found:
+            user_id = find_user_id("username", username)
+            if user_id:
+                found[username] = user_id
+    return found
+
+def find_group(group_id, coach_id):
+    """A group coached by coach_id, else 404"""
+    db = get_database()
+    group = db.groups.find_one({"group_id": group_id, "coach_id": coach_id}, {"_id": 0})
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return group
+
+def invited_user_ids(usernames):
+    found = find_user_ids(usernames)
+    unknown = [username for username in usernames if username not in found]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown users: {', '.join(unknown)}")
+    return list(set(found.values()))
+
+def group_summaries(user_ids, date):
+    """Dashboard numbers for many users with one $in aggregation per collection.
+
+    Totals cover SUMMARY_NUTRIENT_FIELDS, which entries keep as plain fields
+    that $group can sum.
+    """
+    history = history_database()
+    users = list(history.users.find(
+        {"user_id": {"$in": user_ids}},
+        {"_id": 0, "user_id": 1, "username": 1, "created_at": 1, **{field: 1 for field in GOAL_FIELDS}}
+    ))
+
+    totals = {day["_id"]: day for day in history.food_entries.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}, "date": date}},
+        {"$group": {"_id": "$user_id", "entries_count": {"$sum": 1},
+                    **{field: {"$sum": f"${field}"} for field in SUMMARY_NUTRIENT_FIELDS}}}
+    ])}
+    if is_compacted(date):
+        for rollup in history.daily_rollups.find({"user_id": {"$in": user_ids}, "date": date}, {"_id": 0, "batches": 0}):
+            day = totals.setdefault(rollup["user_id"], {"entries_count": 0, **{field: 0 for field in SUMMARY_NUTRIENT_FIELDS}})
+            for key in (*SUMMARY_NUTRIENT_FIELDS, "entries_count"):
+                day[key] += rollup.get(key, 0)
+
+    # Sorted to match the (user_id, timestamp) index so $first reads one entry per user
+    weights = {entry.pop("_id"): entry for entry in history.weight_entries.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}}},
+        {"$sort": {"user_id": 1, "timestamp": -1}},
+        {"$group": {"_id": "$user_id", **{field: {"$first": f"${field}"} for field in WEIGHT_ENTRY_PROJECTION if field != "_id"}}}
+    ])}
+    missing = [user_id for user_id in user_ids if user_id not in weights]
+    if missing and compacted_before() is not None:
+        for rollup in history.daily_rollups.aggregate([
+            {"$match": {"user_id": {"$in": missing}, "weight": {"$exists": True}}},
+            {"$sort": {"user_id": 1, "date": -1}},
+            {"$group": {"_id": "$user_id", "weight": {"$first": "$weight"}, "date": {"$first": "$date"},
+                        "weight_timestamp": {"$first": "$weight_timestamp"}}}
+        ]):
+            weights[rollup["_id"]] = rollup_weight_entry(rollup)
+
+    goals = {version["_id"]: version for version in history.goal_history.aggregate([
+        {"$match": {"user_id": {"$in": user_ids}, "effective_date": {"$lte": date}}},
+        {"$sort": {"user_id": 1, "effective_date": -1}},
+        {"$group": {"_id": "$user_id", **{field: {"$first": f"${field}"} for field in GOAL_FIELDS}}}
+    ])}
+    missing = [user_id for user_id in user_ids if user_id not in goals]
+    if missing:
+        # Same rule as goals_for_date: before the first version, the earliest goals apply
+        goals.update((version["_id"], version) for version in history.goal_history.aggregate([
+            {"$match": {"user_id": {"$in": missing}}},
+            {"$sort": {"user_id": 1, "effective_date": 1}},
+            {"$group": {"_id": "$user_id", **{field: {"$first": f"${field}"} for field in GOAL_FIELDS}}}
+        ]))
+
+    summaries = []
+    for user in sorted(users, key=lambda user: user["username"]):
+        day = totals.get(user["user_id"], {})
+        total_nutrition = {field: round(day.get(field, 0), 2) for field in SUMMARY_NUTRIENT_FIELDS}
+        user_goal = user_goals(goals.get(user["user_id"]) or user)
+        summaries.append({
+            "user_id": user["user_id"],
+            "username": user["username"],
+            "total_nutrition": total_nutrition,
+            "user_goals": user_goal,
+            "progress": calculate_progress(total_nutrition, user_goal),
+            "latest_weight": weights.get(user["user_id"]),
+            "entries_count": day.get("entries_count", 0)
+        })
+    return summaries
+
+# Meal plan endpoints
+@app.get("/api/meal-plan")
+def get_meal_plan(date: str, max_foods: int = 5, current_user: dict = Depends(get_current_user)):
+    if np is None:
+        raise HTTPException(status_code=503, detail="Meal planning requires numpy")
+    if not 1 <= max_foods <= 20:
+        raise HTTPException(status_code=400, detail="max_foods must be between 1 and 20")
+
+    goals = goals_for_date(current_user, date)
+    totals = sum_nutrients(find_food_entries(current_user["user_id"], date, FOOD_TOTALS_PROJECTION))
+    remaining = {field: round(max(goals[goal] - totals[field], 0), 2) for field, goal in zip(MACRO_FIELDS, GOAL_FIELDS)}
+    if remaining["calories"] < 50:
+        return {"date": date, "remaining": remaining, "foods": [], "candidates_count": 0}
+
+    # Recent foods first, with a smaller penalty so familiar foods are preferred
+    recent = get_food_suggestions(current_user["user_id"])
+    recent_ids = {str(food["food_id"]) for food in recent}
+    pool = load_meal_plan_pool()
+    in_pool = [index for index, food in enumerate(pool["foods"]) if food["fdcId"] not in recent_ids]
+
+    foods = [{"fdcId": food["food_id"], "description": food["food_name"], "servingSize": 1,
+              "servingUnit": "serving", "source": "recent"} for food in recent]
+    foods += [pool["foods"][index] for index in in_pool]
+    matrix = np.hstack([
+        np.array([[food[field] for field in MACRO_FIELDS] for food in recent], dtype=float).reshape(-1, len(MACRO_FIELDS)).T,
+        pool["matrix"][:, in_pool]
+    ])
+    penalty = np.full(len(foods), MEAL_PLAN_SPARSITY)
+    penalty[:len(recent)] /= 2
+
+    plan = plan_meal(foods, matrix, np.array(list(remaining.values())), penalty, max_foods)
+    return {
+        "date": date,
+        "remaining": remaining,
+        "foods": plan,
+        "plan_totals": {field: round(sum(food[field] for food in plan), 2) for field in MACRO_FIELDS},
+        "candidates_count": len(foods)
+    }
+
+# Coach group endpoints
+@app.post("/api/groups")
+def create_group(group: GroupCreate, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    group_dict = {
+        "group_id": str(uuid.uuid4()),
+        "name": group.name,
+        "coach_id": current_user["user_id"],
+        "member_ids": [],
+        "invited_ids": invited_user_ids(group.usernames),
+        "created_at": datetime.now()
+    }
+    db.groups.insert_one(group_dict)
+    return {"message": "Group created successfully", "group_id": group_dict["group_id"]}
+
+@app.get("/api/groups")
+def get_groups(current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    user_id = current_user["user_id"]
+    groups = []
+    for group in db.groups.find({"$or": [{"coach_id": user_id}, {"member_ids": user_id}, {"invited_ids": user_id}]},
+                                {"_id": 0}):
+        role = "coach" if group["coach_id"] == user_id else "member" if user_id in group["member_ids"] else "invited"
+        groups.append({
+            "group_id": group["group_id"],
+            "name": group["name"],
+            "role": role,
+            "members_count": len(group["member_ids"]),
+            "invited_count": len(group["invited_ids"]) if role == "coach" else None
+        })
+    return {"groups": groups}
+
+@app.post("/api/groups/{group_id}/members")
+def invite_group_members(group_id: str, invite: GroupInvite, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    group = find_group(group_id, current_user["user_id"])
+    user_ids = [user_id for user_id in invited_user_ids(invite.usernames) if user_id not in group["member_ids"]]
+    db.groups.update_one({"group_id": group_id}, {"$addToSet": {"invited_ids": {"$each": user_ids}}})
+    return {"message": "Members invited successfully", "invited_count": len(user_ids)}
+
+@app.post("/api/groups/{group_id}/join")
+def join_group(group_id: str, current_user: dict = Depends(get_current_user)):
+    db = get_database()
+    result = db.groups.update_one(
+        {"group_id": group_id, "invited_ids": current_user["user_id"]},
+        {"$pull": {"invited_ids": current_user["user_id"]}, "$addToSet": {"member_ids": current_user["user_id"]}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Invitation not found")
+    return {"message": "Joined group successfully"}
+
+@app.delete("/api/groups/{group_id}/members/{user_id}")
+def remove_group_member(group_id: str, user_id: str, current_user: dict = Depends(get_current_user)):
+    # Coaches remove anyone; members can only leave
+    db = get_database()
+    if user_id != current_user["user_id"]:
+        find_group(group_id, current_user["user_id"])
+    result = db.groups.update_one(
+        {"group_id": group_id},
+        {"$pull": {"member_ids": user_id, "invited_ids": user_id}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Group not found")
+    return {"message": "Member removed successfully"}
+
+@app.get("/api/groups/{group_id}/summary")
+def get_group_summary(group_id: str, date: str, current_user: dict = Depends(get_current_user)):
+    group = find_group(group_id, current_user["user_id"])
+    return {
+        "group_id": group_id,
+        "name": group["name"],
+        "date": date,
+        "members": group_summaries(group["member_ids"], date)
     }
 
+# Admin profiling endpoints; each worker profiles itself, so results cover the worker that answers
+@app.post("/api/admin/profiler")
+async def start_profiler(options: ProfilerStart, admin: dict = Depends(get_admin_user)):
+    if not profiler.available():
+        raise HTTPException(status_code=501, detail="Profiling needs a Unix worker running requests on its main thread")
+    if not 0 < options.duration_seconds <= PROFILER_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"duration_seconds must be between 0 and {PROFILER_MAX_SECONDS}")
+    if not 0 < options.percent <= 100:
+        raise HTTPException(status_code=400, detail="percent must be between 0 and 100")
+    if options.interval_ms < PROFILER_MIN_INTERVAL_MS:
+        raise HTTPException(status_code=400, detail=f"interval_ms must be at least {PROFILER_MIN_INTERVAL_MS}")
+
+    profiler.start(options.duration_seconds, options.percent, options.interval_ms / 1000)
+    logger.info("Profiler started by %s: %s", admin["username"], options.dict())
+    return profiler.status()
+
+@app.get("/api/admin/profiler")
+async def get_profile_samples(format: str = "status", admin: dict = Depends(get_admin_user)):
+    if format == "collapsed":
+        return Response(profiler.collapsed(), media_type="text/plain")
+    if format == "speedscope":
+        return profiler.speedscope()
+    if format != "status":
+        raise HTTPException(status_code=400, detail="format must be status, collapsed or speedscope")
+    return profiler.status()
+
+@app.delete("/api/admin/profiler")
+async def stop_profiler(admin: dict = Depends(get_admin_user)):
+    profiler.stop()
+    return profiler.status()
+
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "timestamp": datetime.now()}
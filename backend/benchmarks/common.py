@@ -0,0 +1,55 @@
+"""Shared setup for the benchmark scripts: the app on an in-memory database and a timer.
+
+The numbers measure the application's own CPU work; network and server time
+of a real MongoDB are not included.
+"""
+
+import os
+import sys
+import timeit
+
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("MONGO_QUERY_HINTS", "false")
+os.environ.setdefault("CHANGE_STREAMS_ENABLED", "false")
+os.environ["USDA_API_KEY"] = ""
+os.environ["MONGO_URL"] = "mongodb://localhost:27017"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock
+from fastapi.testclient import TestClient
+
+import server
+
+
+def use_mongomock():
+    server.client = mongomock.MongoClient()
+    server.db = server.client.fittracker
+    server.ensure_indexes()
+    return server.db
+
+
+def api_client():
+    use_mongomock()
+    return TestClient(server.app)
+
+
+def register(api, username):
+    response = api.post("/api/register", json={
+        "username": username, "email": f"{username}@example.com", "password": "secret"
+    })
+    response.raise_for_status()
+    return response.json()
+
+
+def per_call(func, number=100, repeat=5):
+    """Best seconds per call over `repeat` runs of `number` calls"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(title, rows):
+    """Print (label, value, unit) rows under a title"""
+    print(title)
+    width = max(len(label) for label, _, _ in rows)
+    for label, value, unit in rows:
+        print(f"  {label:<{width}}  {value:>12.3f} {unit}")
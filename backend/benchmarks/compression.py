@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire and time per request for the main read endpoints, sent
+uncompressed and with each encoding the server can negotiate.
+
+    cd backend && python benchmarks/compression.py
+"""
+
+from datetime import date, timedelta
+
+# common puts the backend on sys.path and configures the environment first
+from common import api_client, per_call, register, report
+import server
+
+DAYS = 30
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+
+
+def seed(api, headers):
+    first = date(2024, 5, 1)
+    for day in range(DAYS):
+        today = (first + timedelta(days=day)).isoformat()
+        api.post("/api/food-entries/batch", headers=headers, json=[{
+            "user_id": "", "food_id": str(100000 + i), "food_name": f"Food {i}", "meal_type": MEALS[i % 4],
+            "servings": 1.5, "calories": 210.0, "protein": 12.5, "carbs": 30.25, "fat": 7.75, "date": today
+        } for i in range(8)]).raise_for_status()
+        api.post("/api/weight-entries", headers=headers,
+                 json={"user_id": "", "weight": 80 - day / 10, "date": today}).raise_for_status()
+    return first.isoformat(), (first + timedelta(days=DAYS - 1)).isoformat()
+
+
+def main():
+    api = api_client()
+    headers = {"Authorization": "Bearer " + register(api, "bench")["access_token"]}
+    start, end = seed(api, headers)
+    endpoints = [
+        ("dashboard", "/api/dashboard", {"date": end}),
+        ("food-entries", "/api/food-entries", {"date": end}),
+        ("weight-entries", "/api/weight-entries", {}),
+        ("nutrition-history", "/api/nutrition-history", {"start": start, "end": end}),
+    ]
+    encodings = ["identity", "gzip"] + (["br"] if server.brotli is not None else [])
+
+    for label, path, params in endpoints:
+        rows = []
+        for encoding in encodings:
+            request_headers = {**headers, "Accept-Encoding": encoding}
+            response = api.get(path, params=params, headers=request_headers)
+            response.raise_for_status()
+            rows.append((f"{encoding} bytes", response.num_bytes_downloaded, "B"))
+            rows.append((f"{encoding} time", per_call(lambda: api.get(path, params=params, headers=request_headers),
+                                                      number=50) * 1000, "ms"))
+        report(f"GET {path} ({label})", rows)
+
+
+if __name__ == "__main__":
+    main()
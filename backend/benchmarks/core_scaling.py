@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Requests per second from the production gunicorn profile as the worker count
+grows from 1 to N. Each run starts gunicorn.conf.py on a local port and drives
+it with keep-alive clients in separate processes, so the load generator is not
+held back by a single interpreter. The clients share the machine's cores with
+the workers; run with fewer --clients than cores to leave the workers room.
+
+Needs a MongoDB at MONGO_URL, like the server itself.
+
+    cd backend && python benchmarks/core_scaling.py [--max-workers 8] [--seconds 10] [--path /api/dashboard]
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import date
+
+# The servers get the caller's settings, not the in-memory defaults common sets up
+ENVIRONMENT = dict(os.environ)
+
+from common import report
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PUBLIC_PATHS = ("/api/health",)
+
+
+def request(port, method, path, body=None, headers=None):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    try:
+        connection.request(method, path, body=json.dumps(body) if body else None,
+                           headers={"Content-Type": "application/json", **(headers or {})})
+        response = connection.getresponse()
+        return response.status, response.read()
+    finally:
+        connection.close()
+
+
+def start_server(workers, port):
+    env = {**ENVIRONMENT, "WEB_CONCURRENCY": str(workers), "PORT": str(port), "RATE_LIMIT_ENABLED": "false"}
+    server = subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "server:app"],
+                              cwd=BACKEND, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {server.returncode}; is MongoDB reachable at MONGO_URL?")
+        try:
+            if request(port, "GET", "/api/health")[0] == 200:
+                return server
+        except OSError:
+            pass
+        time.sleep(0.2)
+    stop_server(server)
+    raise RuntimeError("gunicorn did not become healthy within 60 seconds")
+
+
+def stop_server(server):
+    server.send_signal(signal.SIGTERM)
+    try:
+        server.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        server.kill()
+        server.wait()
+
+
+def drive(args):
+    """Send requests over one keep-alive connection until the deadline; returns (ok, failed)"""
+    port, path, headers, seconds = args
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    ok = failed = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        try:
+            connection.request("GET", path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            connection.close()
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            continue
+        if response.status == 200:
+            ok += 1
+        else:
+            failed += 1
+    connection.close()
+    return ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--max-workers", type=int, default=os.cpu_count())
+    parser.add_argument("--clients", type=int, default=os.cpu_count())
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--path", default=f"/api/dashboard?date={date.today().isoformat()}")
+    parser.add_argument("--port", type=int, default=8765)
+    options = parser.parse_args()
+
+    counts = sorted({1, options.max_workers} | {2 ** i for i in range(1, options.max_workers.bit_length())})
+    headers = {}
+    rows = []
+    baseline = None
+    with multiprocessing.Pool(options.clients) as clients:
+        for workers in counts:
+            server = start_server(workers, options.port)
+            try:
+                if not headers and options.path.split("?")[0] not in PUBLIC_PATHS:
+                    username = f"bench{os.getpid()}"
+                    status, body = request(options.port, "POST", "/api/register", {
+                        "username": username, "email": f"{username}@example.com", "password": "secret"
+                    })
+                    if status != 200:
+                        raise RuntimeError(f"register failed with {status}: {body[:200]!r}")
+                    headers = {"Authorization": "Bearer " + json.loads(body)["access_token"]}
+                # Warm every worker's caches and connection pool before timing
+                clients.map(drive, [(options.port, options.path, headers, 1)] * options.clients)
+                results = clients.map(drive, [(options.port, options.path, headers, options.seconds)] * options.clients)
+            finally:
+                stop_server(server)
+
+            ok = sum(result[0] for result in results)
+            failed = sum(result[1] for result in results)
+            throughput = ok / options.seconds
+            baseline = baseline or throughput
+            rows.append((f"{workers} workers", throughput, "req/s"))
+            rows.append((f"{workers} workers speedup", throughput / baseline, "x"))
+            if failed:
+                rows.append((f"{workers} workers failed", failed, "requests"))
+
+    report(f"GET {options.path}, {options.clients} clients", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Per-entry cost of decoding, validating and encoding food and weight entries:
+pydantic models with a model_dump copy, as the write endpoints used before,
+against the msgspec structs body_decoder builds, and FastAPI's
+jsonable_encoder response path against fast_json.
+
+    cd backend && python benchmarks/entry_codec.py
+"""
+
+import json
+from datetime import datetime
+from typing import List
+
+import msgspec
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+# common puts the backend on sys.path and configures the environment first
+from common import per_call, report
+import server
+
+BATCH = 100
+
+
+def food_entry(i):
+    return {"user_id": "", "food_id": str(100000 + i), "food_name": f"Food {i}", "meal_type": "lunch",
+            "servings": 1.5, "calories": 210.0, "protein": 12.5, "carbs": 30.25, "fat": 7.75,
+            "date": "2024-05-01", "timestamp": "2024-05-01T12:30:00"}
+
+
+def weight_entry(i):
+    return {"user_id": "", "weight": 80.5 - i / 10, "date": "2024-05-01"}
+
+
+def decoders(model):
+    """(label, decode) pairs for one body and a batch of bodies of `model`"""
+    one = TypeAdapter(model)
+    many = TypeAdapter(List[model])
+    struct = server.fast_struct(model)
+    fast_one = msgspec.json.Decoder(struct, strict=False)
+    fast_many = msgspec.json.Decoder(List[struct], strict=False)
+    return [
+        ("pydantic", lambda body: one.validate_json(body).model_dump(),
+         lambda body: [item.model_dump() for item in many.validate_json(body)]),
+        ("msgspec", lambda body: msgspec.structs.asdict(fast_one.decode(body)),
+         lambda body: [msgspec.structs.asdict(item) for item in fast_many.decode(body)]),
+    ]
+
+
+def main():
+    for name, model, make in (("FoodEntry", server.FoodEntry, food_entry), ("WeightEntry", server.WeightEntry, weight_entry)):
+        body = json.dumps(make(0)).encode()
+        batch = json.dumps([make(i) for i in range(BATCH)]).encode()
+        rows = []
+        for label, decode_one, decode_many in decoders(model):
+            assert decode_one(body)["date"] == "2024-05-01"
+            rows.append((f"{label} decode + validate, single", per_call(lambda: decode_one(body), number=2000) * 1e6, "us"))
+            rows.append((f"{label} decode + validate, batch of {BATCH}",
+                         per_call(lambda: decode_many(batch), number=50) / BATCH * 1e6, "us"))
+        report(f"{name} per entry", rows)
+
+    # Listings return stored entries, with datetimes, under an "entries" key
+    stored = [{**food_entry(i), "entry_id": f"entry-{i}", "timestamp": datetime(2024, 5, 1, 12, 30)}
+              for i in range(BATCH)]
+    content = {"entries": stored}
+    report(f"Listing encode per entry ({BATCH} entries)", [
+        ("jsonable_encoder + json.dumps",
+         per_call(lambda: json.dumps(jsonable_encoder(content)).encode(), number=50) / BATCH * 1e6, "us"),
+        ("fast_json (msgspec)", per_call(lambda: server.fast_json(content), number=50) / BATCH * 1e6, "us"),
+    ])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Bytes and time per request for the endpoints that take fields=, with every
+field against the small selections a widget would ask for. Responses are
+requested uncompressed so the byte counts are the JSON itself.
+
+    cd backend && python benchmarks/fieldsets.py
+"""
+
+from datetime import date, timedelta
+
+# common puts the backend on sys.path and configures the environment first
+from common import api_client, per_call, register, report
+
+DAYS = 30
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+
+
+def seed(api, headers):
+    first = date(2024, 5, 1)
+    for day in range(DAYS):
+        today = (first + timedelta(days=day)).isoformat()
+        api.post("/api/food-entries/batch", headers=headers, json=[{
+            "user_id": "", "food_id": str(100000 + i), "food_name": f"Food {i}", "meal_type": MEALS[i % 4],
+            "servings": 1.5, "calories": 210.0, "protein": 12.5, "carbs": 30.25, "fat": 7.75, "date": today
+        } for i in range(8)]).raise_for_status()
+        api.post("/api/weight-entries", headers=headers,
+                 json={"user_id": "", "weight": 80 - day / 10, "date": today}).raise_for_status()
+    return today
+
+
+def main():
+    api = api_client()
+    headers = {"Authorization": "Bearer " + register(api, "bench")["access_token"], "Accept-Encoding": "identity"}
+    last_day = seed(api, headers)
+    cases = [
+        ("/api/profile", {}, ["username,daily_calorie_goal"]),
+        ("/api/food-entries", {"date": last_day}, ["calories", "food_name,calories,protein,carbs,fat"]),
+        ("/api/weight-entries", {}, ["weight", "weight,date"]),
+    ]
+
+    for path, params, selections in cases:
+        rows = []
+        for fields in [None] + selections:
+            query = {**params, "fields": fields} if fields else params
+            response = api.get(path, params=query, headers=headers)
+            response.raise_for_status()
+            label = fields or "all fields"
+            rows.append((f"{label} bytes", response.num_bytes_downloaded, "B"))
+            rows.append((f"{label} time", per_call(lambda: api.get(path, params=query, headers=headers),
+                                                   number=100) * 1000, "ms"))
+        report(f"GET {path}", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+One GET /api/groups/{id}/summary against a GET /api/dashboard per member, for
+groups of 10 to 1000 members. Every member has a day of food entries and a
+few weights. mongomock scans a collection for every query, so the absolute
+times overstate an indexed MongoDB; the ratio between the two is the point.
+
+    cd backend && python benchmarks/group_summary.py [--sizes 10,100,1000]
+"""
+
+import argparse
+import time
+import uuid
+from datetime import datetime, timedelta
+
+# common puts the backend on sys.path and configures the environment first
+from common import api_client, per_call, register, report
+import server
+
+DATE = "2024-05-01"
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+
+
+def seed_members(db, count):
+    users, food_entries, weight_entries = [], [], []
+    for i in range(count):
+        user_id = str(uuid.uuid4())
+        users.append({"user_id": user_id, "username": f"member{i:04d}", "email": f"member{i:04d}@example.com",
+                      "password": "", "created_at": datetime(2024, 1, 1), **server.DEFAULT_GOALS})
+        for j in range(6):
+            food_entries.append({
+                "entry_id": str(uuid.uuid4()), "user_id": user_id, "food_id": str(100000 + j),
+                "food_name": f"Food {j}", "meal_type": MEALS[j % 4], "servings": 1.0, "serving_unit": None,
+                "calories": 300.0, "protein": 20.0, "carbs": 35.0, "fat": 9.0, "date": DATE,
+                "timestamp": datetime(2024, 5, 1, 8 + j)
+            })
+        for day in range(3):
+            timestamp = datetime(2024, 5, 1) - timedelta(days=day)
+            weight_entries.append({"entry_id": str(uuid.uuid4()), "user_id": user_id, "weight": 80 - day / 10,
+                                   "date": timestamp.strftime("%Y-%m-%d"), "timestamp": timestamp})
+    server.compute_entries_nutrition(food_entries)
+    db.users.insert_many(users)
+    db.food_entries.insert_many(food_entries)
+    db.weight_entries.insert_many(weight_entries)
+    return users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10,100,1000")
+    options = parser.parse_args()
+    sizes = [int(size) for size in options.sizes.split(",")]
+
+    api = api_client()
+    db = server.db
+    coach = {"Authorization": "Bearer " + register(api, "coach")["access_token"]}
+    coach_id = db.users.find_one({"username": "coach"})["user_id"]
+    members = seed_members(db, max(sizes))
+    member_headers = [{"Authorization": "Bearer " + server.issue_tokens(user["username"], user["user_id"])["access_token"]}
+                      for user in members]
+
+    rows = []
+    for size in sizes:
+        group_id = str(uuid.uuid4())
+        db.groups.insert_one({"group_id": group_id, "name": f"Group of {size}", "coach_id": coach_id,
+                              "member_ids": [user["user_id"] for user in members[:size]], "invited_ids": [],
+                              "created_at": datetime.now()})
+        summary = api.get(f"/api/groups/{group_id}/summary", params={"date": DATE}, headers=coach)
+        summary.raise_for_status()
+        assert len(summary.json()["members"]) == size
+
+        one_call = per_call(lambda: api.get(f"/api/groups/{group_id}/summary", params={"date": DATE}, headers=coach),
+                            number=1, repeat=3)
+        started = time.perf_counter()
+        for headers in member_headers[:size]:
+            api.get("/api/dashboard", params={"date": DATE}, headers=headers).raise_for_status()
+        per_member = time.perf_counter() - started
+
+        rows += [
+            (f"{size} members, one summary", one_call * 1000, "ms"),
+            (f"{size} members, a dashboard each", per_member * 1000, "ms"),
+            (f"{size} members, summary per member", one_call / size * 1000, "ms"),
+        ]
+    report("Group summary against per-member dashboards", rows)
+
+
+if __name__ == "__main__":
+    main()
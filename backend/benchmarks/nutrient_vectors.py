@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Cost of tracking all nutrients with packed vectors against plain fields:
+BSON bytes per stored entry, and the time to total a day, a month and a year
+of entries. "4 macros" is the layout entries had before the vectors, "30
+fields" is what tracking every nutrient as named fields would look like.
+
+    cd backend && python benchmarks/nutrient_vectors.py
+"""
+
+import random
+from datetime import date, timedelta
+
+import bson
+from bson.binary import Binary
+
+# common puts the backend on sys.path and configures the environment first
+from common import per_call, report
+import server
+
+MACROS = server.NUTRIENT_FIELDS[:4]
+ENTRIES_PER_DAY = 8
+
+
+def make_entries(days):
+    random.seed(days)
+    first = date(2024, 1, 1)
+    entries = []
+    for day in range(days):
+        for i in range(ENTRIES_PER_DAY):
+            values = [round(random.uniform(0, 200), 2) for _ in server.NUTRIENT_FIELDS]
+            entries.append({
+                "entry_id": f"{day}-{i}", "user_id": "user", "food_id": str(100000 + i), "food_name": f"Food {i}",
+                "meal_type": "lunch", "servings": 1.0, "date": (first + timedelta(days=day)).isoformat(),
+                "values": values
+            })
+    return entries
+
+
+def layouts(entries):
+    """The same entries stored as 4 macros, 30 named fields, and the packed vector the app stores"""
+    def base(entry):
+        return {key: value for key, value in entry.items() if key != "values"}
+    macros = [{**base(entry), **dict(zip(MACROS, entry["values"]))} for entry in entries]
+    fields = [{**base(entry), **dict(zip(server.NUTRIENT_FIELDS, entry["values"]))} for entry in entries]
+    vectors = [{**base(entry), **dict(zip(server.SUMMARY_NUTRIENT_FIELDS, entry["values"])),
+                "nutrients": Binary(server.pack_nutrients(entry["values"]))} for entry in entries]
+    return macros, fields, vectors
+
+
+def sum_fields(entries, names):
+    # The per-field loop the totals used before the vectors
+    totals = {name: 0.0 for name in names}
+    for entry in entries:
+        for name in names:
+            totals[name] += entry.get(name) or 0
+    return {name: round(value, 2) for name, value in totals.items()}
+
+
+def sum_fields_by_date(entries, names):
+    days = {}
+    for entry in entries:
+        days.setdefault(entry["date"], []).append(entry)
+    return {day: sum_fields(day_entries, names) for day, day_entries in days.items()}
+
+
+def main():
+    macros, fields, vectors = layouts(make_entries(1))
+    report("BSON bytes per entry", [
+        ("4 macros", len(bson.encode(macros[0])), "B"),
+        ("30 fields", len(bson.encode(fields[0])), "B"),
+        ("packed vector", len(bson.encode(vectors[0])), "B"),
+    ])
+
+    for label, days in (("day", 1), ("month", 30), ("year", 365)):
+        macros, fields, vectors = layouts(make_entries(days))
+        number = max(10, 3000 // days)
+        rows = [
+            ("4 macros, field loop", per_call(lambda: sum_fields(macros, MACROS), number) * 1e6, "us"),
+            ("30 fields, field loop", per_call(lambda: sum_fields(fields, server.NUTRIENT_FIELDS), number) * 1e6, "us"),
+            ("packed vector, sum_nutrients", per_call(lambda: server.sum_nutrients(vectors), number) * 1e6, "us"),
+        ]
+        if days > 1:
+            rows += [
+                ("30 fields, per-date field loop",
+                 per_call(lambda: sum_fields_by_date(fields, server.NUTRIENT_FIELDS), number) * 1e6, "us"),
+                ("packed vector, sum_nutrients_by_date",
+                 per_call(lambda: server.sum_nutrients_by_date(vectors), number) * 1e6, "us"),
+            ]
+        report(f"Totals for a {label} ({days * ENTRIES_PER_DAY} entries)", rows)
+
+    # The vectors are float32, so check the totals agree with the float64 field sums
+    year = server.sum_nutrients(vectors)
+    exact = sum_fields(fields, server.NUTRIENT_FIELDS)
+    worst = max(abs(year[name] - exact[name]) / max(exact[name], 1) for name in server.NUTRIENT_FIELDS)
+    report("float32 vs float64 totals", [("largest relative error", worst * 1e6, "ppm")])
+
+
+if __name__ == "__main__":
+    main()
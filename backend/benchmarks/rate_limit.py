@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Cost of the rate limiter: one token bucket check on its own, the client
+identity lookup, and a rate-limited request with the limiter on and off.
+Set RATE_LIMIT_REDIS_URL to time the shared Redis buckets as well.
+
+    cd backend && python benchmarks/rate_limit.py
+"""
+
+import asyncio
+import os
+
+# common puts the backend on sys.path and configures the environment first
+from common import api_client, per_call, report
+from starlette.requests import Request
+import server
+
+
+def main():
+    api = api_client()
+    loop = asyncio.new_event_loop()
+    memory = server.MemoryTokenBuckets()
+    request = Request({"type": "http", "method": "POST", "path": "/api/token/refresh", "client": ("10.0.0.1", 1234),
+                       "headers": [(b"x-forwarded-for", b"203.0.113.7, 10.0.0.2")]})
+
+    rows = [
+        ("MemoryTokenBuckets.take", per_call(lambda: loop.run_until_complete(
+            memory.take("bench", 10 ** 9, 1)), number=10000) * 1e6, "us"),
+        ("rate_limit_identity (ip)", per_call(lambda: server.rate_limit_identity(request, "ip"),
+                                              number=10000) * 1e6, "us"),
+    ]
+    if os.getenv("RATE_LIMIT_REDIS_URL"):
+        shared = server.RedisTokenBuckets(os.environ["RATE_LIMIT_REDIS_URL"])
+        rows.append(("RedisTokenBuckets.take", per_call(lambda: loop.run_until_complete(
+            shared.take("bench", 10 ** 9, 1)), number=1000) * 1e6, "us"))
+
+    # An invalid refresh token fails before any database work, leaving the limiter as most of the request
+    server.RATE_LIMIT_POLICIES["/api/token/refresh"] = [("ip", 10 ** 9, 1)]
+    refresh = lambda: api.post("/api/token/refresh", json={"refresh_token": "invalid"})
+    for enabled in (False, True):
+        server.RATE_LIMIT_ENABLED = enabled
+        rows.append((f"POST /api/token/refresh, limiter {'on' if enabled else 'off'}",
+                     per_call(refresh, number=500) * 1e6, "us"))
+
+    report("Per call", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Working set before and after retention compacts a year of entries into daily
+rollups: documents, BSON bytes and index keys per collection, plus the size of
+the gzip archive the raw entries move to. mongomock scans a collection for
+every query, so the compaction time only means something against MongoDB.
+
+    cd backend && python benchmarks/retention.py [--users 5] [--days 120] [--keep-days 30]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import bson
+
+# common puts the backend on sys.path and configures the environment first
+from common import report, use_mongomock
+import server
+
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+COLLECTIONS = ("food_entries", "weight_entries", "daily_rollups")
+
+
+def seed(db, users, days, entries_per_day):
+    today = datetime.now()
+    for user in range(users):
+        food_entries, weight_entries = [], []
+        for day in range(days):
+            timestamp = today - timedelta(days=day)
+            date = timestamp.strftime("%Y-%m-%d")
+            for i in range(entries_per_day):
+                food_entries.append({
+                    "entry_id": str(uuid.uuid4()), "user_id": f"user-{user}", "food_id": str(100000 + i),
+                    "food_name": f"Food {i}", "meal_type": MEALS[i % 4], "servings": 1.5, "serving_unit": None,
+                    "calories": 210.0, "protein": 12.5, "carbs": 30.25, "fat": 7.75, "date": date,
+                    "timestamp": timestamp
+                })
+            weight_entries.append({"entry_id": str(uuid.uuid4()), "user_id": f"user-{user}",
+                                   "weight": 80 - day / 100, "date": date, "timestamp": timestamp})
+        server.compute_entries_nutrition(food_entries)
+        db.food_entries.insert_many(food_entries)
+        db.weight_entries.insert_many(weight_entries)
+
+
+def working_set(db):
+    sizes = {}
+    for name in COLLECTIONS:
+        docs = list(db[name].find())
+        sizes[name] = (len(docs), sum(len(bson.encode(doc)) for doc in docs),
+                       len(docs) * len(db[name].index_information()))
+    return sizes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=5)
+    parser.add_argument("--days", type=int, default=120)
+    parser.add_argument("--entries-per-day", type=int, default=6)
+    parser.add_argument("--keep-days", type=int, default=30)
+    options = parser.parse_args()
+
+    db = use_mongomock()
+    seed(db, options.users, options.days, options.entries_per_day)
+    before = working_set(db)
+
+    with tempfile.TemporaryDirectory() as archive_dir:
+        server.RETENTION_DAYS = options.keep_days
+        server.RETENTION_ARCHIVE_DIR = archive_dir
+        started = time.perf_counter()
+        server.run_retention()
+        elapsed = time.perf_counter() - started
+        archive_bytes = sum(os.path.getsize(os.path.join(archive_dir, name)) for name in os.listdir(archive_dir))
+    after = working_set(db)
+
+    for label, column, unit in (("Documents", 0, "docs"), ("BSON bytes", 1, "KiB"), ("Index keys", 2, "keys")):
+        scale = 1024 if unit == "KiB" else 1
+        rows = [(f"{name} {when}", sizes[name][column] / scale, unit)
+                for name in COLLECTIONS for when, sizes in (("before", before), ("after", after))]
+        rows += [(f"total {when}", sum(size[column] for size in sizes.values()) / scale, unit)
+                 for when, sizes in (("before", before), ("after", after))]
+        report(f"{label}, {options.users} users x {options.days} days, keeping {options.keep_days}", rows)
+    report("Compaction", [("run_retention", elapsed, "s"), ("archive on disk", archive_bytes / 1024, "KiB")])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Compare a login, which verifies the password with bcrypt, to a token refresh,
+which only checks the refresh token's HMAC signature and the denylist.
+
+    cd backend && python benchmarks/token_refresh.py
+"""
+
+from jose import jwt
+
+# common puts the backend on sys.path and configures the environment first
+from common import api_client, per_call, register, report
+import server
+
+
+def main():
+    api = api_client()
+    register(api, "bench")
+    password_hash = server.get_password_hash("secret")
+    tokens = server.issue_tokens("bench", "user-id")
+
+    def refresh():
+        # Each refresh token is single-use, so every call spends the one the last call returned
+        response = api.post("/api/token/refresh", json={"refresh_token": refresh.token})
+        refresh.token = response.json()["refresh_token"]
+    refresh.token = api.post("/api/login", json={"username": "bench", "password": "secret"}).json()["refresh_token"]
+
+    report("Per call", [
+        ("bcrypt verify", per_call(lambda: server.verify_password("secret", password_hash), number=5) * 1000, "ms"),
+        ("JWT HMAC decode", per_call(lambda: jwt.decode(tokens["refresh_token"], server.SECRET_KEY,
+                                                        algorithms=[server.ALGORITHM]), number=1000) * 1000, "ms"),
+        ("POST /api/login", per_call(lambda: api.post("/api/login", json={"username": "bench", "password": "secret"}),
+                                     number=5) * 1000, "ms"),
+        ("POST /api/token/refresh", per_call(refresh, number=50) * 1000, "ms"),
+    ])
+
+
+if __name__ == "__main__":
+    main()
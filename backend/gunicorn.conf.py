@@ -0,0 +1,31 @@
+# Production server profile: gunicorn -c gunicorn.conf.py server:app
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8001')}"
+
+# One worker per core; uvicorn picks uvloop and httptools when they are installed
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Push events published on one worker only reach streams on other workers through
+# Redis; without it, turn the streams off rather than silently drop events
+if workers > 1 and not os.environ.get("EVENTS_REDIS_URL"):
+    print("EVENTS_REDIS_URL is not set; disabling /api/events for multiple workers")
+    os.environ["EVENTS_ENABLED"] = "false"
+
+# Import the app once in the master. The MongoDB client is created lazily and
+# dropped on fork, so every worker opens its own connection pool on startup.
+preload_app = True
+
+# On SIGTERM, stop accepting and give in-flight requests time to finish before
+# the shutdown hooks drain the job outbox
+graceful_timeout = int(os.environ.get("GRACEFUL_TIMEOUT", "30"))
+timeout = int(os.environ.get("WORKER_TIMEOUT", "60"))
+keepalive = 5
+
+# Recycle workers periodically to bound memory growth from in-process caches
+max_requests = int(os.environ.get("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.environ.get("MAX_REQUESTS_JITTER", "1000"))
+
+accesslog = "-"
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Import the USDA FoodData Central Branded Foods JSON dump into the foods collection.
+
+The barcode endpoint then answers from the local hashed GTIN index without
+calling FDC. Download the "Branded" JSON file from
+https://fdc.nal.usda.gov/download-datasets.html and run:
+
+    python import_branded_foods.py FoodData_Central_branded_food_json_<date>.json
+
+Install ijson to stream the multi-gigabyte dump instead of loading it whole.
+"""
+
+import json
+import sys
+import time
+
+from server import ensure_indexes, food_document, store_food_documents
+
+BATCH_SIZE = 1000
+
+def iter_branded_foods(path):
+    try:
+        import ijson
+    except ImportError:
+        print("⚠️  ijson not installed, loading the whole dump into memory")
+        with open(path) as f:
+            yield from json.load(f)["BrandedFoods"]
+        return
+
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "BrandedFoods.item", use_float=True)
+
+def import_branded_foods(path):
+    ensure_indexes()
+    started = time.perf_counter()
+    imported = 0
+    batch = []
+
+    for food in iter_branded_foods(path):
+        batch.append(food_document(food))
+        if len(batch) >= BATCH_SIZE:
+            store_food_documents(batch)
+            imported += len(batch)
+            batch = []
+            elapsed = time.perf_counter() - started
+            print(f"⏳ {imported} foods imported ({imported / elapsed:.0f} foods/s)", end="\r")
+
+    if batch:
+        store_food_documents(batch)
+        imported += len(batch)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Imported {imported} branded foods in {elapsed:.1f}s ({imported / max(elapsed, 1e-9):.0f} foods/s)")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    import_branded_foods(sys.argv[1])
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Shard the FitTracker collections on hashed user_id and check query targeting.
+
+Run against a mongos once the cluster is up:
+
+    python shard_setup.py             # shard collections and backfill user_lookup
+    python shard_setup.py --backfill  # only backfill user_lookup, e.g. on an unsharded deployment
+    python shard_setup.py --explain   # explain the hot-path queries for one user
+
+Unique indexes that do not start with the shard key block sharding, so the
+old username, email and entry_id indexes are dropped first. Their uniqueness
+now comes from user_lookup and the (user_id, entry_id) indexes. After the
+backfill, set USER_LOOKUP_FALLBACK=false so unknown usernames no longer
+query every shard.
+
+--explain exits non-zero if any query is routed to more than one shard.
+tests/test_sharding.py runs the same check against a scratch database when
+MONGOS_URL is set.
+"""
+
+import sys
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from server import SHARD_KEYS, USER_LOOKUP_FIELDS, ensure_indexes, get_database
+
+UNTARGETED_UNIQUE_INDEXES = {
+    "users": ("username_1", "email_1"),
+    "food_entries": ("entry_id_1",),
+    "weight_entries": ("entry_id_1",)
+}
+BATCH_SIZE = 1000
+
+def shard_collections():
+    db = get_database()
+    admin = db.client.admin
+    admin.command("enableSharding", db.name)
+    for collection, indexes in UNTARGETED_UNIQUE_INDEXES.items():
+        for name in indexes:
+            try:
+                db[collection].drop_index(name)
+                print(f"🗑️  Dropped {collection}.{name}")
+            except OperationFailure:
+                pass
+    ensure_indexes(legacy_user_indexes=False)
+
+    for collection, key in SHARD_KEYS.items():
+        db[collection].create_index(list(key.items()))
+        admin.command("shardCollection", f"{db.name}.{collection}", key=key)
+        print(f"✅ Sharded {collection} on {key}")
+
+def backfill_user_lookup():
+    db = get_database()
+    writes = []
+    count = 0
+    for user in db.users.find({}, {"_id": 0, "user_id": 1, **{field: 1 for field in USER_LOOKUP_FIELDS}}):
+        for field in USER_LOOKUP_FIELDS:
+            writes.append(UpdateOne({"_id": f"{field}:{user[field]}"},
+                                    {"$setOnInsert": {"user_id": user["user_id"]}}, upsert=True))
+        count += 1
+        if len(writes) >= BATCH_SIZE:
+            db.user_lookup.bulk_write(writes, ordered=False)
+            writes = []
+    if writes:
+        db.user_lookup.bulk_write(writes, ordered=False)
+    print(f"✅ Backfilled user_lookup for {count} users")
+
+def hot_path_queries(user_id, username):
+    """(collection, command) pairs mirroring the filters the API issues per request"""
+    return [
+        ("user_lookup", {"find": "user_lookup", "filter": {"_id": f"username:{username}"}}),
+        ("users", {"find": "users", "filter": {"user_id": user_id}}),
+        ("food_entries", {"find": "food_entries", "filter": {"user_id": user_id, "date": "2024-01-01"}}),
+        ("food_entries", {"find": "food_entries",
+                          "filter": {"user_id": user_id, "date": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}}),
+        ("food_entries", {"delete": "food_entries",
+                          "deletes": [{"q": {"entry_id": "x", "user_id": user_id}, "limit": 1}]}),
+        ("weight_entries", {"find": "weight_entries", "filter": {"user_id": user_id},
+                            "sort": {"timestamp": -1}, "limit": 30}),
+        ("weight_entries", {"update": "weight_entries", "updates": [
+            {"q": {"entry_id": "x", "user_id": user_id}, "u": {"$setOnInsert": {"weight": 0}}, "upsert": True}
+        ]}),
+        ("saved_meals", {"find": "saved_meals", "filter": {"user_id": user_id}}),
+        ("food_suggestions", {"find": "food_suggestions", "filter": {"user_id": user_id}}),
+        ("goal_history", {"find": "goal_history", "filter": {"user_id": user_id, "effective_date": {"$lte": "2024-01-01"}},
+                          "sort": {"effective_date": -1}, "limit": 1}),
+        ("daily_rollups", {"find": "daily_rollups",
+                           "filter": {"user_id": user_id, "date": {"$gte": "2024-01-01", "$lte": "2024-01-31"}}})
+    ]
+
+def explain_targeting(db, command):
+    """(winning plan stage, number of shards) mongos would route a command to"""
+    plan = db.command("explain", command, verbosity="queryPlanner")["queryPlanner"]["winningPlan"]
+    return plan.get("stage"), len(plan.get("shards", []))
+
+def explain_hot_paths():
+    db = get_database()
+    user = db.users.find_one({}, {"_id": 0, "user_id": 1, "username": 1})
+    if user is None:
+        print("⚠️  No users to explain queries for")
+        return True
+
+    targeted = True
+    for collection, command in hot_path_queries(user["user_id"], user["username"]):
+        stage, shards = explain_targeting(db, command)
+        single = stage == "SINGLE_SHARD" or shards == 1
+        targeted = targeted and single
+        print(f"{'✅' if single else '❌'} {collection} {list(command)[0]}: {stage} ({shards} shards)")
+    return targeted
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["--explain"]:
+        sys.exit(0 if explain_hot_paths() else 1)
+    if sys.argv[1:] == ["--backfill"]:
+        backfill_user_lookup()
+        sys.exit(0)
+    if sys.argv[1:]:
+        print(__doc__)
+        sys.exit(1)
+    shard_collections()
+    backfill_user_lookup()
@@ -0,0 +1,44 @@
+import os
+import sys
+
+# Read by server at import time; the real .env must not point tests at a live database
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+os.environ.setdefault("MONGO_QUERY_HINTS", "false")
+os.environ.setdefault("CHANGE_STREAMS_ENABLED", "false")
+os.environ.setdefault("MONGO_TRANSACTIONS", "false")
+os.environ["USDA_API_KEY"] = ""
+os.environ["MONGO_URL"] = "mongodb://localhost:27017"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import mongomock
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+
+
+@pytest.fixture
+def db(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client.fittracker)
+    server.ensure_indexes()
+    return client.fittracker
+
+
+@pytest.fixture
+def api(db):
+    # Not used as a context manager, so startup hooks (warm-up, runners) stay off
+    return TestClient(server.app)
+
+
+@pytest.fixture
+def register(api):
+    def register(username, **fields):
+        response = api.post("/api/register", json={
+            "username": username, "email": f"{username}@example.com", "password": "secret", **fields
+        })
+        assert response.status_code == 200, response.text
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+    return register
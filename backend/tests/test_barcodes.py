@@ -0,0 +1,35 @@
+import pytest
+
+import server
+
+
+@pytest.mark.parametrize("code, expected", [
+    ("041196891072", "00041196891072"),   # UPC-A
+    ("4006381333931", "04006381333931"),  # EAN-13
+    ("96385074", "00000096385074"),       # EAN-8
+    ("04252614", "00042100005264"),       # UPC-E of 042100005264
+    ("0123", None),
+])
+def test_normalize_gtin(code, expected):
+    assert server.normalize_gtin(code) == expected
+
+
+@pytest.mark.parametrize("code, printed", [
+    ("041196891072", "041196891072"),
+    ("4006381333931", "4006381333931"),
+    ("96385074", "96385074"),
+    ("04252614", "042100005264"),
+])
+def test_fdc_search_keeps_meaningful_leading_zeros(monkeypatch, code, printed):
+    queries = []
+
+    class Response:
+        status_code = 200
+
+        def json(self):
+            return {"foods": []}
+
+    monkeypatch.setattr(server.requests, "get", lambda url, params, timeout: (queries.append(params["query"]), Response())[1])
+
+    assert server.fetch_fdc_food_by_gtin(server.normalize_gtin(code)) is None
+    assert queries == [printed]
@@ -0,0 +1,118 @@
+import os
+import time
+import uuid
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+
+import server
+
+BANANA = {"entry_id": "e1", "food_id": "123456", "food_name": "Banana, raw",
+          "calories": 89, "protein": 1.1, "carbs": 22.8, "fat": 0.3}
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    monkeypatch.setattr(server, "CHANGE_STREAMS_ENABLED", True)
+    for name in ("user_cache", "user_cache_ids", "food_suggestion_cache", "food_suggestion_cache_ids"):
+        monkeypatch.setattr(server, name, {})
+
+
+def change(collection, document_id):
+    # The watcher's pipeline projects events down to these two fields
+    return {"ns": {"db": "fittracker", "coll": collection}, "documentKey": {"_id": document_id}}
+
+
+def add_user(db, username):
+    user_id = str(uuid.uuid4())
+    db.users.insert_one({"user_id": user_id, "username": username, "email": f"{username}@example.com",
+                         "password": "", "daily_calorie_goal": 2000})
+    return user_id
+
+
+def test_user_change_evicts_only_that_user(db, caches):
+    ada, bob = add_user(db, "ada"), add_user(db, "bob")
+    server.find_cached_user(ada)
+    server.find_cached_user(bob)
+    document_id = db.users.find_one({"user_id": ada})["_id"]
+    assert server.user_cache_ids[document_id] == ada
+
+    db.users.update_one({"user_id": ada}, {"$set": {"daily_calorie_goal": 1800}})
+    assert server.find_cached_user(ada)["daily_calorie_goal"] == 2000
+
+    server.CacheInvalidationWatcher().apply(change("users", document_id))
+
+    assert ada not in server.user_cache and document_id not in server.user_cache_ids
+    assert bob in server.user_cache
+    assert server.find_cached_user(ada)["daily_calorie_goal"] == 1800
+
+
+def test_unknown_document_leaves_caches_alone(db, caches):
+    ada = add_user(db, "ada")
+    server.find_cached_user(ada)
+
+    server.CacheInvalidationWatcher().apply(change("users", "not-cached"))
+
+    assert ada in server.user_cache
+
+
+def test_food_suggestion_change_evicts_the_user(db, caches):
+    server.record_food_suggestions("u1", [BANANA])
+    document_id = db.food_suggestions.find_one({"user_id": "u1"})["_id"]
+    assert server.food_suggestion_cache_ids[document_id] == "u1"
+
+    db.food_suggestions.update_one({"user_id": "u1"}, {"$set": {"foods.123456.food_name": "Banana"}})
+    server.CacheInvalidationWatcher().apply(change("food_suggestions", document_id))
+
+    assert "u1" not in server.food_suggestion_cache and document_id not in server.food_suggestion_cache_ids
+    assert [food["food_name"] for food in server.get_food_suggestions("u1")] == ["Banana"]
+
+
+def test_lost_history_clears_every_cache(db, caches, monkeypatch):
+    server.find_cached_user(add_user(db, "ada"))
+    server.record_food_suggestions("u1", [BANANA])
+    watcher = server.CacheInvalidationWatcher()
+    watcher.resume_token = {"_data": "expired"}
+
+    def watch():
+        watcher.stopping.set()
+        raise OperationFailure("Resume point no longer in the oplog", code=server.CHANGE_STREAM_HISTORY_LOST)
+    monkeypatch.setattr(watcher, "watch", watch)
+    watcher.run()
+
+    assert watcher.resume_token is None
+    assert server.user_cache == {} and server.user_cache_ids == {}
+    assert server.food_suggestion_cache == {} and server.food_suggestion_cache_ids == {}
+
+
+@pytest.mark.skipif(not os.getenv("MONGO_REPLICA_SET_URL"),
+                    reason="set MONGO_REPLICA_SET_URL to a replica set to test real change streams")
+def test_watcher_follows_a_replica_set(caches, monkeypatch):
+    client = MongoClient(os.environ["MONGO_REPLICA_SET_URL"], serverSelectionTimeoutMS=5000)
+    db = client[f"fittracker_test_{uuid.uuid4().hex[:8]}"]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", db)
+    watcher = server.CacheInvalidationWatcher()
+    try:
+        ada = add_user(db, "ada")
+        server.find_cached_user(ada)
+        watcher.start()
+        # Changes made before the stream opens are not delivered
+        deadline = time.monotonic() + 10
+        while watcher.resume_token is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert watcher.resume_token is not None
+
+        db.users.update_one({"user_id": ada}, {"$set": {"daily_calorie_goal": 1800}})
+        while ada in server.user_cache and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        assert ada not in server.user_cache
+        assert server.find_cached_user(ada)["daily_calorie_goal"] == 1800
+    finally:
+        watcher.stop()
+        if watcher.thread is not None:
+            watcher.thread.join(timeout=5)
+        client.drop_database(db.name)
+        client.close()
@@ -0,0 +1,64 @@
+import pytest
+from starlette.applications import Starlette
+from starlette.responses import PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.testclient import TestClient
+
+import server
+
+
+def negotiate(accept_encoding):
+    middleware = server.CompressionMiddleware(None)
+    return middleware.negotiate({"headers": [(b"accept-encoding", accept_encoding.encode())]})
+
+
+@pytest.fixture(autouse=True)
+def without_brotli(monkeypatch):
+    monkeypatch.setattr(server, "brotli", None)
+
+
+@pytest.mark.parametrize("accept_encoding, expected", [
+    ("gzip, deflate", "gzip"),
+    ("gzip;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip; q=0.0, deflate", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("*, gzip;q=0", None),
+    ("identity", None),
+    ("", None),
+])
+def test_negotiate_respects_q_values(accept_encoding, expected):
+    assert negotiate(accept_encoding) == expected
+
+
+def test_negotiate_prefers_the_higher_weight(monkeypatch):
+    monkeypatch.setattr(server, "brotli", object())
+    assert negotiate("br, gzip") == "br"
+    assert negotiate("br;q=0.5, gzip") == "gzip"
+    assert negotiate("br;q=0, gzip;q=0.1") == "gzip"
+    assert negotiate("br;q=0, gzip;q=0") is None
+
+
+def test_refused_gzip_is_sent_uncompressed():
+    body = "x" * 10000
+    app = Starlette(routes=[Route("/", lambda request: PlainTextResponse(body))])
+    client = TestClient(server.CompressionMiddleware(app))
+
+    refused = client.get("/", headers={"Accept-Encoding": "gzip;q=0"})
+    assert "content-encoding" not in refused.headers
+    assert refused.text == body
+
+    accepted = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert accepted.headers["content-encoding"] == "gzip"
+    assert accepted.text == body
+
+
+def test_small_body_sent_in_several_messages_is_not_compressed():
+    # BaseHTTPMiddleware re-sends every response this way
+    app = Starlette(routes=[Route("/", lambda request: StreamingResponse(iter([b"a" * 100, b"b" * 100])))])
+    client = TestClient(server.CompressionMiddleware(app, minimum_size=1024))
+
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert response.content == b"a" * 100 + b"b" * 100
@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def ticket_for(api, headers):
+    response = api.post("/api/event-ticket", headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["ticket"]
+
+
+def test_stream_ticket_is_single_use(api, db, register):
+    headers = register("gina")
+    ticket = ticket_for(api, headers)
+
+    user = asyncio.run(server.get_current_user_from_ticket(ticket))
+    assert user["username"] == "gina"
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(server.get_current_user_from_ticket(ticket))
+    assert error.value.status_code == 401
+
+
+def test_tickets_and_access_tokens_are_not_interchangeable(api, db, register):
+    headers = register("hank")
+    ticket = ticket_for(api, headers)
+    access_token = headers["Authorization"].split()[1]
+
+    with pytest.raises(HTTPException):
+        asyncio.run(server.get_current_user_from_ticket(access_token))
+    response = api.get("/api/dashboard", params={"date": "2024-05-01"},
+                       headers={"Authorization": f"Bearer {ticket}"})
+    assert response.status_code == 401
+
+
+def publish_rate(idle_streams, events=2000):
+    """Events per second delivered to one open stream while `idle_streams` others stay idle"""
+    async def scenario():
+        broker = server.EventBroker()
+        await broker.start()
+        for i in range(idle_streams):
+            broker.subscribe(f"idle-{i}")
+        queue = broker.subscribe("active")
+
+        received = 0
+        started = time.perf_counter()
+        for i in range(events):
+            broker.publish("active", {"type": "weight_entry", "n": i})
+            await asyncio.sleep(0)
+            while not queue.empty():
+                queue.get_nowait()
+                received += 1
+        elapsed = time.perf_counter() - started
+        assert received == events
+        assert all(queue.empty() for user_id, queues in broker.subscribers.items()
+                   if user_id != "active" for queue in queues)
+        return events / elapsed
+
+    return asyncio.run(scenario())
+
+
+def test_fan_out_throughput_ignores_idle_streams():
+    baseline = publish_rate(0)
+    crowded = publish_rate(5000)
+
+    # Delivery touches only the target user's queues, so thousands of idle
+    # connections leave throughput within noise of the empty broker
+    assert crowded > baseline / 3, f"{crowded:.0f} events/s with 5000 idle streams vs {baseline:.0f} without"
@@ -0,0 +1,24 @@
+import server
+
+BANANA = {"entry_id": "e1", "food_id": "123456", "food_name": "Banana, raw",
+          "calories": 89, "protein": 1.1, "carbs": 22.8, "fat": 0.3}
+
+
+def test_suggestions_written_by_another_worker_are_seen(db):
+    assert server.get_food_suggestions("u1") == []
+
+    server.record_food_suggestions("u1", [BANANA])
+    # Another worker updates them; without change streams nothing tells this one
+    db.food_suggestions.update_one({"user_id": "u1"}, {"$set": {"foods.123456.food_name": "Banana"}})
+
+    assert [food["food_name"] for food in server.get_food_suggestions("u1")] == ["Banana"]
+    assert server.food_suggestion_cache == {}
+
+
+def test_suggestions_cached_while_change_streams_invalidate(db, monkeypatch):
+    monkeypatch.setattr(server, "CHANGE_STREAMS_ENABLED", True)
+    monkeypatch.setattr(server, "food_suggestion_cache", {})
+    monkeypatch.setattr(server, "food_suggestion_cache_ids", {})
+    server.record_food_suggestions("u2", [BANANA])
+
+    assert [food["food_name"] for food in server.food_suggestion_cache["u2"]] == ["Banana, raw"]
@@ -0,0 +1,132 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+import server
+
+SLOTS = 4
+
+
+class SlowApp:
+    """Inner ASGI app that holds every request until released"""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.deadlines = []
+
+    async def __call__(self, scope, receive, send):
+        self.deadlines.append(server.request_deadline.get())
+        await self.release.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def request(app, path):
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        messages.append(message)
+
+    scope = {"type": "http", "method": "GET", "path": path, "raw_path": path.encode(),
+             "query_string": b"", "headers": []}
+    await app(scope, receive, send)
+    start = messages[0]
+    return start["status"], {key.decode(): value.decode() for key, value in start["headers"]}
+
+
+@pytest.fixture
+def shedding(monkeypatch):
+    monkeypatch.setattr(server, "MAX_INFLIGHT_REQUESTS", SLOTS)
+    inner = SlowApp()
+    return inner, server.DeadlineMiddleware(inner)
+
+
+def test_overload_sheds_low_priority_first(shedding):
+    inner, middleware = shedding
+
+    async def scenario():
+        async def start(path):
+            task = asyncio.create_task(request(middleware, path))
+            # Let it reach the inner app, or be rejected, before the next one arrives
+            await asyncio.sleep(0)
+            return task
+
+        low = [await start("/api/foods/search") for _ in range(3)]
+        critical = [await start("/api/dashboard") for _ in range(3)]
+        normal = await start("/api/meals")
+        inner.release.set()
+        return ([await task for task in low], [await task for task in critical], await normal)
+
+    low, critical, normal = asyncio.run(scenario())
+
+    # Low requests may use half of the slots, the third one is shed at once
+    assert [status for status, _ in low] == [200, 200, 503]
+    assert low[2][1]["retry-after"] == "1"
+    # Critical requests still get the remaining slots, up to all of them
+    assert [status for status, _ in critical] == [200, 200, 503]
+    # Normal requests stop at three quarters, which the critical ones already filled
+    assert normal[0] == 503
+    assert middleware.inflight == 0
+
+
+def test_budget_follows_priority_class(shedding):
+    inner, middleware = shedding
+    inner.release.set()
+
+    async def scenario():
+        await request(middleware, "/api/foods/search")
+        await request(middleware, "/api/dashboard")
+
+    asyncio.run(scenario())
+
+    low_deadline, critical_deadline = inner.deadlines
+    assert critical_deadline - low_deadline == pytest.approx(server.REQUEST_DEADLINE_SECONDS / 2, abs=0.5)
+    assert server.request_deadline.get() is None
+
+
+def test_exempt_paths_bypass_shedding(shedding):
+    inner, middleware = shedding
+    middleware.inflight = SLOTS
+
+    async def scenario():
+        inner.release.set()
+        return await request(middleware, "/api/health")
+
+    status, _ = asyncio.run(scenario())
+
+    assert status == 200
+    assert inner.deadlines == [None]
+
+
+class SlowUsdaResponse:
+    status_code = 200
+
+    def json(self):
+        return {"foods": []}
+
+
+def test_slow_search_does_not_hold_back_the_dashboard(monkeypatch, register):
+    headers = register("busy")
+    monkeypatch.setattr(server, "USDA_API_KEY", "key")
+    monkeypatch.setattr(server.requests, "get", lambda *args, **kwargs: (time.sleep(0.5), SlowUsdaResponse())[1])
+
+    async def scenario():
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test", headers=headers) as client:
+            started = time.monotonic()
+            search = asyncio.create_task(client.get("/api/foods/search", params={"query": "apple"}))
+            await asyncio.sleep(0.1)
+            dashboard = await client.get("/api/dashboard", params={"date": "2024-05-01"})
+            elapsed = time.monotonic() - started
+            return (await search).status_code, dashboard.status_code, elapsed
+
+    search_status, dashboard_status, elapsed = asyncio.run(scenario())
+
+    assert (search_status, dashboard_status) == (200, 200)
+    # The dashboard is answered while the USDA call is still outstanding
+    assert elapsed < 0.4
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from pymongo.errors import OperationFailure
+
+import server
+
+
+@pytest.fixture
+def strict_hints(monkeypatch):
+    """Make hints behave like the server: naming a missing index fails the query"""
+    def hint(cursor, index):
+        keys = [info["key"] for info in cursor.collection.index_information().values()]
+        if list(index) not in keys:
+            raise OperationFailure("hint provided does not correspond to an existing index", code=2)
+        return cursor
+
+    monkeypatch.setattr(mongomock.collection.Cursor, "hint", hint)
+    monkeypatch.setattr(server, "MONGO_QUERY_HINTS", True)
+    monkeypatch.setattr(server, "missing_hint_indexes", set())
+
+
+def add_weights(db, user_id, weights):
+    start = datetime(2024, 5, 1)
+    db.weight_entries.insert_many([
+        {"entry_id": f"w{i}", "user_id": user_id, "weight": weight,
+         "date": (start + timedelta(days=i)).strftime("%Y-%m-%d"), "timestamp": start + timedelta(days=i)}
+        for i, weight in enumerate(weights)
+    ])
+
+
+def test_food_entries_are_projected_for_one_day(db):
+    db.food_entries.insert_many([
+        {"entry_id": "a", "user_id": "u1", "date": "2024-05-01", "food_name": "Apple", "calories": 52},
+        {"entry_id": "b", "user_id": "u1", "date": "2024-05-02", "food_name": "Pear", "calories": 57},
+        {"entry_id": "c", "user_id": "u2", "date": "2024-05-01", "food_name": "Plum", "calories": 46},
+    ])
+
+    entries = server.find_food_entries("u1", "2024-05-01", {"_id": 0, "entry_id": 1, "calories": 1})
+
+    assert entries == [{"entry_id": "a", "calories": 52}]
+
+
+def test_weight_history_is_newest_first_and_limited(db):
+    add_weights(db, "u1", [80, 79.5, 79, 78.4])
+
+    history = server.find_weight_history("u1", limit=3)
+
+    assert [entry["weight"] for entry in history] == [78.4, 79, 79.5]
+    assert all("_id" not in entry for entry in history)
+    assert server.find_latest_weight("u1")["weight"] == 78.4
+    assert server.find_latest_weight("nobody") is None
+
+
+def test_cached_user_never_carries_the_password_hash(db, register):
+    register("frank")
+    user_id = db.users.find_one({"username": "frank"})["user_id"]
+
+    assert "password" not in server.find_cached_user(user_id)
+    assert "password" not in server.find_user(user_id)
+
+
+def test_hinted_reads_use_the_indexes(db, strict_hints):
+    add_weights(db, "u1", [80, 79])
+
+    assert server.find_latest_weight("u1")["weight"] == 79
+    assert server.missing_hint_indexes == set()
+
+
+def test_missing_hint_index_falls_back_to_the_planner(db, strict_hints):
+    # A serverless deploy that skipped ensure_indexes
+    db.weight_entries.drop_indexes()
+    add_weights(db, "u1", [80, 79])
+
+    assert server.find_latest_weight("u1")["weight"] == 79
+    assert ("weight_entries", tuple(server.WEIGHT_ENTRIES_BY_TIME)) in server.missing_hint_indexes
+    # Later reads skip the hint instead of failing first
+    assert [entry["weight"] for entry in server.find_weight_history("u1")] == [79, 80]
@@ -0,0 +1,41 @@
+import os
+import uuid
+
+import pytest
+from pymongo import MongoClient
+
+import server
+import shard_setup
+
+pytestmark = pytest.mark.skipif(not os.getenv("MONGOS_URL"),
+                                reason="set MONGOS_URL to a sharded cluster's mongos to check query targeting")
+
+HOT_PATHS = shard_setup.hot_path_queries("user-id", "username")
+
+
+@pytest.fixture(scope="module")
+def sharded_db():
+    client = MongoClient(os.environ["MONGOS_URL"], serverSelectionTimeoutMS=5000)
+    db = client[f"fittracker_test_{uuid.uuid4().hex[:8]}"]
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(server, "client", client)
+        monkeypatch.setattr(server, "db", db)
+        try:
+            shard_setup.shard_collections()
+            db.users.insert_one({"user_id": str(uuid.uuid4()), "username": "ada", "email": "ada@example.com"})
+            shard_setup.backfill_user_lookup()
+            yield db
+        finally:
+            client.drop_database(db.name)
+            client.close()
+
+
+@pytest.mark.parametrize("index", range(len(HOT_PATHS)),
+                         ids=[f"{collection}-{list(command)[0]}-{i}" for i, (collection, command) in enumerate(HOT_PATHS)])
+def test_hot_path_targets_one_shard(sharded_db, index):
+    user = sharded_db.users.find_one({}, {"_id": 0, "user_id": 1, "username": 1})
+    collection, command = shard_setup.hot_path_queries(user["user_id"], user["username"])[index]
+
+    stage, shards = shard_setup.explain_targeting(sharded_db, command)
+
+    assert stage == "SINGLE_SHARD" or shards == 1, f"{collection} {list(command)[0]} ran as {stage} on {shards} shards"
@@ -0,0 +1,43 @@
+import server
+
+
+def login(api, username):
+    response = api.post("/api/login", json={"username": username, "password": "secret"})
+    assert response.status_code == 200, response.text
+    return response.json()["refresh_token"]
+
+
+def refresh(api, refresh_token):
+    return api.post("/api/token/refresh", json={"refresh_token": refresh_token})
+
+
+def test_reused_refresh_token_revokes_the_session(api, db, register):
+    register("dana")
+    first = login(api, "dana")
+
+    rotated = refresh(api, first)
+    assert rotated.status_code == 200
+
+    # The spent token is replayed, so every token of its family stops working
+    assert refresh(api, first).status_code == 401
+    assert refresh(api, rotated.json()["refresh_token"]).status_code == 401
+
+
+def test_denylist_is_shared_through_mongo(api, db, register):
+    register("erin")
+    refresh_token = login(api, "erin")
+
+    assert api.post("/api/logout", json={"refresh_token": refresh_token}).status_code == 200
+
+    # Another worker or instance sees the revocation through the same collection
+    assert db.token_denylist.count_documents({"_id": {"$regex": "^family:"}}) == 1
+    assert refresh(api, refresh_token).status_code == 401
+
+
+def test_expired_entry_can_be_claimed_again(db):
+    denylist = server.MongoDenylist()
+
+    assert denylist.claim_sync("jti:a", 60)
+    assert not denylist.claim_sync("jti:a", 60)
+    db.token_denylist.update_one({"_id": "jti:a"}, {"$set": {"expires_at": server.datetime(2000, 1, 1)}})
+    assert denylist.claim_sync("jti:a", 60)
@@ -0,0 +1,45 @@
+import uuid
+from datetime import datetime
+
+import server
+
+
+def insert_legacy_user(db, username):
+    """A user as written before user_lookup existed, with no lookup entries"""
+    db.users.insert_one({
+        "user_id": str(uuid.uuid4()), "username": username, "email": f"{username}@example.com",
+        "password": server.get_password_hash("secret"), "created_at": datetime.now()
+    })
+
+
+def test_register_cannot_take_legacy_username(api, db):
+    insert_legacy_user(db, "alice")
+
+    response = api.post("/api/register", json={
+        "username": "alice", "email": "other@example.com", "password": "secret"
+    })
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already registered"
+    assert db.users.count_documents({"username": "alice"}) == 1
+    assert db.user_lookup.count_documents({}) == 0
+    assert api.post("/api/login", json={"username": "alice", "password": "secret"}).status_code == 200
+
+
+def test_profile_cannot_take_legacy_email(api, db, register):
+    insert_legacy_user(db, "bob")
+    headers = register("carol")
+
+    response = api.put("/api/profile", json={
+        "user_id": "ignored", "username": "carol", "email": "bob@example.com"
+    }, headers=headers)
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+    assert db.users.find_one({"username": "carol"})["email"] == "carol@example.com"
+    assert db.user_lookup.count_documents({"_id": "email:bob@example.com"}) == 0
+
+
+def test_legacy_unique_indexes_kept_until_sharding(db):
+    names = set(db.users.index_information())
+    assert {"username_1", "email_1"} <= names
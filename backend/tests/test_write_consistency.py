@@ -0,0 +1,54 @@
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import server
+
+CONCURRENCY = 8
+
+
+def run_concurrently(func, count=CONCURRENCY):
+    with ThreadPoolExecutor(max_workers=count) as pool:
+        return list(pool.map(lambda _: func(), range(count)))
+
+
+def test_concurrent_register_creates_one_user(api, db):
+    responses = run_concurrently(lambda: api.post("/api/register", json={
+        "username": "racer", "email": "racer@example.com", "password": "secret"
+    }))
+
+    statuses = sorted(response.status_code for response in responses)
+    assert statuses == [200] + [400] * (CONCURRENCY - 1)
+    assert db.users.count_documents({"username": "racer"}) == 1
+    user_id = db.users.find_one({"username": "racer"})["user_id"]
+    # Losers release whatever they claimed, so both keys belong to the winner
+    assert sorted(doc["_id"] for doc in db.user_lookup.find({"user_id": user_id})) == [
+        "email:racer@example.com", "username:racer"]
+    assert db.user_lookup.count_documents({}) == 2
+
+
+def test_register_taken_email_releases_username(api, db, register):
+    register("first")
+    response = api.post("/api/register", json={
+        "username": "second", "email": "first@example.com", "password": "secret"
+    })
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Email already registered"
+    assert db.user_lookup.count_documents({"_id": "username:second"}) == 0
+
+
+def test_concurrent_weight_retries_store_one_entry(api, db, register):
+    headers = register("lifter")
+    entry_id = str(uuid.uuid4())
+
+    responses = run_concurrently(lambda: api.post(
+        "/api/weight-entries", json={"user_id": "ignored", "weight": 72.5, "date": "2024-05-01", "entry_id": entry_id}, headers=headers
+    ))
+
+    assert all(response.status_code == 200 for response in responses), [r.text for r in responses]
+    assert all(response.json()["entry_id"] == entry_id for response in responses)
+    assert db.weight_entries.count_documents({"entry_id": entry_id}) == 1
+    # Every retry queues the users.weight update; replaying it is harmless
+    server.job_runner.drain()
+    assert db.users.find_one({"username": "lifter"})["weight"] == 72.5
+
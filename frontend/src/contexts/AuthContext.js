@@ -1,4 +1,4 @@
-import React, { createContext, useContext, useState, useEffect } from 'react';
+import React, { createContext, useContext, useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 
 const AuthContext = createContext();
@@ -14,9 +14,55 @@ export const useAuth = () => {
 export const AuthProvider = ({ children }) => {
   const [user, setUser] = useState(null);
   const [loading, setLoading] = useState(true);
+  // The refresh in flight, shared by every request that failed while it runs
+  const refreshRequest = useRef(null);
 
   const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
 
+  // Swap an expired access token for a new one instead of sending the user back to login.
+  // Refresh tokens are single-use, so concurrent 401s wait for one refresh instead of
+  // each spending the same token, which the server treats as reuse and logs out.
+  useEffect(() => {
+    const interceptor = axios.interceptors.response.use(
+      (response) => response,
+      async (error) => {
+        const original = error.config;
+        const refreshToken = localStorage.getItem('refreshToken');
+        if (error.response?.status !== 401 || !refreshToken || original._retried ||
+            original.url?.endsWith('/api/token/refresh')) {
+          return Promise.reject(error);
+        }
+
+        original._retried = true;
+        try {
+          // A request sent before the last refresh finished only needs the new token
+          let accessToken = localStorage.getItem('authToken');
+          const sentAuthorization = original.headers['Authorization'];
+          if (!sentAuthorization || sentAuthorization === `Bearer ${accessToken}`) {
+            if (!refreshRequest.current) {
+              refreshRequest.current = axios
+                .post(`${API_URL}/api/token/refresh`, { refresh_token: refreshToken })
+                .then((response) => {
+                  storeTokens(response.data);
+                  return response.data.access_token;
+                })
+                .finally(() => {
+                  refreshRequest.current = null;
+                });
+            }
+            accessToken = await refreshRequest.current;
+          }
+          original.headers['Authorization'] = `Bearer ${accessToken}`;
+          return axios(original);
+        } catch (refreshError) {
+          logout();
+          return Promise.reject(error);
+        }
+      }
+    );
+    return () => axios.interceptors.response.eject(interceptor);
+  }, []);
+
   useEffect(() => {
     const token = localStorage.getItem('authToken');
     if (token) {
@@ -55,6 +101,14 @@ export const AuthProvider = ({ children }) => {
     }
   };
 
+  const storeTokens = ({ access_token, refresh_token }) => {
+    localStorage.setItem('authToken', access_token);
+    if (refresh_token) {
+      localStorage.setItem('refreshToken', refresh_token);
+    }
+    axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+  };
+
   const login = async (username, password) => {
     try {
       const response = await axios.post(`${API_URL}/api/login`, {
@@ -62,13 +116,8 @@ export const AuthProvider = ({ children }) => {
         password
       });
 
-      const { access_token } = response.data;
-      
-      // Store token in localStorage
-      localStorage.setItem('authToken', access_token);
-      
-      // Set default authorization header
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+      // Store tokens in localStorage and set default authorization header
+      storeTokens(response.data);
       
       // Fetch user profile
       await fetchUserProfile();
@@ -87,13 +136,8 @@ export const AuthProvider = ({ children }) => {
     try {
       const response = await axios.post(`${API_URL}/api/register`, userData);
       
-      const { access_token } = response.data;
-      
-      // Store token in localStorage
-      localStorage.setItem('authToken', access_token);
-      
-      // Set default authorization header
-      axios.defaults.headers.common['Authorization'] = `Bearer ${access_token}`;
+      // Store tokens in localStorage and set default authorization header
+      storeTokens(response.data);
       
       // Fetch user profile
       await fetchUserProfile();
@@ -109,7 +153,12 @@ export const AuthProvider = ({ children }) => {
   };
 
   const logout = () => {
+    const refreshToken = localStorage.getItem('refreshToken');
+    if (refreshToken) {
+      axios.post(`${API_URL}/api/logout`, { refresh_token: refreshToken }).catch(() => {});
+    }
     localStorage.removeItem('authToken');
+    localStorage.removeItem('refreshToken');
     delete axios.defaults.headers.common['Authorization'];
     setUser(null);
   };
@@ -28,6 +28,94 @@ const DashboardPage = () => {
     fetchDashboardData();
   }, [selectedDate]);
 
+  // Apply pushed changes instead of refetching the whole dashboard
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return;
+
+    let events = null;
+    let retryTimer = null;
+    let failures = 0;
+    let stopped = false;
+
+    const retry = () => {
+      if (stopped || failures >= 5) return;
+      failures += 1;
+      retryTimer = setTimeout(async () => {
+        // Refetching refreshes an expired token and catches up on missed changes
+        await fetchDashboardData();
+        connect();
+      }, 1000 * 2 ** failures);
+    };
+
+    const connect = async () => {
+      // Streams open with a short-lived single-use ticket, so no bearer token
+      // ends up in the URL and the access logs
+      let ticket;
+      try {
+        const response = await axios.post(`${API_URL}/api/event-ticket`);
+        ticket = response.data.ticket;
+      } catch (error) {
+        // 501: this deployment has no push events
+        if (error.response?.status !== 501) retry();
+        return;
+      }
+      if (stopped) return;
+
+      events = new EventSource(`${API_URL}/api/events?ticket=${encodeURIComponent(ticket)}`);
+
+      events.onopen = () => {
+        failures = 0;
+      };
+
+      // EventSource retries dropped connections with the same, now spent, ticket
+      // and gives up on the 401; a new ticket is fetched from here
+      events.onerror = () => {
+        if (events.readyState === EventSource.CLOSED) retry();
+      };
+
+      events.addEventListener('food_entries', (message) => {
+        const event = JSON.parse(message.data);
+        if (event.date !== selectedDate) return;
+
+        setDashboardData((data) => {
+          if (!data) return data;
+          const total_nutrition = { ...data.total_nutrition };
+          Object.keys(event.delta).forEach((key) => {
+            total_nutrition[key] += event.delta[key];
+          });
+          const goals = data.user_goals;
+          return {
+            ...data,
+            total_nutrition,
+            progress: {
+              calories: (total_nutrition.calories / goals.daily_calorie_goal) * 100,
+              protein: (total_nutrition.protein / goals.daily_protein_goal) * 100,
+              carbs: (total_nutrition.carbs / goals.daily_carb_goal) * 100,
+              fat: (total_nutrition.fat / goals.daily_fat_goal) * 100
+            },
+            entries_count: data.entries_count + event.entries_count
+          };
+        });
+      });
+
+      events.addEventListener('weight_entry', (message) => {
+        const event = JSON.parse(message.data);
+        setDashboardData((data) => (data ? { ...data, latest_weight: event.entry } : data));
+      });
+
+      events.addEventListener('resync', () => {
+        fetchDashboardData();
+      });
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (events) events.close();
+    };
+  }, [API_URL, selectedDate]);
+
   const fetchDashboardData = async () => {
     try {
       const response = await axios.get(`${API_URL}/api/dashboard`, {
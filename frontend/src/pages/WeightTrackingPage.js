@@ -1,10 +1,26 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useAuth } from '../contexts/AuthContext';
 import { Scale, Plus, TrendingUp, TrendingDown, Minus } from 'lucide-react';
 import axios from 'axios';
 import toast from 'react-hot-toast';
 import { format } from 'date-fns';
 
+// The backend upserts on entry_id, so resending the same id after a lost response
+// cannot log the weight twice
+const newEntryId = () => {
+  if (window.crypto?.randomUUID) {
+    return window.crypto.randomUUID();
+  }
+  // randomUUID needs a secure context; build a version 4 UUID from random bytes instead
+  const bytes = window.crypto.getRandomValues(new Uint8Array(16));
+  bytes[6] = (bytes[6] & 0x0f) | 0x40;
+  bytes[8] = (bytes[8] & 0x3f) | 0x80;
+  const hex = Array.from(bytes, (byte) => byte.toString(16).padStart(2, '0')).join('');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+};
+
+const MAX_SEND_ATTEMPTS = 3;
+
 const WeightTrackingPage = () => {
   const { API_URL } = useAuth();
   const [weightEntries, setWeightEntries] = useState([]);
@@ -12,6 +28,8 @@ const WeightTrackingPage = () => {
   const [showAddModal, setShowAddModal] = useState(false);
   const [newWeight, setNewWeight] = useState('');
   const [newDate, setNewDate] = useState(format(new Date(), 'yyyy-MM-dd'));
+  // Kept across failed attempts so retrying the same entry reuses its id
+  const pendingEntry = useRef(null);
 
   useEffect(() => {
     fetchWeightEntries();
@@ -39,14 +57,30 @@ const WeightTrackingPage = () => {
       return;
     }
 
+    const weight = parseFloat(newWeight);
+    if (pendingEntry.current?.weight !== weight || pendingEntry.current?.date !== newDate) {
+      pendingEntry.current = { entry_id: newEntryId(), weight, date: newDate };
+    }
+
     try {
       const weightEntry = {
         user_id: '', // Will be set by backend
-        weight: parseFloat(newWeight),
-        date: newDate
+        ...pendingEntry.current
       };
 
-      await axios.post(`${API_URL}/api/weight-entries`, weightEntry);
+      for (let attempt = 1; ; attempt++) {
+        try {
+          await axios.post(`${API_URL}/api/weight-entries`, weightEntry);
+          break;
+        } catch (error) {
+          // Lost responses and server errors are safe to resend under the same entry_id
+          if (error.response?.status < 500 || attempt >= MAX_SEND_ATTEMPTS) {
+            throw error;
+          }
+          await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+        }
+      }
+      pendingEntry.current = null;
       
       toast.success('Weight logged successfully!');
       setShowAddModal(false);